@@ -7,6 +7,8 @@ SERVICE_NAME_FOR_TRACES=""
 DATA_DIR=""
 LIMIT=1
 SAVE_TRACES_JSON=false
+WINDOW_START_US=""
+WINDOW_END_US=""
 
 while [[ $# -gt 0 ]]; do
     case "$1" in
@@ -46,6 +48,14 @@ while [[ $# -gt 0 ]]; do
             SAVE_TRACES_JSON=true
             shift
             ;;
+        --window-start-us)
+            WINDOW_START_US="$2"
+            shift 2
+            ;;
+        --window-end-us)
+            WINDOW_END_US="$2"
+            shift 2
+            ;;
         *)
             echo "Unknown option: $1"
             exit 1
@@ -66,24 +76,34 @@ echo "  Service name for traces: $SERVICE_NAME_FOR_TRACES"
 echo "  Data directory: $DATA_DIR"
 echo "  Non-idle durations directory: $NON_IDLE_DURATIONS_DIR"
 echo "  Limit: $LIMIT"
-echo -e "  Save traces as JSON: $SAVE_TRACES_JSON\n"
+echo "  Save traces as JSON: $SAVE_TRACES_JSON"
+echo -e "  Trace window (us): [$WINDOW_START_US - $WINDOW_END_US]\n"
 
 SCRIPTS_DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" && pwd )"
 BASE_DIR="$(realpath "$SCRIPTS_DIR/..")"
 TRACE_SRC_DIR="$(realpath "$BASE_DIR/src/traces")"
 PROCESS_JAEGER_TRACES_LOG_PATH="$DATA_DIR/logs/process_jaeger_traces.log"
 COLLECT_NON_IDLE_DURATION_DATA_LOG_PATH="$DATA_DIR/logs/collect_non_idle_duration_data.log"
+RUN_ID="$(basename "$DATA_DIR")"
 DATA_DIR="$DATA_DIR/data/trace_data"
 
+WINDOW_ARGS=()
+if [[ -n "$WINDOW_START_US" ]]; then
+    WINDOW_ARGS+=(--window-start-us "$WINDOW_START_US")
+fi
+if [[ -n "$WINDOW_END_US" ]]; then
+    WINDOW_ARGS+=(--window-end-us "$WINDOW_END_US")
+fi
+
 if [ "$SAVE_TRACES_JSON" = true ]; then
-    echo -e "Saving Jaeger traces as JSON in $DATA_DIR/data"
+    echo -e "Saving Jaeger trace JSONs to the trace archive in $DATA_DIR"
 
     echo -e "python3 \"$TRACE_SRC_DIR/process_jaeger_traces.py\" \\
         --service-name-for-traces \"$SERVICE_NAME_FOR_TRACES\" \\
         --data-dir \"$DATA_DIR\" \\
         --limit \"$LIMIT\" \\ 
         --test-name \"$TEST_NAME\" \\
-        --config \"$CONFIG\" \\
+        --config \"$CONFIG\" ${WINDOW_ARGS[*]} \\
         --save-traces-json > \"$PROCESS_JAEGER_TRACES_LOG_PATH\" 2>&1"
 
     python3 "$TRACE_SRC_DIR/process_jaeger_traces.py" \
@@ -91,7 +111,7 @@ if [ "$SAVE_TRACES_JSON" = true ]; then
         --data-dir "$DATA_DIR" \
         --limit "$LIMIT" \
         --test-name "$TEST_NAME" \
-        --config "$CONFIG" \
+        --config "$CONFIG" "${WINDOW_ARGS[@]}" \
         --save-traces-json > "$PROCESS_JAEGER_TRACES_LOG_PATH" 2>&1 || {
         echo "Error: Failed to process Jaeger traces. See $PROCESS_JAEGER_TRACES_LOG_PATH for details."
         exit 1
@@ -102,14 +122,14 @@ else
         --data-dir \"$DATA_DIR\" \\
         --limit \"$LIMIT\" \\
         --test-name \"$TEST_NAME\" \\
-        --config \"$CONFIG\" > \"$PROCESS_JAEGER_TRACES_LOG_PATH\" 2>&1"
+        --config \"$CONFIG\" ${WINDOW_ARGS[*]} > \"$PROCESS_JAEGER_TRACES_LOG_PATH\" 2>&1"
 
     python3 "$TRACE_SRC_DIR/process_jaeger_traces.py" \
         --service-name-for-traces "$SERVICE_NAME_FOR_TRACES" \
         --data-dir "$DATA_DIR" \
         --limit "$LIMIT" \
         --test-name "$TEST_NAME" \
-        --config "$CONFIG" > "$PROCESS_JAEGER_TRACES_LOG_PATH" 2>&1 || {
+        --config "$CONFIG" "${WINDOW_ARGS[@]}" > "$PROCESS_JAEGER_TRACES_LOG_PATH" 2>&1 || {
         echo "Error: Failed to process Jaeger traces. See $PROCESS_JAEGER_TRACES_LOG_PATH for details."
         exit 1
     }
@@ -121,6 +141,7 @@ echo -e "\npython3 \"$TRACE_SRC_DIR/collect_non_idle_duration_data.py\" \\
     --container-name \"$CONTAINER_NAME\" \\
     --config \"$CONFIG\" \\
     --data-dir \"$DATA_DIR\" \\
+    --run-id \"$RUN_ID\" \\
     --non-idle-durations-dir \"$NON_IDLE_DURATIONS_DIR\" > \"$COLLECT_NON_IDLE_DURATION_DATA_LOG_PATH\" 2>&1"
 python3 "$TRACE_SRC_DIR/collect_non_idle_duration_data.py" \
     --test-name "$TEST_NAME" \
@@ -128,6 +149,7 @@ python3 "$TRACE_SRC_DIR/collect_non_idle_duration_data.py" \
     --container-name "$CONTAINER_NAME" \
     --config "$CONFIG" \
     --data-dir "$DATA_DIR" \
+    --run-id "$RUN_ID" \
     --non-idle-durations-dir "$NON_IDLE_DURATIONS_DIR" > "$COLLECT_NON_IDLE_DURATION_DATA_LOG_PATH" 2>&1 || {
     echo "Error: Failed to collect non-idle median duration data. See $COLLECT_NON_IDLE_DURATION_DATA_LOG_PATH for details."
     exit 1
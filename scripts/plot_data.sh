@@ -136,3 +136,27 @@ python3 "$PROFILE_SRC_DIR/plot_profile_with_trace_data.py" \
     echo "Error: Failed to plot performance data with traces. See $PLOT_PROFILE_WITH_TRACE_DATA_LOG_PATH for details."
     exit 1
 }
+
+SPAN_COUNTER_ATTRIBUTION_LOG_PATH="$DATA_DIR/logs/span_counter_attribution.log"
+RUN_ID="$(basename "${DATA_DIR}")"
+echo -e "\npython3 $PROFILE_SRC_DIR/span_counter_attribution.py \\
+    --test-name \"${TEST_NAME}\" \\
+    --service-name-for-traces \"${SERVICE_NAME_FOR_TRACES}\" \\
+    --container-name \"${CONTAINER_NAME}\" \\
+    --config \"${CONFIG}\" \\
+    --profile-data-dir \"${DATA_DIR}/data/profile_data\" \\
+    --trace-data-dir \"${DATA_DIR}/data/trace_data\" \\
+    --run-id \"${RUN_ID}\" \\
+    --non-idle-durations-dir \"${NON_IDLE_DURATIONS_DIR}\" > $SPAN_COUNTER_ATTRIBUTION_LOG_PATH 2>&1"
+python3 "$PROFILE_SRC_DIR/span_counter_attribution.py" \
+    --test-name "${TEST_NAME}" \
+    --service-name-for-traces "${SERVICE_NAME_FOR_TRACES}" \
+    --container-name "${CONTAINER_NAME}" \
+    --config "${CONFIG}" \
+    --profile-data-dir "${DATA_DIR}/data/profile_data" \
+    --trace-data-dir "${DATA_DIR}/data/trace_data" \
+    --run-id "${RUN_ID}" \
+    --non-idle-durations-dir "${NON_IDLE_DURATIONS_DIR}" > $SPAN_COUNTER_ATTRIBUTION_LOG_PATH 2>&1 || {
+    echo "Error: Failed to attribute profile counters to spans. See $SPAN_COUNTER_ATTRIBUTION_LOG_PATH for details."
+    exit 1
+}
@@ -246,6 +246,7 @@ echo -e "\n--------------------------------------------------"
 # NOTE: Edit grub file to specific isolcpus=<cpu_to_pin_profiler>,<cpu_to_profile> for the container to profile and then reboot
 RUN_WORKLOAD_ON_LOCAL_LOG_PATH="$LOG_DIR/run_workload_on_local_output.log"
 echo "Running execute_workload_on_local.sh in background with logs saved at $RUN_WORKLOAD_ON_LOCAL_LOG_PATH"
+WORKLOAD_START_US=$(date +%s%6N)
 $SCRIPTS_DIR/execute_workload_on_local.sh --docker-compose-dir "$DOCKER_COMPOSE_DIR" --test-name "$TEST_NAME" --config "$CONFIG" > "$RUN_WORKLOAD_ON_LOCAL_LOG_PATH" 2>&1 &
 echo -e "--------------------------------------------------\n"
 
@@ -281,6 +282,8 @@ else
     }
     echo -e "--------------------------------------------------\n"
 fi
+WORKLOAD_END_US=$(date +%s%6N)
+echo "Workload window (us): [$WORKLOAD_START_US - $WORKLOAD_END_US]"
 
 echo "sleep 5"
 sleep 5
@@ -294,12 +297,12 @@ echo -e "\n(cd \"$DOCKER_COMPOSE_DIR\" && docker compose ps | awk '{print \$1 \"
 echo -e "\n--------------------------------------------------"
 echo "Running collect_analyse_jaeger_traces.sh"
 if $SAVE_TRACES_JSON; then
-    $SCRIPTS_DIR/collect_analyse_jaeger_traces.sh --test-name "$TEST_NAME" --container-name "$CONTAINER_NAME" --config "$CONFIG" --service-name-for-traces "$SERVICE_NAME_FOR_TRACES" --limit $JAEGER_TRACES_LIMIT --data-dir "$DATA_DIR" --non-idle-durations-dir "$NON_IDLE_DURATIONS_DATA_DIR" --save-traces-json || {
+    $SCRIPTS_DIR/collect_analyse_jaeger_traces.sh --test-name "$TEST_NAME" --container-name "$CONTAINER_NAME" --config "$CONFIG" --service-name-for-traces "$SERVICE_NAME_FOR_TRACES" --limit $JAEGER_TRACES_LIMIT --data-dir "$DATA_DIR" --non-idle-durations-dir "$NON_IDLE_DURATIONS_DATA_DIR" --window-start-us "$WORKLOAD_START_US" --window-end-us "$WORKLOAD_END_US" --save-traces-json || {
         echo "Failed to collect and analyse Jaeger traces"
         exit 1
     }
 else 
-    $SCRIPTS_DIR/collect_analyse_jaeger_traces.sh --test-name "$TEST_NAME" --container-name "$CONTAINER_NAME" --config "$CONFIG" --service-name-for-traces "$SERVICE_NAME_FOR_TRACES" --limit $JAEGER_TRACES_LIMIT --data-dir "$DATA_DIR" --non-idle-durations-dir "$NON_IDLE_DURATIONS_DATA_DIR" || {
+    $SCRIPTS_DIR/collect_analyse_jaeger_traces.sh --test-name "$TEST_NAME" --container-name "$CONTAINER_NAME" --config "$CONFIG" --service-name-for-traces "$SERVICE_NAME_FOR_TRACES" --limit $JAEGER_TRACES_LIMIT --data-dir "$DATA_DIR" --non-idle-durations-dir "$NON_IDLE_DURATIONS_DATA_DIR" --window-start-us "$WORKLOAD_START_US" --window-end-us "$WORKLOAD_END_US" || {
         echo "Failed to collect and analyse Jaeger traces"
         exit 1
     }
@@ -0,0 +1,213 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+from typing import Callable, Dict, List, Optional, Tuple
+from plot_profile_utils import load_profile_data
+from span_counter_attribution import DEFAULT_CHUNK_TRACES, attribute_span_counters, set_profile_data
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../traces')))
+from src.traces.collect_non_idle_duration_data import load_traces_data
+
+# Compares a baseline and a candidate run per (service, operation) of a container: the
+# median and p99 span non idle execution time and the LLC MPKI of the operation's spans.
+# Runs without profile data, like runs in non idle duration only mode, are compared on the
+# non idle execution times of their traces alone, without the MPKI.
+# Confidence intervals of every delta come from a percentile bootstrap, where spans of each
+# run are resampled independently as a (resamples x spans) index matrix and the statistic
+# is taken along the rows, in batches so the index matrix stays within MAX_BOOTSTRAP_CELLS.
+DEFAULT_NUM_BOOTSTRAP = 1000
+DEFAULT_CONFIDENCE = 0.95
+DEFAULT_MIN_SPANS = 30
+DEFAULT_SEED = 0
+MAX_BOOTSTRAP_CELLS = 10_000_000
+DURATION_METRICS = ["median_non_idle_time", "p99_non_idle_time"]
+COMPARISON_METRICS = DURATION_METRICS + ["mpki"]
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare the operations of a container between two runs or configs.")
+    parser.add_argument("--test-name", type=str, required=True, help="Test name")
+    parser.add_argument("--service-name-for-traces", type=str, required=True, help="Service name for traces")
+    parser.add_argument("--container-name", type=str, required=True, help="Container name")
+    parser.add_argument("--baseline-run-dir", type=str, required=True, help="Run directory of the baseline, holding data/trace_data and optionally data/profile_data")
+    parser.add_argument("--baseline-config", type=str, required=True, help="Test configuration of the baseline")
+    parser.add_argument("--candidate-run-dir", type=str, help="Run directory of the candidate, defaults to the latest run directory next to the baseline run directory holding the candidate config")
+    parser.add_argument("--candidate-config", type=str, required=True, help="Test configuration of the candidate")
+    parser.add_argument("--output-dir", type=str, default="outputs", help="Output directory for the comparison CSV")
+    parser.add_argument("--num-bootstrap", type=int, default=DEFAULT_NUM_BOOTSTRAP, help="Number of bootstrap resamples")
+    parser.add_argument("--confidence", type=float, default=DEFAULT_CONFIDENCE, help="Confidence level of the intervals")
+    parser.add_argument("--min-spans", type=int, default=DEFAULT_MIN_SPANS, help="Minimum spans of an operation in both runs for it to be compared")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="Seed of the bootstrap resampling")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of counter attribution processes")
+
+    return parser.parse_args()
+
+def find_config_run_dir(results_dir: str, service_name_for_traces: str, test_name: str, config: str) -> Optional[str]:
+    # every run directory of the results tree holds one config and is named after its start
+    # time, so the latest run holding the config is found from the names alone
+    for run_name in sorted(os.listdir(results_dir), reverse=True):
+        traces_csv_file_path = os.path.join(results_dir, run_name, "data", "trace_data", f"{service_name_for_traces}_{test_name}_{config}_traces_data.csv")
+        if os.path.exists(traces_csv_file_path):
+            return os.path.join(results_dir, run_name)
+    return None
+
+def load_run_span_counters(run_dir: str, service_name_for_traces: str, test_name: str, config: str, container_name: str, num_workers: int) -> pd.DataFrame:
+    traces_df: pd.DataFrame = load_traces_data(
+        os.path.join(run_dir, "data", "trace_data"), service_name_for_traces, test_name, config, container_name,
+        ['trace_id', 'span_id', 'service', 'operation', 'start_time', 'end_time', 'non_idle_execution_time', 'non_idle_intervals'])
+    if traces_df.empty:
+        print(f"[ERROR:] No traces found for container [{container_name}] with config [{config}] in {run_dir}")
+        return pd.DataFrame()
+    # without counters the run's spans are compared on their non idle execution times only
+    profile_data_dir = os.path.join(run_dir, "data", "profile_data")
+    cores_to_profile_data_df: Dict[str, pd.DataFrame] = load_profile_data(profile_data_dir) if os.path.isdir(profile_data_dir) else {}
+    if len(cores_to_profile_data_df) == 0:
+        print(f"[WARNING:] No performance data found for container [{container_name}] in {run_dir}, comparing non idle execution times only")
+        return traces_df
+    set_profile_data(cores_to_profile_data_df)
+    return attribute_span_counters(traces_df, num_workers, DEFAULT_CHUNK_TRACES)
+
+def has_span_counters(span_counters_df: pd.DataFrame) -> bool:
+    return "llc_misses" in span_counters_df.columns and "instructions" in span_counters_df.columns
+
+def get_span_arrays(span_counters_df: pd.DataFrame, with_counters: bool) -> Tuple[np.ndarray, ...]:
+    non_idle_times = span_counters_df["non_idle_execution_time"].to_numpy(dtype=np.float64)
+    if not with_counters:
+        return (non_idle_times,)
+    return (non_idle_times,
+            span_counters_df["llc_misses"].to_numpy(dtype=np.float64),
+            span_counters_df["instructions"].to_numpy(dtype=np.float64))
+
+def get_statistics(non_idle_times: np.ndarray, llc_misses: Optional[np.ndarray] = None, instructions: Optional[np.ndarray] = None) -> np.ndarray:
+    # COMPARISON_METRICS along the last axis, or DURATION_METRICS without counters, inputs are
+    # spans along the last axis
+    quantiles = np.quantile(non_idle_times, [0.5, 0.99], axis=-1)
+    if llc_misses is None or instructions is None:
+        return np.stack([quantiles[0], quantiles[1]], axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mpki = llc_misses.sum(axis=-1) * 1000 / instructions.sum(axis=-1)
+    return np.stack([quantiles[0], quantiles[1], mpki], axis=-1)
+
+def bootstrap_statistics(span_arrays: Tuple[np.ndarray, ...], num_bootstrap: int, rng: np.random.Generator,
+                         statistics_fn: Callable[..., np.ndarray] = get_statistics) -> np.ndarray:
+    # (num_bootstrap, metrics) statistics of resamples drawn with replacement
+    num_spans = len(span_arrays[0])
+    batch_size = max(1, MAX_BOOTSTRAP_CELLS // num_spans)
+    batches: List[np.ndarray] = []
+    for batch_start in range(0, num_bootstrap, batch_size):
+        resample_idx = rng.integers(0, num_spans, size=(min(batch_size, num_bootstrap - batch_start), num_spans))
+        batches.append(statistics_fn(*(span_array[resample_idx] for span_array in span_arrays)))
+    return np.concatenate(batches)
+
+def compare_operations(
+        baseline_span_counters_df: pd.DataFrame,
+        candidate_span_counters_df: pd.DataFrame,
+        num_bootstrap: int,
+        confidence: float,
+        min_spans: int,
+        seed: int,
+) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    alpha = (1 - confidence) / 2
+    baseline_groups = baseline_span_counters_df.groupby(["service", "operation"]).indices
+    candidate_groups = candidate_span_counters_df.groupby(["service", "operation"]).indices
+    with_counters = has_span_counters(baseline_span_counters_df) and has_span_counters(candidate_span_counters_df)
+    if not with_counters:
+        print("[WARNING:] Counters missing for the baseline or candidate, the MPKI is not compared")
+    metrics = COMPARISON_METRICS if with_counters else DURATION_METRICS
+    baseline_arrays = get_span_arrays(baseline_span_counters_df, with_counters)
+    candidate_arrays = get_span_arrays(candidate_span_counters_df, with_counters)
+
+    rows = []
+    for service, operation in sorted(set(baseline_groups) & set(candidate_groups)):
+        baseline_idx = baseline_groups[(service, operation)]
+        candidate_idx = candidate_groups[(service, operation)]
+        if len(baseline_idx) < min_spans or len(candidate_idx) < min_spans:
+            print(f"[WARNING:] Skipping [{service}] [{operation}] with [{len(baseline_idx)}] baseline and [{len(candidate_idx)}] candidate spans, fewer than [{min_spans}]")
+            continue
+        operation_baseline_arrays = tuple(array[baseline_idx] for array in baseline_arrays)
+        operation_candidate_arrays = tuple(array[candidate_idx] for array in candidate_arrays)
+        baseline_statistics = get_statistics(*operation_baseline_arrays)
+        candidate_statistics = get_statistics(*operation_candidate_arrays)
+        deltas = bootstrap_statistics(operation_candidate_arrays, num_bootstrap, rng) - bootstrap_statistics(operation_baseline_arrays, num_bootstrap, rng)
+        ci_lows, ci_highs = np.nanquantile(deltas, [alpha, 1 - alpha], axis=0)
+
+        row = {"service": service, "operation": operation, "baseline_spans": len(baseline_idx), "candidate_spans": len(candidate_idx)}
+        for i, metric in enumerate(metrics):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                relative = 100 / baseline_statistics[i]
+            row[f"baseline_{metric}"] = baseline_statistics[i]
+            row[f"candidate_{metric}"] = candidate_statistics[i]
+            row[f"{metric}_delta"] = candidate_statistics[i] - baseline_statistics[i]
+            row[f"{metric}_delta_pct"] = row[f"{metric}_delta"] * relative
+            row[f"{metric}_delta_pct_ci_low"] = ci_lows[i] * relative
+            row[f"{metric}_delta_pct_ci_high"] = ci_highs[i] * relative
+        rows.append(row)
+
+    comparison_df = pd.DataFrame(rows)
+    if comparison_df.empty:
+        return comparison_df
+    # an operation regresses on a metric when the whole interval of its delta is above zero,
+    # operations are ranked by the largest regression they are certain of
+    ci_low_columns = [f"{metric}_delta_pct_ci_low" for metric in metrics]
+    comparison_df["regressed_metrics"] = comparison_df[ci_low_columns].gt(0).apply(
+        lambda regressed: ",".join(metric for metric, is_regressed in zip(metrics, regressed) if is_regressed), axis=1)
+    comparison_df["regression_pct"] = comparison_df[ci_low_columns].max(axis=1)
+    return comparison_df.sort_values(by="regression_pct", ascending=False, ignore_index=True)
+
+def main() -> None:
+    args: argparse.Namespace = parse_arguments()
+    test_name: str = args.test_name.replace(" ", "_")
+    baseline_config: str = args.baseline_config.replace(" ", "_")
+    candidate_config: str = args.candidate_config.replace(" ", "_")
+    candidate_run_dir: Optional[str] = args.candidate_run_dir
+    if not candidate_run_dir:
+        results_dir = os.path.dirname(os.path.abspath(args.baseline_run_dir))
+        candidate_run_dir = find_config_run_dir(results_dir, args.service_name_for_traces, test_name, candidate_config)
+        if candidate_run_dir is None:
+            print(f"[ERROR:] No run directory with config [{candidate_config}] found in {results_dir}, pass --candidate-run-dir")
+            return
+
+    print("Running with the following arguments:")
+    print(f"Test name: {test_name}")
+    print(f"Service name for traces: {args.service_name_for_traces}")
+    print(f"Container name: {args.container_name}")
+    print(f"Baseline run directory: {args.baseline_run_dir}")
+    print(f"Baseline configuration: {baseline_config}")
+    print(f"Candidate run directory: {candidate_run_dir}")
+    print(f"Candidate configuration: {candidate_config}")
+    print(f"Output directory: {args.output_dir}")
+    print(f"Bootstrap resamples: {args.num_bootstrap}")
+    print(f"Confidence: {args.confidence}")
+    print(f"Min spans: {args.min_spans}")
+    print(f"Seed: {args.seed}")
+    print(f"Workers: {args.workers}")
+
+    baseline_span_counters_df = load_run_span_counters(
+        args.baseline_run_dir, args.service_name_for_traces, test_name, baseline_config, args.container_name, args.workers)
+    candidate_span_counters_df = load_run_span_counters(
+        candidate_run_dir, args.service_name_for_traces, test_name, candidate_config, args.container_name, args.workers)
+    if baseline_span_counters_df.empty or candidate_span_counters_df.empty:
+        return
+
+    comparison_df = compare_operations(
+        baseline_span_counters_df, candidate_span_counters_df, args.num_bootstrap, args.confidence, args.min_spans, args.seed)
+    if comparison_df.empty:
+        print("No operations found with enough spans in both runs.")
+        return
+
+    print(f"\nOperations of [{args.container_name}] ranked by regression from [{baseline_config}] to [{candidate_config}]:")
+    metrics = [metric for metric in COMPARISON_METRICS if f"{metric}_delta_pct" in comparison_df.columns]
+    summary_columns = ["service", "operation"] + [f"{metric}_delta_pct{suffix}" for metric in metrics for suffix in ["", "_ci_low", "_ci_high"]] + ["regressed_metrics"]
+    print(comparison_df[summary_columns].to_string(index=False, float_format=lambda value: f"{value:.2f}"))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    comparison_csv_file_path = os.path.join(
+        args.output_dir, f"{args.service_name_for_traces}_{test_name}_{args.container_name}_{baseline_config}_vs_{candidate_config}_comparison.csv")
+    comparison_df.to_csv(comparison_csv_file_path, index=False)
+    print(f"\nComparison saved to {comparison_csv_file_path}")
+
+if __name__ == "__main__":
+    main()
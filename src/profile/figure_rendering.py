@@ -0,0 +1,73 @@
+import os
+import resource
+import matplotlib
+import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+# Renders the figures of a plotting stage in a pool of worker processes. The stage computes
+# everything a figure needs up front and submits a module level render function with one
+# picklable argument tuple per figure. Every figure is drawn with the Agg backend from the
+# rcParams captured when the stage submitted it, and any rcParams it changes are undone when
+# it is saved, so the image bytes do not depend on the worker that drew it or on the figures
+# drawn before it, and are the same as rendering serially with one worker.
+DEFAULT_RENDER_WORKERS = os.cpu_count()
+DEFAULT_WORKER_MEMORY_MB = 2048
+
+def get_rc_params() -> Dict[str, Any]:
+    # the backend is left to every process, workers always use Agg
+    rc_params = dict(matplotlib.rcParams.copy())
+    rc_params.pop("backend", None)
+    return rc_params
+
+def get_address_space_bytes() -> int:
+    # virtual memory of this process, workers are forked with the address space of the parent
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+def init_render_worker(worker_memory_mb: int) -> None:
+    matplotlib.use("Agg")
+    # a worker can grow its address space by worker_memory_mb over what it inherited, a
+    # figure that needs more fails with a MemoryError in the worker and is rendered serially
+    if worker_memory_mb > 0:
+        limit = get_address_space_bytes() + worker_memory_mb * 1024 * 1024
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        if hard_limit != resource.RLIM_INFINITY:
+            limit = min(limit, hard_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, hard_limit))
+
+def render_figure(render_fn: Callable[..., Any], rc_params: Dict[str, Any], render_args: Tuple) -> Any:
+    try:
+        with matplotlib.rc_context(rc_params):
+            return render_fn(*render_args)
+    finally:
+        plt.close("all")
+
+def render_figures(
+        render_fn: Callable[..., Any],
+        figure_args: List[Tuple],
+        num_workers: int = DEFAULT_RENDER_WORKERS,
+        worker_memory_mb: int = DEFAULT_WORKER_MEMORY_MB,
+) -> List[Any]:
+    # results of render_fn in the order of figure_args
+    rc_params = get_rc_params()
+    num_workers = min(num_workers or 1, len(figure_args))
+    if num_workers <= 1:
+        return [render_figure(render_fn, rc_params, render_args) for render_args in figure_args]
+
+    results: List[Any] = [None] * len(figure_args)
+    failed_figures: List[int] = []
+    with ProcessPoolExecutor(max_workers=num_workers, initializer=init_render_worker, initargs=(worker_memory_mb,)) as executor:
+        futures = [executor.submit(render_figure, render_fn, rc_params, render_args) for render_args in figure_args]
+        for i, future in enumerate(futures):
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                print(f"[WARNING:] Rendering figure [{i}] with [{render_fn.__name__}] failed in a worker with [{type(e).__name__}: {e}], rendering it serially")
+                failed_figures.append(i)
+    for i in failed_figures:
+        results[i] = render_figure(render_fn, rc_params, figure_args[i])
+    return results
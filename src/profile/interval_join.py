@@ -0,0 +1,134 @@
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+# Joins batches of [start, end] time windows with the profile samples of every core. Each
+# core's samples are sorted by Time once, so the samples of a window are the slice
+# [first, last) found with two searchsorted calls, and the counter totals of a window are
+# the difference of two rows of a prefix sum. Windows include both their start and end.
+COUNTER_COLUMNS = ["LLC-loads", "LLC-misses", "Instructions"]
+LLC_LOADS_IDX = 0
+LLC_MISSES_IDX = 1
+INSTRUCTIONS_IDX = 2
+
+class ProfileIndex:
+    def __init__(self, core_to_profile_data_df: Dict[str, pd.DataFrame]):
+        self.core_ids: List[str] = list(core_to_profile_data_df.keys())
+        self.__core_to_times: Dict[str, np.ndarray] = {}
+        self.__core_to_counters: Dict[str, np.ndarray] = {}
+        self.__core_to_prefix_sums: Dict[str, np.ndarray] = {}
+        self.__core_to_non_zero_prefix_sums: Dict[str, np.ndarray] = {}
+        for core_id, profile_data_df in core_to_profile_data_df.items():
+            order = np.argsort(profile_data_df["Time"].to_numpy(dtype=np.int64), kind="stable")
+            counters = profile_data_df[COUNTER_COLUMNS].to_numpy(dtype=np.int64)[order]
+            self.__core_to_times[core_id] = profile_data_df["Time"].to_numpy(dtype=np.int64)[order]
+            self.__core_to_counters[core_id] = counters
+            self.__core_to_prefix_sums[core_id] = get_prefix_sums(counters)
+            self.__core_to_non_zero_prefix_sums[core_id] = get_prefix_sums((counters > 0).astype(np.int64))
+
+    def __len__(self) -> int:
+        return len(self.core_ids)
+
+    def get_times(self, core_id: str) -> np.ndarray:
+        return self.__core_to_times[core_id]
+
+    def get_counters(self, core_id: str) -> np.ndarray:
+        return self.__core_to_counters[core_id]
+
+    def get_min_time(self) -> int:
+        return min(int(times[0]) for times in self.__core_to_times.values() if len(times))
+
+    def get_max_time(self) -> int:
+        return max(int(times[-1]) for times in self.__core_to_times.values() if len(times))
+
+    def get_slices(self, core_id: str, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+        # (first, last) sample of every window, its samples are times[first:last]
+        times = self.__core_to_times[core_id]
+        return np.searchsorted(times, starts, side="left"), np.searchsorted(times, ends, side="right")
+
+    def get_window_num_samples(self, core_id: str, starts, ends) -> np.ndarray:
+        firsts, lasts = self.get_slices(core_id, starts, ends)
+        return lasts - firsts
+
+    def get_window_sums(self, core_id: str, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+        # (windows x counters) totals and the number of samples of every window
+        firsts, lasts = self.get_slices(core_id, starts, ends)
+        prefix_sums = self.__core_to_prefix_sums[core_id]
+        return prefix_sums[lasts] - prefix_sums[firsts], lasts - firsts
+
+    def get_window_non_zero_counts(self, core_id: str, starts, ends) -> np.ndarray:
+        # (windows x counters) number of samples with a non zero counter in every window
+        firsts, lasts = self.get_slices(core_id, starts, ends)
+        non_zero_prefix_sums = self.__core_to_non_zero_prefix_sums[core_id]
+        return non_zero_prefix_sums[lasts] - non_zero_prefix_sums[firsts]
+
+    def get_all_cores_window_sums(self, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+        counter_sums = np.zeros((len(starts), len(COUNTER_COLUMNS)), dtype=np.int64)
+        num_samples = np.zeros(len(starts), dtype=np.int64)
+        for core_id in self.core_ids:
+            core_counter_sums, core_num_samples = self.get_window_sums(core_id, starts, ends)
+            counter_sums += core_counter_sums
+            num_samples += core_num_samples
+        return counter_sums, num_samples
+
+    def get_counters_at_times(self, core_id: str, times: np.ndarray) -> np.ndarray:
+        # (times x counters) counters of the first sample at every time, zeros where the core has none
+        core_times = self.__core_to_times[core_id]
+        if len(core_times) == 0:
+            return np.zeros((len(times), len(COUNTER_COLUMNS)), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(core_times, times), len(core_times) - 1)
+        has_time = core_times[positions] == times
+        return np.where(has_time[:, None], self.__core_to_counters[core_id][positions], 0)
+
+    def get_window_df(self, core_id: str, start, end) -> pd.DataFrame:
+        first, last = self.get_slices(core_id, start, end)
+        window_df = pd.DataFrame(self.__core_to_counters[core_id][first:last], columns=COUNTER_COLUMNS)
+        window_df.insert(0, "Time", self.__core_to_times[core_id][first:last])
+        return window_df
+
+    def __repr__(self):
+        return f"ProfileIndex(core_ids={self.core_ids}, " \
+            f"num_samples={sum(len(times) for times in self.__core_to_times.values())})"
+
+def get_prefix_sums(values: np.ndarray) -> np.ndarray:
+    # row i holds the totals of values[:i], so values[a:b] totals prefix_sums[b] - prefix_sums[a]
+    prefix_sums = np.zeros((len(values) + 1,) + values.shape[1:], dtype=np.int64)
+    np.cumsum(values, axis=0, out=prefix_sums[1:])
+    return prefix_sums
+
+class UnionTimeline:
+    # The samples of all cores on one sorted time axis, the union of every core's sample
+    # times, with one (times x cores) matrix per counter that is zero where a core has no
+    # sample at a time. Cross core sums are row reductions done once, and the busiest core of
+    # any window is the argmax of prefix sum differences, instead of per core lookups.
+    def __init__(self, profile_index: ProfileIndex, start=None, end=None):
+        # only the samples within [start, end] are kept when given
+        self.core_ids: List[str] = list(profile_index.core_ids)
+        core_slices = [profile_index.get_slices(core_id, -np.inf if start is None else start, np.inf if end is None else end)
+                       for core_id in self.core_ids]
+        core_times = [profile_index.get_times(core_id)[first:last] for core_id, (first, last) in zip(self.core_ids, core_slices)]
+        self.times: np.ndarray = np.unique(np.concatenate(core_times)) if core_times else np.empty(0, dtype=np.int64)
+        self.counters: np.ndarray = np.zeros((len(COUNTER_COLUMNS), len(self.times), len(self.core_ids)), dtype=np.int64)
+        for core_idx, (core_id, times, (first, last)) in enumerate(zip(self.core_ids, core_times, core_slices)):
+            # every core's times are a sorted subset of the union, the first sample wins on duplicates
+            positions = np.searchsorted(self.times, times)
+            is_first = np.ones(len(times), dtype=bool)
+            is_first[1:] = times[1:] != times[:-1]
+            self.counters[:, positions[is_first], core_idx] = profile_index.get_counters(core_id)[first:last][is_first].T
+        self.all_cores_counters: np.ndarray = self.counters.sum(axis=2)
+        self.__core_prefix_sums = get_prefix_sums(self.counters.transpose(1, 0, 2))
+
+    def __len__(self) -> int:
+        return len(self.times)
+
+    def get_slices(self, starts, ends) -> Tuple[np.ndarray, np.ndarray]:
+        return np.searchsorted(self.times, starts, side="left"), np.searchsorted(self.times, ends, side="right")
+
+    def get_core_window_sums(self, starts, ends) -> np.ndarray:
+        # (windows x counters x cores) totals of every core in every window
+        firsts, lasts = self.get_slices(starts, ends)
+        return self.__core_prefix_sums[lasts] - self.__core_prefix_sums[firsts]
+
+    def __repr__(self):
+        return f"UnionTimeline(core_ids={self.core_ids}, " \
+            f"num_times={len(self.times)})"
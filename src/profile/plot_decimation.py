@@ -0,0 +1,79 @@
+import numpy as np
+import matplotlib.pyplot as plt
+from typing import Tuple
+
+# Reduces a dense series to what its axes can show before it is drawn, the drawn image stays
+# the same while the number of artists drops to a bounded multiple of the axes size.
+# - lines keep the samples with the minimum and maximum y of every pixel column, at most 2x
+#   the axes width in points, so every spike and the drawn extent of every column are kept
+# - scatters keep one sample of every occupied cell of a grid over the axes, with cells half a
+#   marker wide and high, since the min and max of a column would hide the samples in between
+#   that a scatter draws; an isolated spike is alone in its cell and always kept
+# Kept samples are real samples in their original order, so decimated lines trace the same path.
+POINTS_PER_PIXEL_COLUMN = 2
+CELLS_PER_MARKER = 2
+
+def get_axes_size_px(ax: plt.Axes, dpi: float) -> Tuple[int, int]:
+    # (width, height) of the axes in the saved image, from its position in the figure
+    position = ax.get_position()
+    figure_width, figure_height = ax.figure.get_size_inches()
+    return max(1, int(position.width * figure_width * dpi)), max(1, int(position.height * figure_height * dpi))
+
+def get_buckets(values: np.ndarray, num_buckets: int) -> np.ndarray:
+    # equal width buckets over the range of the values
+    min_value, max_value = values.min(), values.max()
+    if max_value == min_value:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - min_value) / (max_value - min_value) * num_buckets).astype(np.int64), num_buckets - 1)
+
+def get_min_max_indices(x: np.ndarray, y: np.ndarray, num_buckets: int) -> np.ndarray:
+    # sorted indices of the min and max y of every non empty x bucket, NaN samples are dropped
+    valid = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+    if len(valid) == 0:
+        return valid
+    buckets = get_buckets(x[valid], num_buckets)
+
+    # sorted by (bucket, y), the first and last sample of every bucket are its min and max
+    order = np.lexsort((y[valid], buckets))
+    sorted_buckets = buckets[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = sorted_buckets[1:] != sorted_buckets[:-1]
+    is_last = np.ones(len(order), dtype=bool)
+    is_last[:-1] = is_first[1:]
+    return np.unique(valid[order[is_first | is_last]])
+
+def get_cell_indices(x: np.ndarray, y: np.ndarray, num_x_buckets: int, num_y_buckets: int) -> np.ndarray:
+    # sorted indices of the first sample of every non empty (x, y) cell, NaN samples are dropped
+    valid = np.flatnonzero(~(np.isnan(x) | np.isnan(y)))
+    if len(valid) == 0:
+        return valid
+    cells = get_buckets(x[valid], num_x_buckets) * num_y_buckets + get_buckets(y[valid], num_y_buckets)
+    _, first_idx = np.unique(cells, return_index=True)
+    return np.sort(valid[first_idx])
+
+def report_decimation(label: str, num_points: int, num_kept: int, width_px: int, height_px: int) -> None:
+    print(f"Decimated [{label}] from [{num_points}] to [{num_kept}] points for [{width_px}x{height_px}] px "
+          f"(ratio {num_points / max(1, num_kept):.1f}x)")
+
+def decimate_line(x, y, ax: plt.Axes, dpi: float, label: str) -> Tuple[np.ndarray, np.ndarray]:
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    width_px, height_px = get_axes_size_px(ax, dpi)
+    if len(x) <= POINTS_PER_PIXEL_COLUMN * width_px:
+        return x, y
+    kept_idx = get_min_max_indices(x, y, width_px)
+    report_decimation(label, len(x), len(kept_idx), width_px, height_px)
+    return x[kept_idx], y[kept_idx]
+
+def decimate_scatter(x, y, ax: plt.Axes, dpi: float, marker_size: float, label: str) -> Tuple[np.ndarray, np.ndarray]:
+    # marker_size is the scatter size s, the marker area in points squared
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    width_px, height_px = get_axes_size_px(ax, dpi)
+    cell_px = max(1.0, np.sqrt(marker_size) * dpi / 72 / CELLS_PER_MARKER)
+    num_x_buckets, num_y_buckets = max(1, int(width_px / cell_px)), max(1, int(height_px / cell_px))
+    if len(x) <= num_x_buckets * num_y_buckets:
+        return x, y
+    kept_idx = get_cell_indices(x, y, num_x_buckets, num_y_buckets)
+    report_decimation(label, len(x), len(kept_idx), width_px, height_px)
+    return x[kept_idx], y[kept_idx]
@@ -3,8 +3,13 @@ import os
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
+import sys
 from matplotlib.collections import LineCollection
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../traces')))
+from src.traces.duration_sketch import DEFAULT_QUANTILES, SKETCHES_DIR, load_cache_partitions_to_sketch
+
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Plot Non-Idle median trace duration VS cache partitions for each container.")
     parser.add_argument("--data-dir", type=str, required=True, help="Directory containing the input CSV files.")
@@ -51,6 +56,40 @@ def plot_non_idle_durations(non_idle_durations_df: pd.DataFrame, container_name:
     plt.savefig(os.path.join(plot_dir, f"{container_name}_non_idle_duration.png"), dpi=300)
     plt.close()
 
+def plot_non_idle_duration_quantiles(data_dir: str, container_name: str, plot_dir: str) -> None:
+    # percentiles of the per trace non idle duration over every request of every run,
+    # from the run sketches merged per cache partition count
+    cache_partitions_to_sketch = load_cache_partitions_to_sketch(data_dir, container_name)
+    cache_partitions_to_sketch = {cp: sketch for cp, sketch in cache_partitions_to_sketch.items() if cp and sketch.count > 0}
+    if not cache_partitions_to_sketch:
+        print(f"No non idle duration sketches with cache partitions for container {container_name}. Skipping...")
+        return
+
+    cache_partitions = sorted(cache_partitions_to_sketch, key=int)
+    rows = []
+    for cp in cache_partitions:
+        sketch = cache_partitions_to_sketch[cp]
+        rows.append([int(cp), sketch.count] + sketch.get_quantiles(DEFAULT_QUANTILES))
+    quantile_columns = [f"p{quantile * 100:g}" for quantile in DEFAULT_QUANTILES]
+    quantiles_df = pd.DataFrame(rows, columns=["cache_partitions", "num_traces"] + quantile_columns)
+    quantiles_df.to_csv(os.path.join(plot_dir, f"{container_name}_non_idle_duration_quantiles.csv"), index=False)
+    print(quantiles_df.to_string(index=False))
+
+    plt.figure(figsize=(12, 8))
+    positions = quantiles_df["cache_partitions"].values
+    for column, style in zip(quantile_columns, ['bo-', 'go--', 'ro-.']):
+        plt.plot(positions, quantiles_df[column].values, style, linewidth=2, markersize=8, label=f"{column} Non-Idle Duration")
+    plt.xlabel("Num Cache Partitions", fontsize=12)
+    plt.ylabel("Non-Idle Trace Duration", fontsize=12)
+    plt.yscale("log")
+    plt.title(f"{container_name}\nNon-Idle Trace Duration Percentiles VS Cache Partitions ({quantiles_df['num_traces'].sum()} traces)", fontsize=14)
+    plt.legend(fontsize=10)
+    plt.grid(alpha=0.3)
+    plt.xticks(positions)
+    plt.tight_layout()
+    plt.savefig(os.path.join(plot_dir, f"{container_name}_non_idle_duration_quantiles.png"), dpi=300)
+    plt.close()
+
 def main():
     args: argparse.Namespace = parse_arguments()
     data_dir: str = args.data_dir
@@ -66,5 +105,11 @@ def main():
             plot_non_idle_durations(non_idle_durations_df, container_name, plot_dir)
             print(f"Processed {filename} and saved plot to {plot_dir}")
 
+    sketches_dir = os.path.join(data_dir, SKETCHES_DIR)
+    if os.path.isdir(sketches_dir):
+        for container_name in sorted(os.listdir(sketches_dir)):
+            plot_non_idle_duration_quantiles(data_dir, container_name, plot_dir)
+            print(f"Processed non idle duration sketches of {container_name} and saved plot to {plot_dir}")
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -4,6 +4,9 @@ import argparse
 import numpy as np
 from typing import Tuple, Dict
 from plot_profile_utils import load_profile_data, get_processed_df
+from plot_decimation import decimate_scatter
+
+PLOT_DPI = 300
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Plot LLC Load, Miss, and Instruction Frequencies over Time.")
@@ -34,7 +37,8 @@ def plot_data_with_fixed_x_axis(
     x_min: int,
     x_max: int
 ) -> None:
-    axes[position].scatter(data["Time"], data[label], label=label, color=color, marker="o", s=10)  
+    time, values = decimate_scatter(data["Time"], data[label], axes[position], PLOT_DPI, 10, label)
+    axes[position].scatter(time, values, label=label, color=color, marker="o", s=10)  
     axes[position].set_xlim(x_min, x_max)
 
 def plot_data(
@@ -50,7 +54,9 @@ def plot_data(
     title: str,
     p99_cutoff_percent: float = 0.05
 ) -> None:
-    axes[position].scatter(data["Time"], data[label], label=label, color=color, marker="o", s=10)  
+    # the scatter is decimated to the axes size, the statistics and limits use every sample
+    time, values = decimate_scatter(data["Time"], data[label], axes[position], PLOT_DPI, 10, label)
+    axes[position].scatter(time, values, label=label, color=color, marker="o", s=10)  
     axes[position].axhline(median, color=color, linestyle="--", label=f"{title} Median", alpha=0.7)
     axes[position].axhline(p25, color=color, linestyle=":", label=f"{title} 25th", alpha=0.5)
     axes[position].axhline(p75, color=color, linestyle=":", label=f"{title} 75th", alpha=0.5)
@@ -93,7 +99,7 @@ def add_text_box(
 
 def save_plot(fig: plt.Figure, output_file_path: str) -> None:
     fig.tight_layout()
-    plt.savefig(output_file_path, bbox_inches='tight', dpi=300)
+    plt.savefig(output_file_path, bbox_inches='tight', dpi=PLOT_DPI)
     print(f"Plot saved as {output_file_path}")
 
 def main() -> None:
@@ -194,6 +200,7 @@ def main() -> None:
 
         plt.style.use('ggplot')
         fig, axes = plt.subplots(1, 1, figsize=(12, 6))
+        axes = np.atleast_1d(axes)
         plot_data(axes, loads, loads_median, loads_25th, loads_75th, loads_99th, "LLC-loads", "blue", 0, "Loads")
         plot_data(axes, misses, misses_median, misses_25th, misses_75th, misses_99th, "LLC-misses", "red", 0, "Misses")
         add_text_box(axes, 0, loads_median, loads_25th, loads_75th, loads_99th, "LLC-loads", "blue", 0)
@@ -204,6 +211,7 @@ def main() -> None:
 
         # Plot Instructions per core
         fig, axes = plt.subplots(len(core_to_instructions), 1, figsize=(12, 6 * len(core_to_instructions)))
+        axes = np.atleast_1d(axes)
         min_time = min([df["Time"].min() for df in core_to_instructions.values()])
         max_time = max([df["Time"].max() for df in core_to_instructions.values()])
 
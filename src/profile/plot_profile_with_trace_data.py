@@ -5,14 +5,24 @@ from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
 import matplotlib.pyplot as plt
 import numpy as np
-from typing import Dict, Any, List
-from plot_profile_utils import load_profile_data, get_processed_df
+from typing import Dict, Any, List, Optional, Tuple
+from plot_profile_utils import load_profile_data
+from interval_join import ProfileIndex, UnionTimeline, LLC_LOADS_IDX, LLC_MISSES_IDX, INSTRUCTIONS_IDX
+from plot_decimation import decimate_line
+from figure_rendering import DEFAULT_RENDER_WORKERS, DEFAULT_WORKER_MEMORY_MB, render_figures
+from relative_time_binning import DEFAULT_BIN_WIDTH, get_num_bins, get_bin_indices, get_segmented_percentiles
 import sys
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
-from src.traces.collect_non_idle_duration_data import (load_traces_data, get_trace_id_to_non_idle_intervals, get_median_non_idle_intervals, get_median_duration_information_for_non_idle_intervals)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../traces')))
+from src.traces.collect_non_idle_duration_data import (load_traces_data, get_trace_id_to_non_idle_intervals, filter_traces_with_median_non_idle_intervals,
+                                                       get_shape_cluster_non_idle_intervals, get_median_duration_information_for_non_idle_intervals,
+                                                       get_traces_within_duration_bands, BAND_METHODS, DEFAULT_BAND_METHOD)
+from src.traces.non_idle_intervals import TraceNonIdleIntervals, concat_trace_non_idle_intervals
+from src.traces.trace_shape_clusters import DEFAULT_MIN_CLUSTER_TRACES
 
 DEFAULT_SERVICE_NAME = "nginx-web-server"
+NORMALISED_PERF_DATA_COLUMNS = ["relative_position", "LLC-loads", "LLC-misses", "Instructions", "core_idx"]
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Plot Jaeger trace data for a given service.")
@@ -29,181 +39,212 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument("--trace-profile-csv-dir", type=str, help="Output directory for CSV data")
     parser.add_argument("--save-median-resource-usage-csvs", type=bool, default=False, help="Save median plot CSVs")
     parser.add_argument("--non-idle-durations-dir", type=str, help="Output directory for median durations")
+    parser.add_argument("--band-method", type=str, choices=BAND_METHODS, default=DEFAULT_BAND_METHOD, help="Duration band used to select traces per non idle interval: median +- k sd, IQR fences or median +- k scaled MAD")
+    parser.add_argument("--band-width", type=float, help="Band width k, defaults to 1 for sd and mad and 1.5 for iqr")
+    parser.add_argument("--min-cluster-traces", type=int, default=DEFAULT_MIN_CLUSTER_TRACES, help="Minimum traces in a span tree shape cluster for it to be analysed")
+    parser.add_argument("--workers", type=int, default=DEFAULT_RENDER_WORKERS, help="Number of figure rendering processes")
+    parser.add_argument("--worker-memory-mb", type=int, default=DEFAULT_WORKER_MEMORY_MB, help="Memory a rendering process may allocate in MB, 0 for no limit")
+    parser.add_argument("--bin-width", type=float, default=DEFAULT_BIN_WIDTH, help="Width in μs of the relative time bins of the aligned median resource usage")
 
     return parser.parse_args()
 
 def get_selected_traces_based_non_median_non_idle_intervals(
-        median_duration_per_non_idle_interval: Dict[int, int],
-        non_idle_duration_index_to_trace_id_non_idle_duration_map: Dict[int, Dict[str, int]],
-        median_non_idle_intervals: int
-) -> set[str]:
-    # select traces whose duration lies in median +- 1 sd for each non idle interval
-    non_idle_interval_index_to_trace_ids: Dict[int, List[str]] = {}
-    for i in range(median_non_idle_intervals):
-        median_duration: int = median_duration_per_non_idle_interval[i]
-        sd_duration: float = np.std(list(non_idle_duration_index_to_trace_id_non_idle_duration_map[i].values()))
-        lower_bound: int = int(median_duration - (sd_duration))
-        upper_bound: int = int(median_duration + (sd_duration))
-        trace_ids_list: List[str] = []
-        for trace_id, duration in non_idle_duration_index_to_trace_id_non_idle_duration_map[i].items():
-            if lower_bound <= duration <= upper_bound:
-                trace_ids_list.append(trace_id)
-        non_idle_interval_index_to_trace_ids[i] = trace_ids_list
-    # take an intersection of trace ids from the set of selected traces across all non idle intervals
-    selected_trace_ids: set[str] = []
-    for i in range(median_non_idle_intervals):
-        if i == 0:
-            selected_trace_ids = set(non_idle_interval_index_to_trace_ids[i])
-        else:
-            selected_trace_ids = selected_trace_ids.intersection(set(non_idle_interval_index_to_trace_ids[i]))
-    if not selected_trace_ids:
-        print("No traces found that match the median duration +- 1 standard deviation criteria across all non idle intervals.")
+        trace_non_idle_intervals: TraceNonIdleIntervals,
+        duration_matrix: np.ndarray,
+        band_method: str = DEFAULT_BAND_METHOD,
+        band_width: Optional[float] = None
+) -> Optional[TraceNonIdleIntervals]:
+    # select traces whose duration lies in the median band of every non idle interval,
+    # median +- 1 sd by default
+    selected_trace_mask: np.ndarray = get_traces_within_duration_bands(duration_matrix, band_method, band_width)
+    if not selected_trace_mask.any():
+        print(f"No traces found that match the [{band_method}] duration band criteria across all non idle intervals.")
         return
     
-    return selected_trace_ids
+    return trace_non_idle_intervals.select(selected_trace_mask)
 
-def plot_aligned_median_resource_usage(
-    trace_id_to_non_idle_intervals: Dict[str, List[Dict[int, int]]],
+def get_aligned_median_resource_usage(
+    trace_non_idle_intervals: TraceNonIdleIntervals,
     median_non_idle_intervals: int,
     median_duration_per_non_idle_interval: Dict[int, int],
-    core_to_profile_data_df: Dict[str, pd.DataFrame],
+    union_timeline: UnionTimeline,
     profile_data_dir: str,
     output_dir: str, 
     config: str, 
     container_name: str,
     save_median_resource_usage_csvs: bool,
-) -> None:
-    print(f"Plotting aligned median resource usage for traces in {container_name} with config {config}")
+    cluster_name: str = "",
+    bin_width: float = DEFAULT_BIN_WIDTH,
+) -> Optional[Tuple]:
+    # writes the CSVs and returns the arguments of render_aligned_median_resource_usage
+    print(f"Plotting aligned median resource usage for traces in {container_name} with config {config} {cluster_name}")
+    # every shape cluster gets its own set of files
+    file_suffix = f"_{cluster_name}" if cluster_name else ""
     
-    # process perf data
-    normalised_perf_data_per_non_idle_interval: Dict[int, # non idle interval index
-                                                        List[ #records for each timestamp
-                                                            Dict[str, Any]
-                                                            ]
-                                                        ] = {}
-    for i in range(median_non_idle_intervals):
-        normalised_perf_data_per_non_idle_interval[i] = []
-    for trace_id, non_idle_intervals in trace_id_to_non_idle_intervals.items():
-        for i, non_idle_interval in enumerate(non_idle_intervals):
-            non_idle_interval_start: int = list(non_idle_interval.keys())[0]
-            non_idle_interval_end: int = non_idle_interval[non_idle_interval_start]
-            non_idle_interval_duration: int = non_idle_interval_end - non_idle_interval_start
-
-            # Get all timestamps from all cores within the non idle interval
-            all_timestamps = set()
-            for core_df in core_to_profile_data_df.values():
-                core_df = core_df[
-                    (core_df['Time'] >= non_idle_interval_start) & 
-                    (core_df['Time'] <= non_idle_interval_end)
-                ]
-                all_timestamps.update(core_df['Time'].unique())
-            all_timestamps = sorted(list(all_timestamps))
-
-            # Get updated core dfs for this timestamp range
-            updated_core_to_profile_data_df: Dict[str, pd.DataFrame] = {}
-            for core_id, core_df in core_to_profile_data_df.items():
-                core_df = core_df[
-                    (core_df['Time'] >= non_idle_interval_start) & 
-                    (core_df['Time'] <= non_idle_interval_end)
-                ]
-                updated_core_to_profile_data_df[core_id] = core_df
-
-            # get core with highest instructions for this trace
-            core_with_highest_instructions = None
-            max_instructions = 0
-            for core_id, core_df in updated_core_to_profile_data_df.items():
-                if not core_df.empty:
-                    total_instructions = core_df['Instructions'].sum()
-                    if total_instructions > max_instructions:
-                        max_instructions = total_instructions
-                        core_with_highest_instructions = core_id
-            if core_with_highest_instructions is None:
-                print(f"No instructions data found for trace {trace_id} for non idle interval {i}.")
-                continue
-
-            # For each timestamp, sum up LLC loads and misses across all cores
-            for timestamp in all_timestamps:
-                total_llc_loads = 0
-                total_llc_misses = 0
-                for core_id, core_df in updated_core_to_profile_data_df.items():
-                    if not core_df.empty:
-                        timestamp_data = core_df[core_df['Time'] == timestamp]
-                        if not timestamp_data.empty:
-                            total_llc_loads += timestamp_data['LLC-loads'].iloc[0]
-                            total_llc_misses += timestamp_data['LLC-misses'].iloc[0]
-
-                # Get instructions for this timestamp
-                instructions_df = updated_core_to_profile_data_df[core_with_highest_instructions]
-                if not instructions_df.empty:
-                    timestamp_instructions = instructions_df[instructions_df['Time'] == timestamp]['Instructions'].iloc[0] if not instructions_df[instructions_df['Time'] == timestamp].empty else 0
-                else:
-                    continue
-
-                # Normalize the data
-                relative_position = (timestamp - non_idle_interval_start) / non_idle_interval_duration
-                relative_position = max(0, min(1, relative_position))
-                normalised_perf_data_per_non_idle_interval[i].append({
-                    'trace_id': trace_id,
-                    'absolute_time': timestamp,
-                    'relative_position': relative_position,
-                    'LLC-loads': total_llc_loads,
-                    'LLC-misses': total_llc_misses,
-                    'Instructions': timestamp_instructions,
-                    'core_id': core_with_highest_instructions
-                })
-
-    if not normalised_perf_data_per_non_idle_interval:
+    # the windows of all intervals are sliced from the union timeline at once, the core with
+    # the highest instructions of every interval is the argmax of its per core window sums
+    # (the first core wins ties) and the LLC loads and misses of every timestamp are summed
+    # across cores
+    interval_starts, interval_ends = trace_non_idle_intervals.starts, trace_non_idle_intervals.ends
+    firsts, lasts = union_timeline.get_slices(interval_starts, interval_ends)
+    core_instructions = union_timeline.get_core_window_sums(interval_starts, interval_ends)[:, INSTRUCTIONS_IDX, :]
+    core_idx_with_highest_instructions = np.argmax(core_instructions, axis=1)
+    has_instructions = core_instructions.max(axis=1) > 0
+
+    interval_positions = np.arange(len(interval_starts)) - np.repeat(trace_non_idle_intervals.offsets[:-1], trace_non_idle_intervals.get_counts())
+    interval_trace_ids = np.repeat(trace_non_idle_intervals.trace_ids, trace_non_idle_intervals.get_counts())
+    for trace_id, i in zip(interval_trace_ids[~has_instructions], interval_positions[~has_instructions].tolist()):
+        print(f"No instructions data found for trace {trace_id} for non idle interval {i}.")
+
+    # one row per timestamp of every interval with instructions, in trace and interval order
+    num_timestamps = np.where(has_instructions, lasts - firsts, 0)
+    sample_intervals = np.repeat(np.arange(len(interval_starts)), num_timestamps)
+    sample_idx = np.arange(len(sample_intervals)) - np.repeat(np.cumsum(num_timestamps) - num_timestamps, num_timestamps) + firsts[sample_intervals]
+    sample_times = union_timeline.times[sample_idx]
+    sample_core_idx = core_idx_with_highest_instructions[sample_intervals]
+
+    if len(sample_intervals) == 0:
         print("No performance data found within trace windows.")
         return
-    
+
+    # Normalize the data, a zero length interval puts its samples at the end
+    with np.errstate(divide="ignore", invalid="ignore"):
+        relative_positions = (sample_times - interval_starts[sample_intervals]) / (interval_ends - interval_starts)[sample_intervals]
+    sample_perf_data = {
+        'relative_position': np.where(np.isnan(relative_positions), 1.0, np.clip(relative_positions, 0, 1)),
+        'LLC-loads': union_timeline.all_cores_counters[LLC_LOADS_IDX][sample_idx],
+        'LLC-misses': union_timeline.all_cores_counters[LLC_MISSES_IDX][sample_idx],
+        'Instructions': union_timeline.counters[INSTRUCTIONS_IDX][sample_idx, sample_core_idx],
+        'core_idx': sample_core_idx,
+    }
+    # per non idle interval index the samples of every trace's interval as arrays of
+    # (relative position, LLC loads, LLC misses, instructions, core index)
+    normalised_perf_data_per_non_idle_interval: Dict[int, Dict[str, np.ndarray]] = {}
+    sample_positions = interval_positions[sample_intervals]
+    for i in range(median_non_idle_intervals):
+        is_interval = sample_positions == i
+        normalised_perf_data_per_non_idle_interval[i] = {column: sample_perf_data[column][is_interval] for column in NORMALISED_PERF_DATA_COLUMNS}
+
+    # per non idle interval index the (bins x BAND_PERCENTILES) percentiles of every bin with samples,
+    # LLC loads and misses are summed across cores, instructions are per core and 0 in bins
+    # where the core was never the core with the highest instructions
     non_idle_interval_idx_to_time_points: Dict[int, np.ndarray] = {}
-    non_idle_interval_idx_to_median_llc_loads: Dict[int, List[float]] = {}
-    non_idle_interval_idx_to_median_llc_misses: Dict[int, List[float]] = {}
-    non_idle_interval_idx_to_core_id_to_median_instructions: Dict[int, Dict[str, List[float]]] = {}
+    non_idle_interval_idx_to_llc_loads_percentiles: Dict[int, np.ndarray] = {}
+    non_idle_interval_idx_to_llc_misses_percentiles: Dict[int, np.ndarray] = {}
+    non_idle_interval_idx_to_core_id_to_instructions_percentiles: Dict[int, Dict[str, np.ndarray]] = {}
 
     for non_idle_interval_idx, median_duration in median_duration_per_non_idle_interval.items():
-        num_bin_in_microseconds: int = median_duration
-        bin_edges: np.ndarray = np.linspace(0, 1, num_bin_in_microseconds + 1)
+        num_bins: int = get_num_bins(median_duration, bin_width)
+        bin_edges: np.ndarray = np.linspace(0, 1, num_bins + 1)
         bin_centers: np.ndarray = (bin_edges[:-1] + bin_edges[1:]) / 2
-        binned_llc_loads: List[List[float]] = [[] for _ in range(num_bin_in_microseconds)]
-        binned_llc_misses: List[List[float]] = [[] for _ in range(num_bin_in_microseconds)]
-        binned_instructions: Dict[str, List[List[float]]] = {core_id: [[] for _ in range(num_bin_in_microseconds)] for core_id in core_to_profile_data_df.keys()}
-
-        for row in normalised_perf_data_per_non_idle_interval[non_idle_interval_idx]:
-            bin_idx: int = min(int(row['relative_position'] * num_bin_in_microseconds), num_bin_in_microseconds - 1)
-            binned_llc_loads[bin_idx].append(row['LLC-loads'])
-            binned_llc_misses[bin_idx].append(row['LLC-misses'])
-            binned_instructions[row['core_id']][bin_idx].append(row['Instructions'])
-
-        median_llc_loads: List[float] = []
-        median_llc_misses: List[float] = []
-        core_id_to_instructions: Dict[str, List[float]] = {core_id: [] for core_id in core_to_profile_data_df.keys()}   
-        valid_bin_centers: List[float] = []
-        for i in range(num_bin_in_microseconds):
-            if binned_llc_loads[i] and binned_llc_misses[i]:
-                median_llc_loads.append(np.median([x for x in binned_llc_loads[i] if x > 0]))
-                median_llc_misses.append(np.median([x for x in binned_llc_misses[i] if x > 0]))
-                valid_bin_centers.append(bin_centers[i])
-                # Calculate median instructions for each core
-                for core_id in core_to_profile_data_df.keys():
-                    core_id_to_instructions[core_id].append(
-                        np.median([x for x in binned_instructions[core_id][i] if x > 0]) if binned_instructions[core_id][i] else 0
-                    )
-        time_points: np.ndarray = np.array(valid_bin_centers) * median_duration
-
-        non_idle_interval_idx_to_time_points[non_idle_interval_idx] = time_points
-        non_idle_interval_idx_to_median_llc_loads[non_idle_interval_idx] = median_llc_loads
-        non_idle_interval_idx_to_median_llc_misses[non_idle_interval_idx] = median_llc_misses
-        non_idle_interval_idx_to_core_id_to_median_instructions[non_idle_interval_idx] = core_id_to_instructions
+        interval_perf_data = normalised_perf_data_per_non_idle_interval[non_idle_interval_idx]
+        bin_indices = get_bin_indices(interval_perf_data['relative_position'], num_bins)
+        valid_bins = np.bincount(bin_indices, minlength=num_bins) > 0
+
+        # percentiles are taken over the non zero samples of a bin
+        llc_loads, llc_misses = interval_perf_data['LLC-loads'], interval_perf_data['LLC-misses']
+        non_idle_interval_idx_to_llc_loads_percentiles[non_idle_interval_idx] = get_segmented_percentiles(bin_indices[llc_loads > 0], llc_loads[llc_loads > 0], num_bins)[valid_bins]
+        non_idle_interval_idx_to_llc_misses_percentiles[non_idle_interval_idx] = get_segmented_percentiles(bin_indices[llc_misses > 0], llc_misses[llc_misses > 0], num_bins)[valid_bins]
+        core_id_to_instructions_percentiles: Dict[str, np.ndarray] = {}
+        for core_idx, core_id in enumerate(union_timeline.core_ids):
+            is_core = interval_perf_data['core_idx'] == core_idx
+            is_core_non_zero = is_core & (interval_perf_data['Instructions'] > 0)
+            core_bins = np.bincount(bin_indices[is_core], minlength=num_bins) > 0
+            instructions_percentiles = get_segmented_percentiles(bin_indices[is_core_non_zero], interval_perf_data['Instructions'][is_core_non_zero], num_bins)
+            instructions_percentiles[~core_bins] = 0
+            core_id_to_instructions_percentiles[core_id] = instructions_percentiles[valid_bins]
+
+        non_idle_interval_idx_to_time_points[non_idle_interval_idx] = bin_centers[valid_bins] * median_duration
+        non_idle_interval_idx_to_core_id_to_instructions_percentiles[non_idle_interval_idx] = core_id_to_instructions_percentiles
 
     total_median_duration_across_non_idle_intervals: float = sum(median_duration_per_non_idle_interval.values())
 
+    # the intervals are laid out one after another with a gap of 10 μs, the same for every plot
+    non_idle_interval_idx_to_adjusted_time_points: Dict[int, np.ndarray] = {}
+    cumulative_time = 0
+    break_points = []
+    x_lim_end = 0
+    for idx in range(median_non_idle_intervals):
+        adjusted_time_points = non_idle_interval_idx_to_time_points[idx] + cumulative_time
+        non_idle_interval_idx_to_adjusted_time_points[idx] = adjusted_time_points
+        x_lim_end = adjusted_time_points[-1] + 10
+        if idx < median_non_idle_intervals - 1:
+            cumulative_time = adjusted_time_points[-1] + 10
+            break_points.append(cumulative_time)
+    all_time_points = np.concatenate([non_idle_interval_idx_to_adjusted_time_points[idx] for idx in range(median_non_idle_intervals)])
+
+    if save_median_resource_usage_csvs:
+        # Save the LLC data and breakpoints to CSV file
+        llc_loads_percentiles = np.concatenate([non_idle_interval_idx_to_llc_loads_percentiles[idx] for idx in range(median_non_idle_intervals)])
+        llc_misses_percentiles = np.concatenate([non_idle_interval_idx_to_llc_misses_percentiles[idx] for idx in range(median_non_idle_intervals)])
+        llc_data_df = pd.DataFrame({
+            'Time': all_time_points,
+            'LLC-loads': llc_loads_percentiles[:, 1],
+            'LLC-misses': llc_misses_percentiles[:, 1],
+            "is_break_point": [1 if time in break_points else 0 for time in all_time_points],
+            'LLC-loads-p25': llc_loads_percentiles[:, 0],
+            'LLC-loads-p75': llc_loads_percentiles[:, 2],
+            'LLC-misses-p25': llc_misses_percentiles[:, 0],
+            'LLC-misses-p75': llc_misses_percentiles[:, 2],
+        })
+        llc_data_csv_file_name = f"llc_data_{container_name}_{config}{file_suffix}.csv"
+        llc_data_df.to_csv(os.path.join(profile_data_dir, llc_data_csv_file_name), index=False)
+        print(f"LLC data saved to {llc_data_csv_file_name} in {profile_data_dir}")
+
+        # Save the instructions data to CSV file
+        instructions_data_dfs: List[pd.DataFrame] = []
+        for core_id in union_timeline.core_ids:
+            instructions_percentiles = np.concatenate([non_idle_interval_idx_to_core_id_to_instructions_percentiles[idx][core_id] for idx in range(median_non_idle_intervals)])
+            instructions_data_dfs.append(pd.DataFrame({
+                'Time': all_time_points,
+                'Core ID': core_id,
+                'Instructions': instructions_percentiles[:, 1],
+                'Instructions-p25': instructions_percentiles[:, 0],
+                'Instructions-p75': instructions_percentiles[:, 2],
+            }))
+        instructions_data_df = pd.concat(instructions_data_dfs, ignore_index=True)
+        instructions_data_csv_file_name = f"instructions_data_{container_name}_{config}{file_suffix}.csv"
+        instructions_data_df.to_csv(os.path.join(profile_data_dir, instructions_data_csv_file_name), index=False)
+        print(f"Instructions data saved to {instructions_data_csv_file_name} in {profile_data_dir}")
+    
+    print(f"Number of traces analysed: {len(trace_non_idle_intervals)}")
+    return (
+        union_timeline.core_ids,
+        median_non_idle_intervals,
+        total_median_duration_across_non_idle_intervals,
+        non_idle_interval_idx_to_adjusted_time_points,
+        break_points,
+        x_lim_end,
+        non_idle_interval_idx_to_llc_loads_percentiles,
+        non_idle_interval_idx_to_llc_misses_percentiles,
+        non_idle_interval_idx_to_core_id_to_instructions_percentiles,
+        output_dir,
+        config,
+        container_name,
+        file_suffix,
+    )
+
+def render_aligned_median_resource_usage(
+    core_ids: List[str],
+    median_non_idle_intervals: int,
+    total_median_duration_across_non_idle_intervals: float,
+    non_idle_interval_idx_to_adjusted_time_points: Dict[int, np.ndarray],
+    break_points: List[float],
+    x_lim_end: float,
+    non_idle_interval_idx_to_llc_loads_percentiles: Dict[int, np.ndarray],
+    non_idle_interval_idx_to_llc_misses_percentiles: Dict[int, np.ndarray],
+    non_idle_interval_idx_to_core_id_to_instructions_percentiles: Dict[int, Dict[str, np.ndarray]],
+    output_dir: str,
+    config: str,
+    container_name: str,
+    file_suffix: str,
+) -> List[str]:
     # Plot the the non idle intervals side by side in one plot for llc loads and misses
     llc_fig: plt.Figure
     llc_axs: plt.Axes
     instruction_fig: plt.Figure
     instruction_ax: plt.Axes
-    if len(core_to_profile_data_df) == 1:
+    if len(core_ids) == 1:
         fig, axes = plt.subplots(2, 1, figsize=(15, 10))
         llc_axs = axes[0]
         llc_fig = fig
@@ -220,27 +261,18 @@ def plot_aligned_median_resource_usage(
             fontsize=14, fontweight='bold'
         )
 
-    cumulative_time = 0
-    all_time_points = []
-    llc_loads_data = []
-    llc_misses_data = []
-    break_points = []
-    x_lim_end = 0
-    for idx in range(median_non_idle_intervals):
-        time_points = non_idle_interval_idx_to_time_points[idx]
-        median_llc_loads = non_idle_interval_idx_to_median_llc_loads[idx]
-        median_llc_misses = non_idle_interval_idx_to_median_llc_misses[idx]
-        adjusted_time_points = time_points + cumulative_time
-        all_time_points.extend(adjusted_time_points)
-        llc_loads_data.extend(median_llc_loads)
-        llc_misses_data.extend(median_llc_misses)
-        x_lim_end = adjusted_time_points[-1] + 10
-        if idx < median_non_idle_intervals - 1:
-            cumulative_time = adjusted_time_points[-1] + 10
-            break_points.append(cumulative_time)
+    all_time_points = np.concatenate([non_idle_interval_idx_to_adjusted_time_points[idx] for idx in range(median_non_idle_intervals)])
+    llc_loads_percentiles = np.concatenate([non_idle_interval_idx_to_llc_loads_percentiles[idx] for idx in range(median_non_idle_intervals)])
+    llc_misses_percentiles = np.concatenate([non_idle_interval_idx_to_llc_misses_percentiles[idx] for idx in range(median_non_idle_intervals)])
 
-    llc_axs.scatter(all_time_points, llc_loads_data, color='blue', marker='o', s=10, label='LLC Loads', alpha=0.7)
-    llc_axs.scatter(all_time_points, llc_misses_data, color='red', marker='^', s=10, label='LLC Misses', alpha=0.7)
+    llc_axs.scatter(all_time_points, llc_loads_percentiles[:, 1], color='blue', marker='o', s=10, label='LLC Loads', alpha=0.7)
+    llc_axs.scatter(all_time_points, llc_misses_percentiles[:, 1], color='red', marker='^', s=10, label='LLC Misses', alpha=0.7)
+    for idx in range(median_non_idle_intervals):
+        adjusted_time_points = non_idle_interval_idx_to_adjusted_time_points[idx]
+        llc_axs.fill_between(adjusted_time_points, non_idle_interval_idx_to_llc_loads_percentiles[idx][:, 0], non_idle_interval_idx_to_llc_loads_percentiles[idx][:, 2],
+                             color='blue', alpha=0.15, linewidth=0, label='LLC Loads p25-p75' if idx == 0 else None)
+        llc_axs.fill_between(adjusted_time_points, non_idle_interval_idx_to_llc_misses_percentiles[idx][:, 0], non_idle_interval_idx_to_llc_misses_percentiles[idx][:, 2],
+                             color='red', alpha=0.15, linewidth=0, label='LLC Misses p25-p75' if idx == 0 else None)
     for break_point in break_points:
         llc_axs.axvline(x=break_point, color='gray', linestyle='--', alpha=1)
     llc_axs.set_xlabel("Time (μs)")
@@ -252,181 +284,105 @@ def plot_aligned_median_resource_usage(
     llc_axs.grid(True, linestyle='--', alpha=0.3)
     llc_axs.legend(loc='upper right')
 
-    if save_median_resource_usage_csvs:
-        # Save the LLC data and breakpoints to CSV file
-        llc_data_df = pd.DataFrame({
-            'Time': all_time_points,
-            'LLC-loads': llc_loads_data,
-            'LLC-misses': llc_misses_data,
-            "is_break_point": [1 if time in break_points else 0 for time in all_time_points]
-        })
-        llc_data_csv_file_name = f"llc_data_{container_name}_{config}.csv"
-        llc_data_df.to_csv(os.path.join(profile_data_dir, llc_data_csv_file_name), index=False)
-        print(f"LLC data saved to {llc_data_csv_file_name} in {profile_data_dir}")
-
-    # Plot instructions data
-    if len(core_to_profile_data_df) == 1:
-        cumulative_time = 0
-        x_lim_end = 0
-        all_time_points = []
-        instructions_data = []
-        break_points = []
-        
-        for idx in range(median_non_idle_intervals):
-            time_points = non_idle_interval_idx_to_time_points[idx]
-            core_id_to_instructions = non_idle_interval_idx_to_core_id_to_median_instructions[idx]
-            adjusted_time_points = time_points + cumulative_time
-            all_time_points.extend(adjusted_time_points)
-            for core_id, instructions in core_id_to_instructions.items():
-                if not instructions:
-                    continue
-                instructions_data.extend(instructions)
-                x_lim_end = adjusted_time_points[-1] + 10
-            if idx < median_non_idle_intervals - 1:
-                cumulative_time = adjusted_time_points[-1] + 10
-                break_points.append(cumulative_time)
-
-        instruction_ax.scatter(all_time_points, instructions_data, color='green', marker='o', s=10, label='Instructions', alpha=0.7)
-        for break_point in break_points:
-            instruction_ax.axvline(x=break_point, color='gray', linestyle='--', alpha=1)
-        instruction_ax.set_title(f"Instructions across Non-Idle Intervals\n{container_name} | {config}")
-        instruction_ax.set_xlabel('Time (μs)', fontsize=10)
-        instruction_ax.set_ylabel('Instructions', fontsize=10)
-        instruction_ax.set_xlim(0, x_lim_end)
-        instruction_ax.set_xticks(np.arange(0, x_lim_end, step=100))
-        instruction_ax.grid(True, linestyle='--', alpha=0.3)
-        instruction_ax.legend(loc='upper right')
-
-        llc_fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-        llc_instructions_png_file_name = f"llc_instructions_{container_name}_{config}.png"
-        llc_fig.savefig(os.path.join(output_dir, llc_instructions_png_file_name))
-        plt.close(llc_fig)
-        print(f"Aligned median resource usage plot saved as {llc_instructions_png_file_name} in {output_dir}")
+    # Plot instructions data, one axis per core
+    if len(core_ids) == 1:
+        instruction_axes = [instruction_ax]
     else:
-        # TODO: revisit, might be buggy
-        instruction_fig, instruction_axes = plt.subplots(len(core_to_profile_data_df), 1, figsize=(15, 10))
+        instruction_fig, instruction_axes = plt.subplots(len(core_ids), 1, figsize=(15, 10))
         instruction_fig.suptitle(
             f"Instructions across Non-Idle Intervals\nContainer: {container_name} | Config: {config}\n{median_non_idle_intervals} Non Idle Intervals | Median Duration: {total_median_duration_across_non_idle_intervals:.3f} μs",
             fontsize=14, fontweight='bold'
         )
-        for i, (core_id, core_id_to_instructions) in enumerate(non_idle_interval_idx_to_core_id_to_median_instructions.items()):
-            core_ax = instruction_axes[i]
-            cumulative_time = 0
-            for idx in range(median_non_idle_intervals):
-                time_points = non_idle_interval_idx_to_time_points[idx]
-                instructions = core_id_to_instructions[idx]
-                adjusted_time_points = time_points + cumulative_time
-                core_ax.scatter(adjusted_time_points, instructions, color='blue', s=10, alpha=0.7)
-                for i, instruction in enumerate(instructions):
-                    instructions_data.append({
-                        'Time': adjusted_time_points[i],
-                        'Core ID': core_id,
-                        'Instructions': instruction
-                    })
-                if idx < median_non_idle_intervals - 1:
-                    cumulative_time = adjusted_time_points[-1] + 10 # Add a small gap between intervals
-                    core_ax.axvline(x=cumulative_time, color='r', linestyle='--', alpha=1)
-            core_ax.set_xlabel('Time (μs)', fontsize=10)
-            core_ax.set_ylabel('Instructions', fontsize=10)
-            core_ax.set_xlim(0, cumulative_time + 10)
-            core_ax.set_xticks(np.arange(0, cumulative_time + 10, step=100))
-            core_ax.set_ylim(0, max(max(instructions) for instructions in core_id_to_instructions.values()) * 1.1)
-            core_ax.grid(True, linestyle='--', alpha=0.3)
-            core_ax.legend(loc='upper right')
+    for core_id, core_ax in zip(core_ids, instruction_axes):
+        instructions_percentiles = np.concatenate([non_idle_interval_idx_to_core_id_to_instructions_percentiles[idx][core_id] for idx in range(median_non_idle_intervals)])
+        core_ax.scatter(all_time_points, instructions_percentiles[:, 1], color='green', marker='o', s=10, label='Instructions', alpha=0.7)
+        for idx in range(median_non_idle_intervals):
+            interval_instructions_percentiles = non_idle_interval_idx_to_core_id_to_instructions_percentiles[idx][core_id]
+            core_ax.fill_between(non_idle_interval_idx_to_adjusted_time_points[idx], interval_instructions_percentiles[:, 0], interval_instructions_percentiles[:, 2],
+                                 color='green', alpha=0.15, linewidth=0, label='Instructions p25-p75' if idx == 0 else None)
+        for break_point in break_points:
+            core_ax.axvline(x=break_point, color='gray', linestyle='--', alpha=1)
+        if len(core_ids) == 1:
+            core_ax.set_title(f"Instructions across Non-Idle Intervals\n{container_name} | {config}")
+        else:
             core_ax.set_title(f"Core {core_id} Instructions", fontsize=12, fontweight='bold')
+        core_ax.set_xlabel('Time (μs)', fontsize=10)
+        core_ax.set_ylabel('Instructions', fontsize=10)
+        core_ax.set_xlim(0, x_lim_end)
+        core_ax.set_xticks(np.arange(0, x_lim_end, step=100))
+        core_ax.grid(True, linestyle='--', alpha=0.3)
+        core_ax.legend(loc='upper right')
+
+    if len(core_ids) == 1:
+        llc_fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+        llc_instructions_png_file_name = f"llc_instructions_{container_name}_{config}{file_suffix}.png"
+        llc_fig.savefig(os.path.join(output_dir, llc_instructions_png_file_name))
+        plt.close(llc_fig)
+        return [llc_instructions_png_file_name]
+    llc_fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+    llc_png_file_name = f"llc_{container_name}_{config}{file_suffix}.png"
+    llc_fig.savefig(os.path.join(output_dir, llc_png_file_name))
+    plt.close(llc_fig)
+    instruction_fig.tight_layout(rect=[0, 0.03, 1, 0.95])
+    instruction_png_file_name = f"instructions_{container_name}_{config}{file_suffix}.png"
+    instruction_fig.savefig(os.path.join(output_dir, instruction_png_file_name))
+    plt.close(instruction_fig)
+    return [llc_png_file_name, instruction_png_file_name]
 
-            llc_fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-            llc_png_file_name = f"llc_{container_name}_{config}.png"
-            llc_fig.savefig(os.path.join(output_dir, llc_png_file_name))
-            plt.close(llc_fig)
-            instruction_fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-            instruction_png_file_name = f"instructions_{container_name}_{config}.png"
-            instruction_fig.savefig(os.path.join(output_dir, instruction_png_file_name))
-            plt.close(instruction_fig)
-            print(f"Aligned median resource usage plots saved as {llc_png_file_name} and {instruction_png_file_name} in {output_dir}")
-
-    if save_median_resource_usage_csvs:
-        # Save the instructions data to CSV file
-        instructions_data_df = pd.DataFrame(instructions_data)
-        instructions_data_csv_file_name = f"instructions_data_{container_name}_{config}.csv"
-        instructions_data_df.to_csv(os.path.join(profile_data_dir, instructions_data_csv_file_name), index=False)
-        print(f"Instructions data saved to {instructions_data_csv_file_name} in {profile_data_dir}")
-    
-    print(f"Number of traces analysed: {len(trace_id_to_non_idle_intervals)}")
 
 def get_highest_resource_usage_traces(
-    trace_id_to_non_idle_intervals: Dict[str, List[Dict[int, int]]],
-    core_to_profile_data_df: Dict[str, pd.DataFrame],
+    trace_non_idle_intervals: TraceNonIdleIntervals,
+    profile_index: ProfileIndex,
     num_samples: int
 ) -> pd.DataFrame:
-    trace_stats = []
-    min_perf_time = min([df['Time'].min() for df in core_to_profile_data_df.values()])
-    max_perf_time = max([df['Time'].max() for df in core_to_profile_data_df.values()])
-    
-    for trace_id, non_idle_intervals in trace_id_to_non_idle_intervals.items():
-        non_idle_intervals = sorted(non_idle_intervals, key=lambda x: list(x.keys())[0])
-        trace_start = list(non_idle_intervals[0].keys())[0]
-        trace_end = list(non_idle_intervals[-1].values())[0]
-        duration = trace_end - trace_start
-        if trace_end < min_perf_time or trace_start > max_perf_time:
-            continue
-        if trace_start < min_perf_time or trace_end > max_perf_time:
-            continue
-        non_zero_llc_loads = 0
-        non_zero_llc_misses = 0
-        non_zero_instructions = 0
-        curr_core_with_highest_instructions = None
-        highest_instructions = 0
-        core_to_instructions = {}
-        core_to_llc_loads = {}
-        core_to_llc_misses = {}
-
-        for core_no, profile_data_df in core_to_profile_data_df.items():
-            trace_perf_data = profile_data_df[
-                (profile_data_df['Time'] >= trace_start) & 
-                (profile_data_df['Time'] <= trace_end)
-            ]
-            if trace_perf_data.empty:
-                continue
-            instructions_count = (trace_perf_data['Instructions'] > 0).sum()
-            llc_loads_count = (trace_perf_data['LLC-loads'] > 0).sum()
-            llc_misses_count = (trace_perf_data['LLC-misses'] > 0).sum()
-            core_to_instructions[core_no] = instructions_count
-            core_to_llc_loads[core_no] = llc_loads_count
-            core_to_llc_misses[core_no] = llc_misses_count
-            non_zero_llc_loads += llc_loads_count
-            non_zero_llc_misses += llc_misses_count
-            non_zero_instructions += instructions_count
-            if instructions_count > highest_instructions:
-                highest_instructions = instructions_count
-                curr_core_with_highest_instructions = core_no
-                
-        if curr_core_with_highest_instructions is None:
-            print(f"No instructions data found for trace {trace_id}.")
-            continue
+    min_perf_time = profile_index.get_min_time()
+    max_perf_time = profile_index.get_max_time()
+
+    # intervals are sorted and merged, so a trace spans its first start to its last end,
+    # only traces fully inside the profiled time range are scored
+    trace_starts = trace_non_idle_intervals.get_trace_starts()
+    trace_ends = trace_non_idle_intervals.get_trace_ends()
+    in_range = (trace_starts >= min_perf_time) & (trace_ends <= max_perf_time)
+    trace_ids = trace_non_idle_intervals.trace_ids[in_range]
+    trace_starts = trace_starts[in_range]
+    trace_ends = trace_ends[in_range]
+
+    # (cores x traces x counters) number of non zero samples, a core counts for a trace only
+    # when it has samples in the trace window
+    core_non_zero_counts = np.stack([profile_index.get_window_non_zero_counts(core_id, trace_starts, trace_ends) for core_id in profile_index.core_ids])
+    core_has_samples = np.stack([profile_index.get_window_num_samples(core_id, trace_starts, trace_ends) > 0 for core_id in profile_index.core_ids])
+    non_zero_counts = core_non_zero_counts.sum(axis=0)
+    # the first core with the most non zero instructions, none when no core has any
+    core_instructions = core_non_zero_counts[:, :, INSTRUCTIONS_IDX]
+    core_with_highest_instructions_idx = np.argmax(core_instructions, axis=0)
+    has_instructions = core_instructions.max(axis=0) > 0
+    for trace_id in trace_ids[~has_instructions]:
+        print(f"No instructions data found for trace {trace_id}.")
+
+    total_resource_usage = non_zero_counts.sum(axis=1)
+    scored_idx = np.flatnonzero(has_instructions)
+    if len(scored_idx) == 0:
+        return pd.DataFrame()
+    top_idx = scored_idx[np.argsort(-total_resource_usage[scored_idx], kind="stable")[:num_samples]]
 
-        total_resource_usage = non_zero_llc_loads + non_zero_llc_misses + non_zero_instructions
-        
+    trace_stats = []
+    for idx in top_idx.tolist():
+        core_idx_with_samples = np.flatnonzero(core_has_samples[:, idx]).tolist()
         trace_stats.append({
-            'trace_id': trace_id,
-            'start_time': trace_start,
-            'end_time': trace_end,
-            'non_zero_llc_loads': non_zero_llc_loads,
-            'non_zero_llc_misses': non_zero_llc_misses,
-            'non_zero_instructions': non_zero_instructions,
-            'total_resource_usage': total_resource_usage,
-            'duration': duration,
-            'core_with_highest_instructions': curr_core_with_highest_instructions,
-            'core_to_instructions': core_to_instructions,
-            'core_to_llc_loads': core_to_llc_loads,
-            'core_to_llc_misses': core_to_llc_misses
+            'trace_id': trace_ids[idx],
+            'start_time': int(trace_starts[idx]),
+            'end_time': int(trace_ends[idx]),
+            'non_zero_llc_loads': int(non_zero_counts[idx, LLC_LOADS_IDX]),
+            'non_zero_llc_misses': int(non_zero_counts[idx, LLC_MISSES_IDX]),
+            'non_zero_instructions': int(non_zero_counts[idx, INSTRUCTIONS_IDX]),
+            'total_resource_usage': int(total_resource_usage[idx]),
+            'duration': int(trace_ends[idx] - trace_starts[idx]),
+            'core_with_highest_instructions': profile_index.core_ids[core_with_highest_instructions_idx[idx]],
+            'core_to_instructions': {profile_index.core_ids[core_idx]: int(core_non_zero_counts[core_idx, idx, INSTRUCTIONS_IDX]) for core_idx in core_idx_with_samples},
+            'core_to_llc_loads': {profile_index.core_ids[core_idx]: int(core_non_zero_counts[core_idx, idx, LLC_LOADS_IDX]) for core_idx in core_idx_with_samples},
+            'core_to_llc_misses': {profile_index.core_ids[core_idx]: int(core_non_zero_counts[core_idx, idx, LLC_MISSES_IDX]) for core_idx in core_idx_with_samples}
         })
-    
-    trace_stats_df = pd.DataFrame(trace_stats)
-    if trace_stats_df.empty:
-        return pd.DataFrame()
-    trace_stats_df = trace_stats_df.sort_values(by='total_resource_usage', ascending=False)
-    top_traces = trace_stats_df.head(num_samples)
+    top_traces = pd.DataFrame(trace_stats)
     
     print(f"Top {len(top_traces)} traces by resource usage:")
     for i, (_, row) in enumerate(top_traces.iterrows()):
@@ -454,7 +410,7 @@ def get_highest_resource_usage_traces(
 
 def save_trace_profile_csvs(
     highest_resource_usage_traces: pd.DataFrame,
-    cores_to_profile_data_df: Dict[str, pd.DataFrame],
+    profile_index: ProfileIndex,
     output_dir: str,
     container_name: str,
     config: str
@@ -465,52 +421,39 @@ def save_trace_profile_csvs(
 
     os.makedirs(output_dir, exist_ok=True)
 
-    instructions_df = pd.DataFrame()
-    llc_loads_df = pd.DataFrame()
-    llc_misses_df = pd.DataFrame()
+    # one column per trace indexed by the time since the trace start, traces are aligned on it
+    trace_to_instructions: Dict[str, pd.Series] = {}
+    trace_to_llc_loads: Dict[str, pd.Series] = {}
+    trace_to_llc_misses: Dict[str, pd.Series] = {}
 
     for _, trace in highest_resource_usage_traces.iterrows():
         trace_id = trace["trace_id"]
         trace_start = trace["start_time"]
         trace_end = trace["end_time"]
         core_with_highest_instructions = trace["core_with_highest_instructions"]
-        profile_df = cores_to_profile_data_df[core_with_highest_instructions]
-        profile_df = profile_df[
-            (profile_df["Time"] >= trace_start) & 
-            (profile_df["Time"] <= trace_end)
-        ].copy()
+        profile_df = profile_index.get_window_df(core_with_highest_instructions, trace_start, trace_end)
         if profile_df.empty:
             continue
 
         # Normalize timestamps
-        profile_df["normalized_time"] = profile_df["Time"] - trace_start
+        normalized_time = pd.Index(profile_df["Time"] - trace_start, name="normalized_time")
 
         # Add instructions data from core with highest instructions
-        instructions_df[f"trace_{trace_id}"] = profile_df.set_index("normalized_time")["Instructions"]
-
-        # Sum up LLC loads and misses across all cores
-        total_llc_loads = pd.Series(0, index=profile_df.index)
-        total_llc_misses = pd.Series(0, index=profile_df.index)
-        for core_id, core_df in cores_to_profile_data_df.items():
-            core_df = core_df[
-                (core_df["Time"] >= trace_start) & 
-                (core_df["Time"] <= trace_end)
-            ]
-            if not core_df.empty:
-                core_df = core_df.set_index("Time")
-                total_llc_loads += core_df["LLC-loads"].reindex(profile_df["Time"]).fillna(0)
-                total_llc_misses += core_df["LLC-misses"].reindex(profile_df["Time"]).fillna(0)
-        llc_loads_df[f"trace_{trace_id}"] = total_llc_loads.set_index(profile_df["normalized_time"])
-        llc_misses_df[f"trace_{trace_id}"] = total_llc_misses.set_index(profile_df["normalized_time"])
-
-    instructions_df.to_csv(os.path.join(output_dir, f"traces_instructions_core_{core_with_highest_instructions}_{container_name}_{config}.csv"))
-    llc_loads_df.to_csv(os.path.join(output_dir, f"traces_llc_loads_{container_name}_{config}.csv"))
-    llc_misses_df.to_csv(os.path.join(output_dir, f"traces_llc_misses_{container_name}_{config}.csv"))
+        trace_to_instructions[f"trace_{trace_id}"] = pd.Series(profile_df["Instructions"].to_numpy(), index=normalized_time)
+
+        # Sum up LLC loads and misses across all cores at the timestamps of that core
+        total_llc = sum(profile_index.get_counters_at_times(core_id, profile_df["Time"].to_numpy()) for core_id in profile_index.core_ids)
+        trace_to_llc_loads[f"trace_{trace_id}"] = pd.Series(total_llc[:, LLC_LOADS_IDX], index=normalized_time)
+        trace_to_llc_misses[f"trace_{trace_id}"] = pd.Series(total_llc[:, LLC_MISSES_IDX], index=normalized_time)
+
+    pd.concat(trace_to_instructions, axis=1).to_csv(os.path.join(output_dir, f"traces_instructions_core_{core_with_highest_instructions}_{container_name}_{config}.csv"))
+    pd.concat(trace_to_llc_loads, axis=1).to_csv(os.path.join(output_dir, f"traces_llc_loads_{container_name}_{config}.csv"))
+    pd.concat(trace_to_llc_misses, axis=1).to_csv(os.path.join(output_dir, f"traces_llc_misses_{container_name}_{config}.csv"))
 
     print(f"Saved trace profile CSVs to {output_dir}") 
 
 def plot_traces_start_end_times_and_perf_data(
-    trace_id_to_non_idle_intervals: Dict[str, List[Dict[int, int]]],
+    trace_non_idle_intervals: TraceNonIdleIntervals,
     core_to_profile_data_df: Dict[str, pd.DataFrame],
     output_dir: str
 ) -> None:
@@ -523,11 +466,11 @@ def plot_traces_start_end_times_and_perf_data(
 
     for i, (core_id, perf_df) in enumerate(core_to_profile_data_df.items()):
         ax = axs[i]
-        ax.plot(perf_df['Time'], perf_df['Instructions'], label=f'Core {core_id} Instructions', color='blue', alpha=0.7)
-        for trace_id, non_idle_intervals in trace_id_to_non_idle_intervals.items():
-            non_idle_intervals = sorted(non_idle_intervals, key=lambda x: list(x.keys())[0])
-            trace_start = list(non_idle_intervals[0].keys())[0]
-            trace_end = list(non_idle_intervals[-1].values())[0]
+        time, instructions = decimate_line(perf_df['Time'], perf_df['Instructions'], ax, fig.dpi, f"Core {core_id} Instructions")
+        ax.plot(time, instructions, label=f'Core {core_id} Instructions', color='blue', alpha=0.7)
+        trace_starts = trace_non_idle_intervals.get_trace_starts().tolist()
+        trace_ends = trace_non_idle_intervals.get_trace_ends().tolist()
+        for trace_id, trace_start, trace_end in zip(trace_non_idle_intervals.trace_ids, trace_starts, trace_ends):
             ax.axvline(x=trace_start, color='red', linestyle='--', alpha=0.5)
             ax.axvline(x=trace_end, color='blue', linestyle='--', alpha=0.5)
             ax.axvspan(trace_start, trace_end, alpha=0.3, color='green', label=f'Trace {trace_id}')
@@ -542,15 +485,50 @@ def plot_traces_start_end_times_and_perf_data(
     plt.close()
     print(f"Plot saved to {plot_path}")
 
+def render_trace_zoomed_perf_plot(
+    zoomed_plot_profile_df: pd.DataFrame,
+    normalized_trace_start: float,
+    normalized_trace_end: float,
+    title: str,
+    plot_path: str
+) -> str:
+    fig, axs = plt.subplots(2, 1, figsize=(15, 10))
+    fig.suptitle(title, fontsize=14, fontweight='bold')
+
+    axs[0].scatter(zoomed_plot_profile_df["NormalizedTime"], zoomed_plot_profile_df['LLC-loads'], s=10, alpha=0.7, color="blue", label="LLC Loads")
+    axs[0].scatter(zoomed_plot_profile_df["NormalizedTime"], zoomed_plot_profile_df['LLC-misses'], s=10, alpha=0.7, color="red", label="LLC Misses")
+    axs[0].axvspan(normalized_trace_start, normalized_trace_end, alpha=0.2, color=(1, 0.7, 0.7), label="Trace Window")
+    axs[0].set_title("LLC Loads and LLC Misses (Zoomed In)")
+    axs[0].set_xlabel("Time (microseconds)")
+    axs[0].set_ylabel("Count")
+    axs[0].legend()
+
+    axs[1].scatter(zoomed_plot_profile_df["NormalizedTime"], zoomed_plot_profile_df['Instructions'], s=10, alpha=0.7, color="green", label="Instructions")
+    axs[1].axvspan(normalized_trace_start, normalized_trace_end, alpha=0.2, color=(1, 0.7, 0.7), label="Trace Window")
+    axs[1].set_title("Instructions from Core {core_with_highest_instructions} (Zoomed In)")
+    axs[1].set_xlabel("Time (microseconds)")
+    axs[1].set_ylabel("Instruction (Delta) Count")
+    axs[1].legend()
+
+    plt.tight_layout()
+    plt.savefig(plot_path)
+    plt.close()
+    return plot_path
+
 def plot_highest_resource_usage_traces(
     trace_stats_df: pd.DataFrame,
-    cores_to_profile_data_df: Dict[str, pd.DataFrame],
+    profile_index: ProfileIndex,
     output_dir: str,
     num_samples: int,
     config: str,
-    container_name: str
+    container_name: str,
+    num_workers: int = DEFAULT_RENDER_WORKERS,
+    worker_memory_mb: int = DEFAULT_WORKER_MEMORY_MB
 ) -> None:
+    # the zoomed profile of every sampled trace is gathered here and the figures are rendered in parallel
     num_plots = 0
+    figure_args = []
+    plotted_traces = []
     print(f"Plotting top {min(num_samples, len(trace_stats_df))} traces by resource usage")
 
     for i, trace in trace_stats_df.iterrows():
@@ -563,21 +541,11 @@ def plot_highest_resource_usage_traces(
         core_with_highest_instructions = trace["core_with_highest_instructions"]
 
         # Get performance data for the core with the highest instructions (assumption being the trace was executed on this core)
-        profile_df = cores_to_profile_data_df[core_with_highest_instructions]
-        profile_df["Time"] = profile_df["Time"].astype(int)
-        plot_profile_df = profile_df[
-            (profile_df["Time"] >= trace_start) & 
-            (profile_df["Time"] <= trace_end)
-        ]
-        if plot_profile_df.empty:
+        if profile_index.get_window_num_samples(core_with_highest_instructions, trace_start, trace_end) == 0:
             print(f"No performance data found for trace_id {trace_id}")
             continue
         zoom_margin = 0.01 * (trace_end - trace_start)
-        zoomed_plot_profile_df = profile_df[
-            (profile_df["Time"] >= trace_start - zoom_margin) &
-            (profile_df["Time"] <= trace_end + zoom_margin)
-        ]
-        zoomed_plot_profile_df = zoomed_plot_profile_df.sort_values(by="Time")
+        zoomed_plot_profile_df = profile_index.get_window_df(core_with_highest_instructions, trace_start - zoom_margin, trace_end + zoom_margin)
 
         # make zoomed_plot_profile_df have a contimuous time index from min time to max time and fill the missing values with NaN
         zoomed_plot_profile_df = zoomed_plot_profile_df.set_index("Time")
@@ -585,20 +553,11 @@ def plot_highest_resource_usage_traces(
         zoomed_plot_profile_df = zoomed_plot_profile_df.reset_index()
 
         # Sum up LLC loads and misses across all cores for the trace time window
-        total_llc_loads: pd.DataFrame = pd.DataFrame()
-        total_llc_misses: pd.DataFrame = pd.DataFrame()
-        for _, core_df in cores_to_profile_data_df.items():
-            core_df = core_df[
-                (core_df["Time"] >= trace_start - zoom_margin) &
-                (core_df["Time"] <= trace_end + zoom_margin)
-            ]
-            if not core_df.empty:
-                llc_loads = get_processed_df(core_df, "LLC-loads", False)
-                llc_misses = get_processed_df(core_df, "LLC-misses", False)
-                total_llc_loads = pd.concat([total_llc_loads, llc_loads], axis=0)
-                total_llc_misses = pd.concat([total_llc_misses, llc_misses], axis=0)
-        total_llc_loads = total_llc_loads.groupby("Time").sum()
-        total_llc_misses = total_llc_misses.groupby("Time").sum()
+        total_llc: pd.DataFrame = pd.concat(
+            [profile_index.get_window_df(core_id, trace_start - zoom_margin, trace_end + zoom_margin)[["Time", "LLC-loads", "LLC-misses"]] for core_id in profile_index.core_ids],
+            axis=0).groupby("Time").sum()
+        total_llc_loads = total_llc[["LLC-loads"]]
+        total_llc_misses = total_llc[["LLC-misses"]]
 
         # make sure the total_llc_loads and total_llc_misses have a continuous time index from min time of zoomed_plot_profile_df to max time of zoomed_plot_profile_df
         total_llc_loads = total_llc_loads.reindex(zoomed_plot_profile_df["Time"])
@@ -623,38 +582,27 @@ def plot_highest_resource_usage_traces(
             if part.startswith("cp"):
                 cache_partitions_str = part[2:]
                 break
-        fig, axs = plt.subplots(2, 1, figsize=(15, 10))
         trace_duration = trace_end - trace_start
-        fig.suptitle(
-            f"Container: {container_name} | Cache Partitons: {cache_partitions_str}\nTotal Trace Duration: {trace_duration} μs ",
-            fontsize=14, fontweight='bold'
-        )
+        title = f"Container: {container_name} | Cache Partitons: {cache_partitions_str}\nTotal Trace Duration: {trace_duration} μs "
 
         min_time = zoomed_plot_profile_df["Time"].min()
         zoomed_plot_profile_df["NormalizedTime"] = zoomed_plot_profile_df["Time"] - min_time
         normalized_trace_start = trace_start - min_time
         normalized_trace_end = trace_end - min_time
 
-        axs[0].scatter(zoomed_plot_profile_df["NormalizedTime"], zoomed_plot_profile_df['LLC-loads'], s=10, alpha=0.7, color="blue", label="LLC Loads")
-        axs[0].scatter(zoomed_plot_profile_df["NormalizedTime"], zoomed_plot_profile_df['LLC-misses'], s=10, alpha=0.7, color="red", label="LLC Misses")
-        axs[0].axvspan(normalized_trace_start, normalized_trace_end, alpha=0.2, color=(1, 0.7, 0.7), label="Trace Window")
-        axs[0].set_title("LLC Loads and LLC Misses (Zoomed In)")
-        axs[0].set_xlabel("Time (microseconds)")
-        axs[0].set_ylabel("Count")
-        axs[0].legend()
-
-        axs[1].scatter(zoomed_plot_profile_df["NormalizedTime"], zoomed_plot_profile_df['Instructions'], s=10, alpha=0.7, color="green", label="Instructions")
-        axs[1].axvspan(normalized_trace_start, normalized_trace_end, alpha=0.2, color=(1, 0.7, 0.7), label="Trace Window")
-        axs[1].set_title("Instructions from Core {core_with_highest_instructions} (Zoomed In)")
-        axs[1].set_xlabel("Time (microseconds)")
-        axs[1].set_ylabel("Instruction (Delta) Count")
-        axs[1].legend()
-
-        plt.tight_layout()
-        plt.savefig(f"{output_dir}/trace_{num_plots+1}_{config}_zoomed_perf_plot.png")
-        plt.close()
+        figure_args.append((
+            zoomed_plot_profile_df[["NormalizedTime", "LLC-loads", "LLC-misses", "Instructions"]],
+            normalized_trace_start,
+            normalized_trace_end,
+            title,
+            f"{output_dir}/trace_{num_plots+1}_{config}_zoomed_perf_plot.png"
+        ))
+        plotted_traces.append((trace_id, total_resource_usage))
         num_plots += 1
-        print(f"Plot {num_plots} saved: trace_id={trace_id}, resource_usage={total_resource_usage}") 
+
+    render_figures(render_trace_zoomed_perf_plot, figure_args, num_workers, worker_memory_mb)
+    for i, (trace_id, total_resource_usage) in enumerate(plotted_traces):
+        print(f"Plot {i+1} saved: trace_id={trace_id}, resource_usage={total_resource_usage}")
 
 def main() -> None:
     global DEFAULT_SERVICE_NAME
@@ -672,6 +620,12 @@ def main() -> None:
     trace_profile_csv_dir: str = args.trace_profile_csv_dir
     save_median_resource_usage_csvs: bool = args.save_median_resource_usage_csvs
     non_idle_durations_dir: str = args.non_idle_durations_dir
+    min_cluster_traces: int = args.min_cluster_traces
+    band_method: str = args.band_method
+    band_width: Optional[float] = args.band_width
+    bin_width: float = args.bin_width
+    num_workers: int = args.workers
+    worker_memory_mb: int = args.worker_memory_mb
     
     if args.default_service_name:
         DEFAULT_SERVICE_NAME = args.default_service_name
@@ -689,9 +643,16 @@ def main() -> None:
     print(f"Trace profile CSV directory: {trace_profile_csv_dir}")
     print(f"Save median resource usage CSVs: {save_median_resource_usage_csvs}")
     print(f"Median durations data directory: {non_idle_durations_dir}")
+    print(f"Min cluster traces: {min_cluster_traces}")
+    print(f"Band method: {band_method}")
+    print(f"Band width: {band_width}")
+    print(f"Bin width: {bin_width}")
+    print(f"Workers: {num_workers}")
+    print(f"Worker memory (MB): {worker_memory_mb}")
     
     container_jaeger_traces_df: pd.DataFrame = load_traces_data(
-        traces_data_dir, service_name_for_traces, test_name, config, container_name)
+        traces_data_dir, service_name_for_traces, test_name, config, container_name,
+        ['trace_id', 'service', 'operation', 'start_time', 'end_time', 'non_idle_intervals'])
     cores_to_profile_data_df: pd.DataFrame = load_profile_data(profile_data_dir)
 
     if container_jaeger_traces_df.empty:
@@ -720,54 +681,78 @@ def main() -> None:
     print(f"Performance data time range [{min_perf_time_dt} - {max_perf_time_dt}] aka [{min_perf_time} - {max_perf_time}]")
     print(f"Trace data time range [{min_trace_time_dt} - {max_trace_time_dt}] aka [{min_trace_time} - {max_trace_time}]")
 
-    all_trace_ids_to_non_idle_intervals: Dict[str, List[Dict[int, int]]] = get_trace_id_to_non_idle_intervals(container_jaeger_traces_df)
-    if not all_trace_ids_to_non_idle_intervals:
+    all_trace_non_idle_intervals: TraceNonIdleIntervals = get_trace_id_to_non_idle_intervals(container_jaeger_traces_df)
+    if len(all_trace_non_idle_intervals) == 0:
         print("No non-idle intervals found in traces.")
         return
     
     print("\nPlotting traces start/end times and performance data...")
     plot_traces_start_end_times_and_perf_data(
-        all_trace_ids_to_non_idle_intervals,
+        all_trace_non_idle_intervals,
         cores_to_profile_data_df,
         plot_dir
     )
     
-    median_non_idle_intervals = get_median_non_idle_intervals(all_trace_ids_to_non_idle_intervals)
-    # filter out traces with non idle intervals not equal to median
-    filtered_trace_ids_to_non_idle_intervals = {trace_id: non_idle_intervals for trace_id, non_idle_intervals in all_trace_ids_to_non_idle_intervals.items() if len(non_idle_intervals) == median_non_idle_intervals}
-    if not filtered_trace_ids_to_non_idle_intervals:
-        print(f"No traces found with {median_non_idle_intervals} number of non idle intervals.")
-        return
-    
-    median_duration_per_non_idle_interval, non_idle_duration_index_to_trace_id_non_idle_duration_map = get_median_duration_information_for_non_idle_intervals(filtered_trace_ids_to_non_idle_intervals, median_non_idle_intervals)
-    selected_trace_ids = get_selected_traces_based_non_median_non_idle_intervals(
-        median_duration_per_non_idle_interval,
-        non_idle_duration_index_to_trace_id_non_idle_duration_map,
-        median_non_idle_intervals
-    )
-    # filter out traces with trace ids not in selected_trace_ids
-    final_trace_ids_to_non_idle_intervals = {trace_id: non_idle_intervals for trace_id, non_idle_intervals in filtered_trace_ids_to_non_idle_intervals.items() if trace_id in selected_trace_ids}
-    if not filtered_trace_ids_to_non_idle_intervals:
-        print("No traces found after filtering by median duration +- 1 standard deviation.")
-        return
+    # every core's samples are sorted once, the trace windows below are joined with them by time
+    profile_index = ProfileIndex(cores_to_profile_data_df)
+    # the samples of all cores within the traces on one time axis, shared by every shape cluster
+    union_timeline = UnionTimeline(profile_index, min_trace_time, max_trace_time)
+    print(f"Built {union_timeline}")
+
+    # the aligned median analysis runs once per span tree shape cluster, the selected traces
+    # of every cluster are then candidates for the highest resource usage samples
+    selected_trace_non_idle_intervals: List[TraceNonIdleIntervals] = []
+    aligned_figure_args: List[Tuple] = []
+    shape_clusters = get_shape_cluster_non_idle_intervals(container_jaeger_traces_df, all_trace_non_idle_intervals, min_cluster_traces)
+    for cluster_idx, (shape, cluster_trace_non_idle_intervals) in enumerate(shape_clusters):
+        print(f"\nShape cluster {cluster_idx} [{shape}] with [{len(cluster_trace_non_idle_intervals)}] traces")
+        median_non_idle_intervals, filtered_trace_non_idle_intervals = filter_traces_with_median_non_idle_intervals(cluster_trace_non_idle_intervals)
+        if len(filtered_trace_non_idle_intervals) == 0:
+            print(f"No traces found with {median_non_idle_intervals} number of non idle intervals.")
+            continue
 
-    print("\nPlotting aligned median resource usage...")
-    plot_aligned_median_resource_usage(
-        final_trace_ids_to_non_idle_intervals,
-        median_non_idle_intervals,
-        median_duration_per_non_idle_interval,
-        cores_to_profile_data_df,
-        profile_data_dir,
-        plot_dir,
-        config,
-        container_name,
-        save_median_resource_usage_csvs,
-    )
+        median_duration_per_non_idle_interval, duration_matrix = get_median_duration_information_for_non_idle_intervals(filtered_trace_non_idle_intervals, median_non_idle_intervals)
+        cluster_final_trace_non_idle_intervals = get_selected_traces_based_non_median_non_idle_intervals(
+            filtered_trace_non_idle_intervals,
+            duration_matrix,
+            band_method,
+            band_width
+        )
+        if cluster_final_trace_non_idle_intervals is None:
+            print("No traces found after filtering by the median duration band.")
+            continue
+        selected_trace_non_idle_intervals.append(cluster_final_trace_non_idle_intervals)
+
+        print("\nPlotting aligned median resource usage...")
+        cluster_aligned_figure_args = get_aligned_median_resource_usage(
+            cluster_final_trace_non_idle_intervals,
+            median_non_idle_intervals,
+            median_duration_per_non_idle_interval,
+            union_timeline,
+            profile_data_dir,
+            plot_dir,
+            config,
+            container_name,
+            save_median_resource_usage_csvs,
+            # the largest cluster keeps the unsuffixed file names of the single cluster analysis
+            f"shape{cluster_idx}" if cluster_idx > 0 else "",
+            bin_width,
+        )
+        if cluster_aligned_figure_args is not None:
+            aligned_figure_args.append(cluster_aligned_figure_args)
+
+    # the aligned plots of all shape clusters are rendered together
+    for png_file_names in render_figures(render_aligned_median_resource_usage, aligned_figure_args, num_workers, worker_memory_mb):
+        print(f"Aligned median resource usage plots saved as {' and '.join(png_file_names)} in {plot_dir}")
+    if not selected_trace_non_idle_intervals:
+        print("No traces selected in any shape cluster.")
+        return
+    final_trace_non_idle_intervals = concat_trace_non_idle_intervals(selected_trace_non_idle_intervals)
 
     print("\nGetting highest resource usage traces...")
     highest_resource_usage_traces = get_highest_resource_usage_traces(
-        final_trace_ids_to_non_idle_intervals,
-        cores_to_profile_data_df,
+        final_trace_non_idle_intervals,
+        profile_index,
         samples
     )
     if highest_resource_usage_traces.empty:
@@ -777,11 +762,13 @@ def main() -> None:
     print("\nPlotting profile for highest resource usage traces...")
     plot_highest_resource_usage_traces(
         highest_resource_usage_traces, 
-        cores_to_profile_data_df, 
+        profile_index, 
         plot_dir, 
         samples, 
         config, 
-        container_name
+        container_name,
+        num_workers,
+        worker_memory_mb
     )
 
     if save_trace_profile_csvs:
@@ -789,7 +776,7 @@ def main() -> None:
             print("Saving trace profile CSVs...")
             save_trace_profile_csvs(
                 highest_resource_usage_traces,
-                cores_to_profile_data_df,
+                profile_index,
                 args.trace_profile_csv_dir,
                 container_name,
                 config
@@ -0,0 +1,36 @@
+import math
+import numpy as np
+from typing import List
+
+# Bins samples by their relative position within a non idle interval and takes percentiles
+# per bin over whole arrays: bin indices come from np.digitize, the values are sorted once by
+# (bin, value) and every bin's percentiles are read from its segment of the sorted values by
+# linear interpolation, the same as np.percentile and np.median per bin.
+DEFAULT_BIN_WIDTH = 1
+BAND_PERCENTILES = [25, 50, 75]
+
+def get_num_bins(median_duration: int, bin_width: float = DEFAULT_BIN_WIDTH) -> int:
+    # bins of bin_width microseconds over the median duration of the interval
+    return max(1, math.ceil(median_duration / bin_width))
+
+def get_bin_indices(relative_positions: np.ndarray, num_bins: int) -> np.ndarray:
+    # bin i holds the positions in [i, i + 1) / num_bins, the last bin also holds position 1
+    return np.digitize(relative_positions * num_bins, np.arange(1, num_bins))
+
+def get_segmented_percentiles(segment_ids: np.ndarray, values: np.ndarray, num_segments: int, percentiles: List[float] = BAND_PERCENTILES) -> np.ndarray:
+    # (segments x percentiles) percentiles of the values of every segment, NaN for empty segments
+    order = np.lexsort((values, segment_ids))
+    sorted_values = values[order].astype(np.float64)
+    counts = np.bincount(segment_ids, minlength=num_segments)
+    segment_starts = np.cumsum(counts) - counts
+    has_values = counts > 0
+
+    segment_percentiles = np.full((num_segments, len(percentiles)), np.nan)
+    for i, percentile in enumerate(percentiles):
+        positions = (counts[has_values] - 1) * (percentile / 100)
+        low = np.floor(positions).astype(np.int64)
+        high = np.ceil(positions).astype(np.int64)
+        low_values = sorted_values[segment_starts[has_values] + low]
+        high_values = sorted_values[segment_starts[has_values] + high]
+        segment_percentiles[has_values, i] = low_values + (high_values - low_values) * (positions - low)
+    return segment_percentiles
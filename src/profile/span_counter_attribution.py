@@ -0,0 +1,182 @@
+import argparse
+import os
+import time
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from plot_profile_utils import load_profile_data
+from interval_join import ProfileIndex
+from trace_exemplars import DEFAULT_TOP_K, DEFAULT_RESERVOIR_SIZE, update_run_exemplars
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../traces')))
+from src.traces.collect_non_idle_duration_data import load_traces_data, get_cache_partitions_str, get_run_id
+from src.traces.non_idle_intervals import TraceNonIdleIntervals, get_span_intervals, merge_trace_non_idle_intervals
+
+# Attributes the hardware counter deltas sampled on every profiled core to every non idle
+# interval of every span of the container, with the prefix sums of the profile index. The
+# profiler has no notion of which request a core works on, so spans running at the same
+# time on the container are each attributed the samples of their window.
+SPAN_COUNTER_COLUMNS = ["llc_loads", "llc_misses", "instructions"]
+DEFAULT_CHUNK_TRACES = 1000
+SPAN_COUNTERS_SUFFIX = "_span_counters.csv"
+OPERATION_COUNTERS_SUFFIX = "_operation_counters.csv"
+
+# set before the worker pool forks so the workers share it instead of receiving a copy per task
+profile_index: Optional[ProfileIndex] = None
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Attribute hardware counters to every span of a container.")
+    parser.add_argument("--test-name", type=str, required=True, help="Test name")
+    parser.add_argument("--service-name-for-traces", type=str, required=True, help="Service name for traces")
+    parser.add_argument("--container-name", type=str, required=True, help="Container name")
+    parser.add_argument("--config", type=str, required=True, help="Test configuration")
+    parser.add_argument("--profile-data-dir", type=str, required=True, help="Profile Data directory")
+    parser.add_argument("--trace-data-dir", type=str, required=True, help="Traces Data directory")
+    parser.add_argument("--output-dir", type=str, help="Output directory for the span counters CSVs, defaults to the traces data directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of attribution processes")
+    parser.add_argument("--chunk-traces", type=int, default=DEFAULT_CHUNK_TRACES, help="Number of traces per attribution task")
+    parser.add_argument("--non-idle-durations-dir", type=str, help="Non idle durations data directory, the run's traces are added to the exemplars kept there when given")
+    parser.add_argument("--run-id", type=str, help="Unique id of the run for the exemplars, defaults to the name of the run directory holding data/trace_data")
+    parser.add_argument("--top-k", type=int, default=DEFAULT_TOP_K, help="Number of top exemplar traces kept per score")
+    parser.add_argument("--reservoir-size", type=int, default=DEFAULT_RESERVOIR_SIZE, help="Number of typical exemplar traces kept")
+
+    return parser.parse_args()
+
+def set_profile_data(cores_to_profile_data_df: Dict[str, pd.DataFrame]) -> None:
+    # must run before the worker pool is created, workers only see the data of their fork
+    global profile_index
+    profile_index = ProfileIndex(cores_to_profile_data_df)
+
+def sum_counters_in_windows(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # counters and number of samples of all cores with start <= Time <= end, per window
+    return profile_index.get_all_cores_window_sums(starts, ends)
+
+def attribute_span_chunk(span_offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # per span totals over its non idle intervals, every span has at least one interval
+    counter_sums, num_samples = sum_counters_in_windows(starts, ends)
+    return np.add.reduceat(counter_sums, span_offsets[:-1], axis=0), np.add.reduceat(num_samples, span_offsets[:-1])
+
+def get_trace_chunks(trace_ids: np.ndarray, chunk_traces: int) -> List[Tuple[int, int]]:
+    # (first span, last span + 1) of every chunk, spans are sorted by trace so chunks never split a trace
+    trace_starts = np.flatnonzero(np.append(True, trace_ids[1:] != trace_ids[:-1]))
+    chunk_starts = trace_starts[::chunk_traces].tolist()
+    return list(zip(chunk_starts, chunk_starts[1:] + [len(trace_ids)]))
+
+def attribute_span_counters(traces_df: pd.DataFrame, num_workers: int, chunk_traces: int) -> pd.DataFrame:
+    traces_df = traces_df.sort_values(by="trace_id", kind="stable").reset_index(drop=True)
+    span_offsets, starts, ends = get_span_intervals(traces_df["non_idle_intervals"])
+    chunks = get_trace_chunks(traces_df["trace_id"].to_numpy(dtype=object), chunk_traces)
+
+    chunk_args = []
+    for first_span, last_span in chunks:
+        chunk_offsets = span_offsets[first_span:last_span + 1]
+        chunk_args.append((chunk_offsets - chunk_offsets[0], starts[chunk_offsets[0]:chunk_offsets[-1]], ends[chunk_offsets[0]:chunk_offsets[-1]]))
+
+    counter_sums, num_samples = [], []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk_counter_sums, chunk_num_samples in executor.map(attribute_span_chunk, *zip(*chunk_args)):
+            counter_sums.append(chunk_counter_sums)
+            num_samples.append(chunk_num_samples)
+
+    span_counters_df = traces_df.drop(columns=["non_idle_intervals"])
+    counter_sums = np.concatenate(counter_sums) if counter_sums else np.zeros((0, len(SPAN_COUNTER_COLUMNS)), dtype=np.int64)
+    for i, column in enumerate(SPAN_COUNTER_COLUMNS):
+        span_counters_df[column] = counter_sums[:, i]
+    span_counters_df["mpki"] = get_mpki(span_counters_df["llc_misses"], span_counters_df["instructions"])
+    span_counters_df["samples"] = np.concatenate(num_samples) if num_samples else np.zeros(0, dtype=np.int64)
+    return span_counters_df
+
+def get_trace_counters(trace_non_idle_intervals: TraceNonIdleIntervals) -> pd.DataFrame:
+    # per trace counters over its merged non idle intervals, so concurrent spans of a trace are counted once
+    counter_sums, _ = sum_counters_in_windows(trace_non_idle_intervals.starts, trace_non_idle_intervals.ends)
+    trace_counters_df = pd.DataFrame({
+        "trace_id": trace_non_idle_intervals.trace_ids,
+        "start_time": trace_non_idle_intervals.get_trace_starts(),
+        "end_time": trace_non_idle_intervals.get_trace_ends(),
+        "non_idle_duration": trace_non_idle_intervals.get_non_idle_durations(),
+    })
+    trace_counter_sums = np.add.reduceat(counter_sums, trace_non_idle_intervals.offsets[:-1], axis=0)
+    for i, column in enumerate(SPAN_COUNTER_COLUMNS):
+        trace_counters_df[column] = trace_counter_sums[:, i]
+    trace_counters_df["mpki"] = get_mpki(trace_counters_df["llc_misses"], trace_counters_df["instructions"])
+    return trace_counters_df
+
+def get_mpki(llc_misses: pd.Series, instructions: pd.Series) -> pd.Series:
+    # LLC misses per thousand instructions, NaN when no instructions were sampled
+    return llc_misses * 1000 / instructions.where(instructions > 0)
+
+def get_operation_counters(span_counters_df: pd.DataFrame) -> pd.DataFrame:
+    operation_counters_df = span_counters_df.groupby(["service", "operation"], as_index=False).agg(
+        num_spans=("span_id", "count"),
+        llc_loads=("llc_loads", "sum"),
+        llc_misses=("llc_misses", "sum"),
+        instructions=("instructions", "sum"),
+        samples=("samples", "sum"),
+        median_span_mpki=("mpki", "median"),
+    )
+    operation_counters_df["mpki"] = get_mpki(operation_counters_df["llc_misses"], operation_counters_df["instructions"])
+    return operation_counters_df.sort_values(by="llc_misses", ascending=False, ignore_index=True)
+
+def main() -> None:
+    args: argparse.Namespace = parse_arguments()
+    test_name: str = args.test_name.replace(" ", "_")
+    config: str = args.config.replace(" ", "_")
+    output_dir: str = args.output_dir if args.output_dir else args.trace_data_dir
+    run_id: str = args.run_id if args.run_id else get_run_id(args.trace_data_dir)
+
+    print("Running with the following arguments:")
+    print(f"Test name: {test_name}")
+    print(f"Service name for traces: {args.service_name_for_traces}")
+    print(f"Container name: {args.container_name}")
+    print(f"Configuration: {config}")
+    print(f"Profile data directory: {args.profile_data_dir}")
+    print(f"Traces data directory: {args.trace_data_dir}")
+    print(f"Output directory: {output_dir}")
+    print(f"Workers: {args.workers}")
+    print(f"Chunk traces: {args.chunk_traces}")
+    print(f"Non idle durations directory: {args.non_idle_durations_dir}")
+    print(f"Run ID: {run_id}")
+    print(f"Top K: {args.top_k}")
+    print(f"Reservoir size: {args.reservoir_size}")
+
+    traces_df: pd.DataFrame = load_traces_data(
+        args.trace_data_dir, args.service_name_for_traces, test_name, config, args.container_name,
+        ['trace_id', 'span_id', 'service', 'operation', 'start_time', 'end_time', 'non_idle_execution_time', 'non_idle_intervals'])
+    if traces_df.empty:
+        print(f"No traces found for container [{args.container_name}] with service name [{args.service_name_for_traces}]")
+        return
+    cores_to_profile_data_df: Dict[str, pd.DataFrame] = load_profile_data(args.profile_data_dir)
+    if len(cores_to_profile_data_df) == 0:
+        print(f"No performance data found for container [{args.container_name}]")
+        return
+
+    start_time = time.perf_counter()
+    set_profile_data(cores_to_profile_data_df)
+    span_counters_df = attribute_span_counters(traces_df, args.workers, args.chunk_traces)
+    elapsed_time = time.perf_counter() - start_time
+    print(f"Attributed counters of [{len(cores_to_profile_data_df)}] cores to [{len(span_counters_df)}] spans in [{elapsed_time:.2f}s] with [{args.workers}] workers")
+
+    os.makedirs(output_dir, exist_ok=True)
+    file_prefix = f"{args.service_name_for_traces}_{test_name}_{config}_{args.container_name}"
+    span_counters_csv_file_path = os.path.join(output_dir, f"{file_prefix}{SPAN_COUNTERS_SUFFIX}")
+    span_counters_df.to_csv(span_counters_csv_file_path, index=False)
+    print(f"Span counters saved to {span_counters_csv_file_path}")
+
+    operation_counters_df = get_operation_counters(span_counters_df)
+    operation_counters_csv_file_path = os.path.join(output_dir, f"{file_prefix}{OPERATION_COUNTERS_SUFFIX}")
+    operation_counters_df.to_csv(operation_counters_csv_file_path, index=False)
+    print(operation_counters_df.to_string(index=False))
+    print(f"Operation counters saved to {operation_counters_csv_file_path}")
+
+    if args.non_idle_durations_dir:
+        trace_non_idle_intervals = merge_trace_non_idle_intervals(traces_df)
+        if len(trace_non_idle_intervals) > 0:
+            update_run_exemplars(
+                os.path.join(args.non_idle_durations_dir, test_name), args.container_name, run_id, config, get_cache_partitions_str(config),
+                get_trace_counters(trace_non_idle_intervals), args.top_k, args.reservoir_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import argparse
+import heapq
+import json
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional, Tuple
+
+# Keeps exemplar traces of a container across runs in O(K) memory: a bounded min heap of
+# the top K traces per score, so the tail exemplars of every run are compared against the
+# smallest kept score only, and a uniform reservoir sample (Algorithm R) of typical traces.
+# The state is saved after every run, so a finished run is added once and old runs are
+# never scored again. Runs are keyed by a unique run id, a config can be run many times.
+EXEMPLAR_SCORES = ["non_idle_duration", "llc_misses", "instructions"]
+EXEMPLAR_COLUMNS = ["run", "config", "trace_id", "start_time", "end_time", "non_idle_duration", "llc_loads", "llc_misses", "instructions", "mpki"]
+DEFAULT_TOP_K = 5
+DEFAULT_RESERVOIR_SIZE = 20
+DEFAULT_SEED = 0
+EXEMPLARS_DIR = "exemplars"
+
+class ExemplarTracker:
+    def __init__(self, top_k: int = DEFAULT_TOP_K, reservoir_size: int = DEFAULT_RESERVOIR_SIZE, seed: int = DEFAULT_SEED):
+        self.top_k = top_k
+        self.reservoir_size = reservoir_size
+        self.seed = seed
+        self.num_seen = 0
+        self.runs: List[str] = []
+        self.run_to_config: Dict[str, str] = {}
+        # (score, run, trace_id, exemplar), the run and trace id break ties so exemplars are never compared
+        self.__score_to_heap: Dict[str, List[Tuple[float, str, str, Dict[str, Any]]]] = {score: [] for score in EXEMPLAR_SCORES}
+        self.__reservoir: List[Dict[str, Any]] = []
+
+    def has_run(self, run: str) -> bool:
+        return run in self.runs
+
+    def add_run(self, run: str, config: str, trace_exemplars_df: pd.DataFrame) -> None:
+        # trace_exemplars_df has one row per trace with EXEMPLAR_COLUMNS except run and config
+        if self.has_run(run):
+            print(f"[WARNING:] Run [{run}] already added to the exemplars, skipping it")
+            return
+        self.runs.append(run)
+        self.run_to_config[run] = config
+        if trace_exemplars_df.empty:
+            return
+        trace_exemplars_df = trace_exemplars_df.reset_index(drop=True)
+
+        for score in EXEMPLAR_SCORES:
+            # only the top K of the run can enter the heap, found with a partial sort
+            scores = trace_exemplars_df[score].to_numpy(dtype=np.float64)
+            candidates = np.flatnonzero(~np.isnan(scores))
+            if len(candidates) > self.top_k:
+                candidates = candidates[np.argpartition(-scores[candidates], self.top_k - 1)[:self.top_k]]
+            heap = self.__score_to_heap[score]
+            for idx in candidates.tolist():
+                entry = (float(scores[idx]), run, str(trace_exemplars_df.at[idx, "trace_id"]), self.__get_exemplar(run, config, trace_exemplars_df, idx))
+                if len(heap) < self.top_k:
+                    heapq.heappush(heap, entry)
+                elif entry[:3] > heap[0][:3]:
+                    heapq.heapreplace(heap, entry)
+
+        # Algorithm R over the run: the i-th trace seen overall replaces a random slot with
+        # probability reservoir_size / (i + 1), applied in order so later traces win
+        positions = self.num_seen + np.arange(len(trace_exemplars_df), dtype=np.int64)
+        rng = np.random.default_rng([self.seed, self.num_seen])
+        slots = np.where(positions < self.reservoir_size, positions, rng.integers(0, positions + 1))
+        for idx in np.flatnonzero(slots < self.reservoir_size).tolist():
+            exemplar = self.__get_exemplar(run, config, trace_exemplars_df, idx)
+            if slots[idx] < len(self.__reservoir):
+                self.__reservoir[slots[idx]] = exemplar
+            else:
+                self.__reservoir.append(exemplar)
+        self.num_seen += len(trace_exemplars_df)
+
+    @staticmethod
+    def __get_exemplar(run: str, config: str, trace_exemplars_df: pd.DataFrame, idx: int) -> Dict[str, Any]:
+        exemplar = {"run": run, "config": config}
+        for column in EXEMPLAR_COLUMNS[2:]:
+            value = trace_exemplars_df.at[idx, column]
+            exemplar[column] = value.item() if isinstance(value, np.generic) else value
+        return exemplar
+
+    def get_top_exemplars(self, score: str) -> List[Dict[str, Any]]:
+        return [entry[3] for entry in sorted(self.__score_to_heap[score], key=lambda entry: entry[:3], reverse=True)]
+
+    def get_typical_exemplars(self) -> List[Dict[str, Any]]:
+        return sorted(self.__reservoir, key=lambda exemplar: exemplar["non_idle_duration"])
+
+    def get_exemplars_df(self) -> pd.DataFrame:
+        rows = []
+        for score in EXEMPLAR_SCORES:
+            rows.extend({"kind": f"top_{score}", "rank": rank, **exemplar} for rank, exemplar in enumerate(self.get_top_exemplars(score), start=1))
+        rows.extend({"kind": "typical", "rank": rank, **exemplar} for rank, exemplar in enumerate(self.get_typical_exemplars(), start=1))
+        return pd.DataFrame(rows, columns=["kind", "rank"] + EXEMPLAR_COLUMNS)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "top_k": self.top_k,
+            "reservoir_size": self.reservoir_size,
+            "seed": self.seed,
+            "num_seen": self.num_seen,
+            "runs": self.runs,
+            "run_to_config": self.run_to_config,
+            "top": {score: self.get_top_exemplars(score) for score in EXEMPLAR_SCORES},
+            "reservoir": self.__reservoir,
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "ExemplarTracker":
+        tracker = ExemplarTracker(data["top_k"], data["reservoir_size"], data["seed"])
+        tracker.num_seen = data["num_seen"]
+        tracker.runs = data["runs"]
+        tracker.run_to_config = data["run_to_config"]
+        for score in EXEMPLAR_SCORES:
+            heap = [(float(exemplar[score]), exemplar["run"], str(exemplar["trace_id"]), exemplar) for exemplar in data["top"].get(score, [])]
+            heapq.heapify(heap)
+            tracker.__score_to_heap[score] = heap
+        tracker.__reservoir = data["reservoir"]
+        return tracker
+
+    def __repr__(self):
+        return f"ExemplarTracker(top_k={self.top_k}, " \
+            f"reservoir_size={self.reservoir_size}, " \
+            f"num_runs={len(self.runs)}, " \
+            f"num_seen={self.num_seen})"
+
+def get_container_exemplars_dir(non_idle_durations_test_dir: str, container_name: str) -> str:
+    return os.path.join(non_idle_durations_test_dir, EXEMPLARS_DIR, container_name)
+
+def get_exemplars_file_path(non_idle_durations_test_dir: str, container_name: str, cache_partitions: str) -> str:
+    return os.path.join(get_container_exemplars_dir(non_idle_durations_test_dir, container_name), f"cp{cache_partitions}.json")
+
+def load_exemplar_tracker(exemplars_file_path: str, top_k: int = DEFAULT_TOP_K, reservoir_size: int = DEFAULT_RESERVOIR_SIZE) -> ExemplarTracker:
+    if not os.path.exists(exemplars_file_path):
+        return ExemplarTracker(top_k, reservoir_size)
+    with open(exemplars_file_path, "r") as f:
+        return ExemplarTracker.from_dict(json.load(f))
+
+def save_exemplar_tracker(tracker: ExemplarTracker, exemplars_file_path: str) -> None:
+    os.makedirs(os.path.dirname(exemplars_file_path), exist_ok=True)
+    with open(f"{exemplars_file_path}.tmp", "w") as f:
+        json.dump(tracker.to_dict(), f)
+    os.replace(f"{exemplars_file_path}.tmp", exemplars_file_path)
+
+def update_run_exemplars(
+        non_idle_durations_test_dir: str,
+        container_name: str,
+        run_id: str,
+        config: str,
+        cache_partitions: str,
+        trace_exemplars_df: pd.DataFrame,
+        top_k: int = DEFAULT_TOP_K,
+        reservoir_size: int = DEFAULT_RESERVOIR_SIZE,
+) -> Optional[ExemplarTracker]:
+    # one tracker per container and cache partition count, every run of every config with
+    # that cache partition count is added to it once
+    exemplars_file_path = get_exemplars_file_path(non_idle_durations_test_dir, container_name, cache_partitions)
+    tracker = load_exemplar_tracker(exemplars_file_path, top_k, reservoir_size)
+    if tracker.has_run(run_id):
+        print(f"Run [{run_id}] already in the exemplars at {exemplars_file_path}, not adding it again")
+        return tracker
+    tracker.add_run(run_id, config, trace_exemplars_df)
+    save_exemplar_tracker(tracker, exemplars_file_path)
+    print(f"Added [{len(trace_exemplars_df)}] traces of run [{run_id}] of config [{config}] to {tracker}, saved to {exemplars_file_path}")
+    return tracker
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Print and save the exemplar traces of a container across runs.")
+    parser.add_argument("--non-idle-durations-dir", type=str, required=True, help="Non idle durations data directory")
+    parser.add_argument("--test-name", type=str, required=True, help="Test name")
+    parser.add_argument("--container-name", type=str, required=True, help="Container name")
+
+    return parser.parse_args()
+
+def main() -> None:
+    args: argparse.Namespace = parse_arguments()
+    test_name: str = args.test_name.replace(" ", "_")
+
+    print("Running with the following arguments:")
+    print(f"Non idle durations directory: {args.non_idle_durations_dir}")
+    print(f"Test name: {test_name}")
+    print(f"Container name: {args.container_name}")
+
+    exemplars_dir = get_container_exemplars_dir(os.path.join(args.non_idle_durations_dir, test_name), args.container_name)
+    if not os.path.isdir(exemplars_dir):
+        print(f"No exemplars found in {exemplars_dir}")
+        return
+
+    exemplars_dfs = []
+    for file in sorted(os.listdir(exemplars_dir)):
+        if not file.endswith(".json"):
+            continue
+        tracker = load_exemplar_tracker(os.path.join(exemplars_dir, file))
+        exemplars_df = tracker.get_exemplars_df()
+        exemplars_df.insert(0, "cache_partitions", file[len("cp"):-len(".json")])
+        exemplars_dfs.append(exemplars_df)
+        print(f"\n{file}: {tracker}, runs: {tracker.run_to_config}")
+        print(exemplars_df.to_string(index=False))
+    if not exemplars_dfs:
+        print(f"No exemplars found in {exemplars_dir}")
+        return
+
+    exemplars_csv_file_path = os.path.join(exemplars_dir, f"{args.container_name}_exemplars.csv")
+    pd.concat(exemplars_dfs, ignore_index=True).to_csv(exemplars_csv_file_path, index=False)
+    print(f"\nExemplars saved to {exemplars_csv_file_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import pandas as pd
+import requests
+from typing import Any, Callable, Dict, Iterable, Iterator, List
+import traces_handler
+from traces_handler import fetch_traces, get_trace_ids, iter_json_array_items, SPAN_TABLE_BATCH_TRACES
+from span_table import get_span_records_df
+from jaeger_grpc import decode_traces_data, iter_find_traces_messages, iter_streamed_traces
+from jaeger_stand_in import create_synthetic_traces, load_recorded_traces, start_jaeger_grpc_stand_in, start_jaeger_stand_in
+
+INGEST_MODES = ["per-trace", "bulk", "stream", "grpc"]
+# traces are parsed into span records in batches of SPAN_TABLE_BATCH_TRACES with
+# get_span_records_df and the batches concatenated, the same way parse_and_save_traces does
+STAGES = ["search", "fetch", "decode", "span_table", "dataframe", "csv_write"]
+# stages whose CPU time counts as parsing, measured on the ingesting thread
+PARSE_STAGES = ["decode", "span_table"]
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark Jaeger trace ingest throughput, peak RSS and per stage cost")
+    parser.add_argument("--jaeger-url", type=str, help="Benchmark against this Jaeger query URL instead of a local stand-in")
+    parser.add_argument("--jaeger-grpc-target", type=str, help="Jaeger gRPC query service host:port, used with --jaeger-url for the grpc mode")
+    parser.add_argument("--traces-dir", type=str, help="Serve saved trace JSONs from the stand-in instead of synthetic traces")
+    parser.add_argument("--service-name-for-traces", type=str, default="nginx-web-server", help="Service name to search traces for")
+    parser.add_argument("--num-traces", type=int, default=1000, help="Number of synthetic traces, also the search limit")
+    parser.add_argument("--spans-per-trace", type=int, default=20, help="Number of spans per synthetic trace")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Stand-in latency per request in milliseconds")
+    parser.add_argument("--fetch-workers", type=int, default=traces_handler.DEFAULT_FETCH_WORKERS, help="Number of concurrent trace fetch workers")
+    parser.add_argument("--modes", type=str, default=",".join(INGEST_MODES), help="Comma separated ingest modes to benchmark")
+    return parser.parse_args()
+
+def run_ingest(mode: str, jaeger_url: str, jaeger_grpc_target: str, service_name: str, limit: int, num_workers: int, output_dir: str, results: multiprocessing.Queue) -> None:
+    # runs in its own process so peak RSS is measured per mode
+    traces_handler.JAEGER_URL = jaeger_url
+    stage_to_seconds: Dict[str, float] = {stage: 0.0 for stage in STAGES}
+    parse_cpu_seconds = 0.0
+    wire_bytes = 0
+
+    def timed(stage: str, fn: Callable, *args: Any) -> Any:
+        nonlocal parse_cpu_seconds
+        start_time = time.perf_counter()
+        start_cpu_time = time.thread_time()
+        result = fn(*args)
+        stage_to_seconds[stage] += time.perf_counter() - start_time
+        if stage in PARSE_STAGES:
+            parse_cpu_seconds += time.thread_time() - start_cpu_time
+        return result
+
+    def counted(chunks: Iterable[bytes]) -> Iterator[bytes]:
+        # response bodies and gRPC messages as received, before any decoding
+        nonlocal wire_bytes
+        for chunk in chunks:
+            wire_bytes += len(chunk)
+            yield chunk
+
+    traces_to_parse: List[Dict[str, Any]] = []
+    dfs: List[pd.DataFrame] = []
+    num_traces = 0
+
+    def parse(trace: Dict[str, Any]) -> None:
+        nonlocal traces_to_parse, num_traces
+        traces_to_parse.append(trace)
+        num_traces += 1
+        if len(traces_to_parse) >= SPAN_TABLE_BATCH_TRACES:
+            dfs.append(timed("span_table", get_span_records_df, traces_to_parse))
+            traces_to_parse = []
+
+    start_time = time.perf_counter()
+
+    if mode == "per-trace":
+        trace_ids = timed("search", get_trace_ids, service_name, limit)
+        fetched_traces = fetch_traces(trace_ids, num_workers)
+        while True:
+            fetched_trace = timed("fetch", next, fetched_traces, None)
+            if fetched_trace is None:
+                break
+            wire_bytes += len(fetched_trace[1].encode())
+            trace = timed("decode", json.loads, fetched_trace[1])["data"][0]
+            parse(trace)
+    elif mode == "bulk":
+        url = f"{traces_handler.JAEGER_URL}{traces_handler.JAEGER_TRACES_API_PATH}"
+        response_content = timed("search", lambda: requests.get(url, params={"service": service_name, "limit": limit}).content)
+        wire_bytes += len(response_content)
+        traces = timed("decode", json.loads, response_content)["data"]
+        for trace in traces:
+            parse(trace)
+    elif mode == "stream":
+        # fetching and decoding are interleaved, both are counted as decode
+        url = f"{traces_handler.JAEGER_URL}{traces_handler.JAEGER_TRACES_API_PATH}"
+        response = requests.get(url, params={"service": service_name, "limit": limit}, stream=True)
+        traces = iter_json_array_items(counted(response.iter_content(chunk_size=traces_handler.STREAM_CHUNK_SIZE)))
+        while True:
+            trace = timed("decode", next, traces, None)
+            if trace is None:
+                break
+            parse(trace)
+    elif mode == "grpc":
+        # receiving the stream is counted as fetch, protobuf decoding as decode
+        messages = counted(iter_find_traces_messages(jaeger_grpc_target, service_name, limit))
+
+        def received_messages() -> Iterator[bytes]:
+            while True:
+                message = timed("fetch", next, messages, None)
+                if message is None:
+                    return
+                yield message
+
+        for trace in iter_streamed_traces(received_messages(), lambda message: timed("decode", decode_traces_data, message)):
+            parse(trace)
+    else:
+        raise ValueError(f"Unknown ingest mode [{mode}]")
+
+    dfs.append(timed("span_table", get_span_records_df, traces_to_parse))
+    df = timed("dataframe", lambda: pd.concat(dfs, ignore_index=True))
+    timed("csv_write", lambda: df.to_csv(os.path.join(output_dir, f"{mode}_traces_data.csv"), index=False))
+    elapsed_time = time.perf_counter() - start_time
+
+    results.put({
+        "mode": mode,
+        "traces": num_traces,
+        "spans": len(df),
+        "seconds": elapsed_time,
+        "traces_per_second": num_traces / elapsed_time if elapsed_time > 0 else 0.0,
+        # ru_maxrss is in KB on Linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "wire_mb_per_1000_traces": wire_bytes / (1024 * 1024) * 1000 / num_traces if num_traces else 0.0,
+        "parse_cpu_ms_per_1000_traces": parse_cpu_seconds * 1000 * 1000 / num_traces if num_traces else 0.0,
+        "stage_to_seconds": stage_to_seconds,
+    })
+
+def print_results(results: List[Dict[str, Any]]) -> None:
+    header = f"{'mode':<10} {'traces':>7} {'spans':>9} {'traces/s':>10} {'peak RSS MB':>12} {'MB/1k':>8} {'parse ms/1k':>12} " + " ".join(f"{stage:>10}" for stage in STAGES)
+    print(header)
+    for result in results:
+        stage_to_seconds = result["stage_to_seconds"]
+        print(f"{result['mode']:<10} {result['traces']:>7} {result['spans']:>9} {result['traces_per_second']:>10.1f} {result['peak_rss_mb']:>12.1f} "
+              f"{result['wire_mb_per_1000_traces']:>8.2f} {result['parse_cpu_ms_per_1000_traces']:>12.1f} "
+              + " ".join(f"{stage_to_seconds[stage]:>9.3f}s" for stage in STAGES))
+
+def main() -> None:
+    args = parse_arguments()
+
+    server = None
+    grpc_server = None
+    jaeger_url = args.jaeger_url
+    jaeger_grpc_target = args.jaeger_grpc_target
+    modes = args.modes.split(",")
+    if not jaeger_url:
+        if args.traces_dir:
+            traces = load_recorded_traces(args.traces_dir)
+        else:
+            traces = create_synthetic_traces(args.num_traces, args.spans_per_trace, 0)
+        server = start_jaeger_stand_in(traces, port=0, latency_ms=args.latency_ms)
+        jaeger_url = f"http://{server.server_address[0]}:{server.server_address[1]}"
+        print(f"Started Jaeger stand-in with [{len(traces)}] traces on [{jaeger_url}]")
+        if "grpc" in modes:
+            grpc_server, grpc_port = start_jaeger_grpc_stand_in(traces, port=0, latency_ms=args.latency_ms)
+            jaeger_grpc_target = f"127.0.0.1:{grpc_port}"
+            print(f"Started Jaeger gRPC stand-in on [{jaeger_grpc_target}]")
+    elif "grpc" in modes and not jaeger_grpc_target:
+        print("[WARNING:] No --jaeger-grpc-target given, skipping the grpc mode")
+        modes.remove("grpc")
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as output_dir:
+        for mode in modes:
+            queue = context.Queue()
+            process = context.Process(target=run_ingest, args=(mode, jaeger_url, jaeger_grpc_target, args.service_name_for_traces, args.num_traces, args.fetch_workers, output_dir, queue))
+            process.start()
+            results.append(queue.get())
+            process.join()
+
+    if server is not None:
+        server.shutdown()
+    if grpc_server is not None:
+        grpc_server.stop(None)
+
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
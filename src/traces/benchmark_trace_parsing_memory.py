@@ -0,0 +1,108 @@
+import argparse
+import json
+import time
+import tracemalloc
+import requests
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
+import traces_handler
+from traces_handler import iter_json_array_items, SPAN_TABLE_BATCH_TRACES, STREAM_CHUNK_SIZE
+from span_table import get_span_records_df
+
+def parse_arguments() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare peak memory of the buffered and streaming Jaeger trace parsing paths")
+    parser.add_argument("--input-file", type=str, help="Saved /api/traces search response to parse instead of querying Jaeger")
+    parser.add_argument("--service-name-for-traces", type=str, default="nginx-web-server", help="Service name to query Jaeger for")
+    parser.add_argument("--limits", type=str, default="100,500,1000", help="Comma separated trace limits to query Jaeger with")
+    parser.add_argument("--jaeger-url", type=str, help="Jaeger query URL, defaults to the one in traces_handler")
+    return parser.parse_args()
+
+def read_file_chunks(file_path: str) -> Iterator[bytes]:
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+def get_search_response(service_name: str, limit: int, stream: bool) -> requests.Response:
+    url = f"{traces_handler.JAEGER_URL}{traces_handler.JAEGER_TRACES_API_PATH}"
+    response = requests.get(url, params={"service": service_name, "limit": limit}, stream=stream)
+    response.raise_for_status()
+    return response
+
+def count_span_records(traces: Iterable[Dict[str, Any]]) -> Tuple[int, int]:
+    # traces are parsed in batches of SPAN_TABLE_BATCH_TRACES like parse_and_save_traces, the
+    # records of every batch are counted and dropped so both paths are compared on parsing memory alone
+    num_traces = 0
+    num_records = 0
+    traces_to_parse: List[Dict[str, Any]] = []
+    for trace in traces:
+        num_traces += 1
+        traces_to_parse.append(trace)
+        if len(traces_to_parse) >= SPAN_TABLE_BATCH_TRACES:
+            num_records += len(get_span_records_df(traces_to_parse))
+            traces_to_parse = []
+    num_records += len(get_span_records_df(traces_to_parse))
+    return num_traces, num_records
+
+def measure(parse: Callable[[], Tuple[int, int]]) -> Dict[str, float]:
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    num_traces, num_records = parse()
+    elapsed_time = time.perf_counter() - start_time
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "traces": num_traces,
+        "spans": num_records,
+        "peak_mb": peak_bytes / (1024 * 1024),
+        "seconds": elapsed_time,
+    }
+
+def buffered_from_file(file_path: str) -> Tuple[int, int]:
+    # mirrors the existing path, the whole body is kept as text and as parsed objects
+    with open(file_path, "r") as f:
+        text = f.read()
+    traces = json.loads(text).get("data", [])
+    return count_span_records(traces)
+
+def streaming_from_file(file_path: str) -> Tuple[int, int]:
+    return count_span_records(iter_json_array_items(read_file_chunks(file_path)))
+
+def buffered_from_jaeger(service_name: str, limit: int) -> Tuple[int, int]:
+    response = get_search_response(service_name, limit, False)
+    text = response.text
+    traces = response.json().get("data", [])
+    result = count_span_records(traces)
+    del text
+    return result
+
+def streaming_from_jaeger(service_name: str, limit: int) -> Tuple[int, int]:
+    with get_search_response(service_name, limit, True) as response:
+        return count_span_records(iter_json_array_items(response.iter_content(chunk_size=STREAM_CHUNK_SIZE)))
+
+def print_results(results: List[Tuple[str, str, Dict[str, float]]]) -> None:
+    print(f"{'input':<24} {'path':<10} {'traces':>8} {'spans':>10} {'peak MB':>10} {'seconds':>9}")
+    for input_name, path_name, result in results:
+        print(f"{input_name:<24} {path_name:<10} {result['traces']:>8} {result['spans']:>10} {result['peak_mb']:>10.2f} {result['seconds']:>9.2f}")
+
+def main() -> None:
+    args = parse_arguments()
+
+    if args.jaeger_url:
+        traces_handler.JAEGER_URL = args.jaeger_url
+
+    results: List[Tuple[str, str, Dict[str, float]]] = []
+    if args.input_file:
+        results.append((args.input_file, "buffered", measure(lambda: buffered_from_file(args.input_file))))
+        results.append((args.input_file, "streaming", measure(lambda: streaming_from_file(args.input_file))))
+    else:
+        for limit in [int(limit) for limit in args.limits.split(",")]:
+            input_name = f"limit={limit}"
+            results.append((input_name, "buffered", measure(lambda: buffered_from_jaeger(args.service_name_for_traces, limit))))
+            results.append((input_name, "streaming", measure(lambda: streaming_from_jaeger(args.service_name_for_traces, limit))))
+
+    print_results(results)
+
+if __name__ == "__main__":
+    main()
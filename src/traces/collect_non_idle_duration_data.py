@@ -2,7 +2,17 @@ import argparse
 import os
 import pandas as pd
 import numpy as np
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Optional, Tuple
+from duration_sketch import DurationSketch, save_run_sketch
+from non_idle_intervals import TraceNonIdleIntervals, merge_trace_non_idle_intervals
+from span_store import get_span_store_dir, has_span_store, load_span_store
+from trace_shape_clusters import DEFAULT_MIN_CLUSTER_TRACES, get_shape_clusters, get_trace_id_to_shape
+
+SHAPE_CLUSTERS_DIR = "shape_clusters"
+BAND_METHODS = ["sd", "iqr", "mad"]
+BAND_METHOD_TO_DEFAULT_WIDTH = {"sd": 1.0, "iqr": 1.5, "mad": 1.0}
+DEFAULT_BAND_METHOD = "sd"
+MAD_TO_SD = 1.4826
 
 def parse_arguments() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Collect non-idle median duration data from traces")
@@ -12,6 +22,8 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument("--config", type=str, required=True, help="Test configuration")
     parser.add_argument("--data-dir", type=str, required=True, help="Data directory")
     parser.add_argument("--non-idle-durations-dir", type=str, help="Output directory for median durations")
+    parser.add_argument("--run-id", type=str, help="Unique id of the run, defaults to the name of the run directory holding data/trace_data")
+    parser.add_argument("--min-cluster-traces", type=int, default=DEFAULT_MIN_CLUSTER_TRACES, help="Minimum traces in a span tree shape cluster for it to be analysed")
 
     return parser.parse_args()
 
@@ -20,7 +32,8 @@ def load_traces_data(
     service_name_for_traces: str,
     test_name: str,
     config: str,
-    container_name: str
+    container_name: str,
+    columns: Optional[List[str]] = None
 ) -> pd.DataFrame:
     global DEFAULT_SERVICE_NAME
 
@@ -29,88 +42,110 @@ def load_traces_data(
         print(f"File not found: {jaeger_traces_csv_file_path}, trying default service name: {DEFAULT_SERVICE_NAME}")
         jaeger_traces_csv_file_path: str = os.path.join(data_dir, f"{DEFAULT_SERVICE_NAME}_{test_name}_{config}_traces_data.csv")
 
+    span_store_dir: str = get_span_store_dir(jaeger_traces_csv_file_path)
+    if has_span_store(span_store_dir):
+        print(f"Loading container [{container_name}] from span store {span_store_dir}")
+        return load_span_store(span_store_dir, container_name, columns)
+
     jaeger_traces_df: pd.DataFrame = pd.read_csv(jaeger_traces_csv_file_path)
     container_jaeger_traces_df: pd.DataFrame = jaeger_traces_df[jaeger_traces_df['container_name'] == container_name]
+    if columns is not None:
+        container_jaeger_traces_df = container_jaeger_traces_df[columns]
     return container_jaeger_traces_df
 
-def get_trace_id_to_non_idle_intervals(traces_df: pd.DataFrame) -> Dict[str, List[Dict[int, int]]]:
-    trace_id_to_non_idle_intervals: Dict[str, List[Dict[int, int]]] = {}
-    for _, row in traces_df.iterrows():
-        trace_id = row['trace_id']
-        non_idle_intervals = row['non_idle_intervals'].split(";")
-        for interval in non_idle_intervals:
-            start, end = map(int, interval.split("-"))
-            if trace_id not in trace_id_to_non_idle_intervals:
-                trace_id_to_non_idle_intervals[trace_id] = []
-            trace_id_to_non_idle_intervals[trace_id].append({start: end})
-    if not trace_id_to_non_idle_intervals:
+def get_trace_id_to_non_idle_intervals(traces_df: pd.DataFrame) -> TraceNonIdleIntervals:
+    # merged non idle intervals of every trace, parsed and merged over whole arrays
+    trace_non_idle_intervals = merge_trace_non_idle_intervals(traces_df)
+    if len(trace_non_idle_intervals) == 0:
         print("No non idle intervals found in the trace data.")
-        return {}
-    
-    for trace_id, intervals in trace_id_to_non_idle_intervals.items():
-        sorted_intervals = sorted(intervals, key=lambda x: list(x.keys())[0])
-        trace_id_to_non_idle_intervals[trace_id] = sorted_intervals
-
-    # merge intervals for each trace id
-    for trace_id, intervals in trace_id_to_non_idle_intervals.items():
-        merged_intervals = []
-        current_start, current_end = None, None
-        for interval in intervals:
-            for start, end in interval.items():
-                if current_start is None:
-                    current_start, current_end = start, end
-                elif start <= current_end:
-                    current_end = max(current_end, end)
-                else:
-                    merged_intervals.append({current_start: current_end})
-                    current_start, current_end = start, end
-        if current_start is not None:
-            merged_intervals.append({current_start: current_end})
-        trace_id_to_non_idle_intervals[trace_id] = merged_intervals
-
-    return trace_id_to_non_idle_intervals
-
-def get_median_non_idle_intervals(trace_id_to_non_idle_intervals: Dict[str, List[Dict[int, int]]]) -> int:
+    return trace_non_idle_intervals
+
+def get_median_non_idle_intervals(trace_non_idle_intervals: TraceNonIdleIntervals) -> int:
     # Calculate median number of non idle intervals across all traces
-    non_idle_intervals_lens: List[int] = []
-    for trace_id, non_idle_intervals in trace_id_to_non_idle_intervals.items():
-        non_idle_intervals_lens.append(len(non_idle_intervals))
-    if not non_idle_intervals_lens:
+    non_idle_intervals_lens: np.ndarray = trace_non_idle_intervals.get_counts()
+    if len(non_idle_intervals_lens) == 0:
         print("No non idle intervals found for any traces.")
         return
-    len_non_idle_intervals_to_count_map: Dict[int, int] = {}
-    for length in non_idle_intervals_lens:
-        if length not in len_non_idle_intervals_to_count_map:
-            len_non_idle_intervals_to_count_map[length] = 0
-        len_non_idle_intervals_to_count_map[length] += 1
-    if len_non_idle_intervals_to_count_map:
-        print(f"Non idle intervals length distribution: {len_non_idle_intervals_to_count_map}")
-    non_idle_intervals_lens = sorted(non_idle_intervals_lens)
+    lens, lens_counts = np.unique(non_idle_intervals_lens, return_counts=True)
+    len_non_idle_intervals_to_count_map: Dict[int, int] = dict(zip(lens.tolist(), lens_counts.tolist()))
+    print(f"Non idle intervals length distribution: {len_non_idle_intervals_to_count_map}")
     median_non_idle_intervals: int = int(np.median(non_idle_intervals_lens))
     print(f"Median number of non idle intervals: {median_non_idle_intervals}")
 
     return median_non_idle_intervals
 
+def filter_traces_with_median_non_idle_intervals(
+        trace_non_idle_intervals: TraceNonIdleIntervals
+) -> Tuple[int, TraceNonIdleIntervals]:
+    # filter out traces with non idle intervals not equal to median
+    median_non_idle_intervals = get_median_non_idle_intervals(trace_non_idle_intervals)
+    filtered_trace_non_idle_intervals = trace_non_idle_intervals.select(trace_non_idle_intervals.get_counts() == median_non_idle_intervals)
+    return median_non_idle_intervals, filtered_trace_non_idle_intervals
+
+def get_shape_cluster_non_idle_intervals(
+        traces_df: pd.DataFrame,
+        trace_non_idle_intervals: TraceNonIdleIntervals,
+        min_cluster_traces: int
+) -> List[Tuple[str, TraceNonIdleIntervals]]:
+    # splits the traces into span tree shape clusters, largest first, so each cluster is
+    # aligned on its own instead of keeping only the traces of the median interval count
+    trace_id_to_shape = get_trace_id_to_shape(traces_df)
+    clusters = []
+    for shape, trace_ids in get_shape_clusters(trace_id_to_shape, min_cluster_traces):
+        cluster_trace_non_idle_intervals = trace_non_idle_intervals.select_trace_ids(trace_ids)
+        if len(cluster_trace_non_idle_intervals):
+            clusters.append((shape, cluster_trace_non_idle_intervals))
+    return clusters
+
+def get_non_idle_duration_matrix(
+        trace_non_idle_intervals: TraceNonIdleIntervals,
+        median_non_idle_intervals: int
+) -> np.ndarray:
+    # every trace has median_non_idle_intervals intervals, so the durations form a traces x intervals matrix
+    return (trace_non_idle_intervals.ends - trace_non_idle_intervals.starts).reshape(-1, median_non_idle_intervals)
+
 def get_median_duration_information_for_non_idle_intervals(
-        trace_id_to_non_idle_intervals: Dict[str, List[Dict[int, int]]],
+        trace_non_idle_intervals: TraceNonIdleIntervals,
         median_non_idle_intervals: int
-) -> Tuple[Dict[int, int], Dict[int, Dict[str, int]]]:
-    # calculate the median duration for each non idle interval
-    median_duration_per_non_idle_interval: Dict[int, int] = {}
-    non_idle_duration_index_to_trace_id_non_idle_duration_map: Dict[int, Dict[str, int]] = {}
-    for i in range(median_non_idle_intervals):
-        non_idle_duration_index_to_trace_id_non_idle_duration_map[i] = {}
-    for i in range(median_non_idle_intervals):
-        durations: List[int] = []
-        for trace_id, non_idle_intervals in trace_id_to_non_idle_intervals.items():
-            non_idle_interval: Dict[int, int] = non_idle_intervals[i]
-            start, end = list(non_idle_interval.items())[0]
-            duration = end - start
-            non_idle_duration_index_to_trace_id_non_idle_duration_map[i][trace_id] = duration
-            durations.append(duration)
-        median_duration_per_non_idle_interval[i] = int(np.median(durations))
-
-    return median_duration_per_non_idle_interval, non_idle_duration_index_to_trace_id_non_idle_duration_map
+) -> Tuple[Dict[int, int], np.ndarray]:
+    # calculate the median duration for each non idle interval, returned with the duration matrix it came from
+    duration_matrix: np.ndarray = get_non_idle_duration_matrix(trace_non_idle_intervals, median_non_idle_intervals)
+    median_durations: np.ndarray = np.median(duration_matrix, axis=0).astype(np.int64)
+    median_duration_per_non_idle_interval: Dict[int, int] = dict(enumerate(median_durations.tolist()))
+
+    return median_duration_per_non_idle_interval, duration_matrix
+
+def get_non_idle_duration_bands(
+        duration_matrix: np.ndarray,
+        band_method: str = DEFAULT_BAND_METHOD,
+        band_width: Optional[float] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    # lower and upper duration bound per non idle interval:
+    #   sd:  median +- k * standard deviation, bounds truncated to ints
+    #   iqr: [p25 - k * IQR, p75 + k * IQR]
+    #   mad: median +- k * 1.4826 * median absolute deviation, which matches sd for normal durations
+    band_width = band_width if band_width is not None else BAND_METHOD_TO_DEFAULT_WIDTH[band_method]
+    median_durations = np.median(duration_matrix, axis=0).astype(np.int64)
+    if band_method == "sd":
+        sd_durations = np.std(duration_matrix, axis=0)
+        return (median_durations - band_width * sd_durations).astype(np.int64), (median_durations + band_width * sd_durations).astype(np.int64)
+    if band_method == "iqr":
+        p25_durations, p75_durations = np.percentile(duration_matrix, [25, 75], axis=0)
+        iqr_durations = p75_durations - p25_durations
+        return p25_durations - band_width * iqr_durations, p75_durations + band_width * iqr_durations
+    if band_method == "mad":
+        mad_durations = MAD_TO_SD * np.median(np.abs(duration_matrix - np.median(duration_matrix, axis=0)), axis=0)
+        return median_durations - band_width * mad_durations, median_durations + band_width * mad_durations
+    raise ValueError(f"Unknown band method [{band_method}], expected one of {BAND_METHODS}")
+
+def get_traces_within_duration_bands(
+        duration_matrix: np.ndarray,
+        band_method: str = DEFAULT_BAND_METHOD,
+        band_width: Optional[float] = None
+) -> np.ndarray:
+    # mask of the traces whose duration lies in the band of every non idle interval
+    lower_bounds, upper_bounds = get_non_idle_duration_bands(duration_matrix, band_method, band_width)
+    return ((duration_matrix >= lower_bounds) & (duration_matrix <= upper_bounds)).all(axis=1)
 
 def write_median_durations_to_csv(
         non_idle_durations_dir: str,
@@ -132,12 +167,7 @@ def write_median_durations_to_csv(
         os.makedirs(median_durations_test_dir, exist_ok=True)
         container_non_idle_durations_csv_file_name = os.path.join(median_durations_test_dir, f"{container_name}.csv")
 
-        cache_partitions_str = ""
-        config_parts = config.split("_")
-        for part in config_parts:
-            if part.startswith("cp"):
-                cache_partitions_str = part[2:]
-                break
+        cache_partitions_str = get_cache_partitions_str(config)
         if not os.path.exists(container_non_idle_durations_csv_file_name):
             with open(container_non_idle_durations_csv_file_name, 'w') as f:
                 f.write("cache_partitions,non_idle_duration\n")
@@ -146,6 +176,59 @@ def write_median_durations_to_csv(
         print(f"Cache partitions: {cache_partitions_str}, Total median duration across non idle intervals: {total_median_duration_across_non_idle_intervals}")
         print(f"Median durations written to {container_non_idle_durations_csv_file_name}")
 
+def get_cache_partitions_str(config: str) -> str:
+    for part in config.split("_"):
+        if part.startswith("cp"):
+            return part[2:]
+    return ""
+
+def write_shape_cluster_median_durations_to_csv(
+        non_idle_durations_dir: str,
+        container_name: str,
+        test_name: str,
+        config: str,
+        shape_to_median_durations: List[Tuple[str, int, Dict[int, int]]],
+) -> None:
+    # one row per shape cluster and run, kept in a sub directory so plot_non_idle_durations
+    # still only sees one csv per container
+    if not non_idle_durations_dir:
+        return
+
+    shape_clusters_dir = os.path.join(non_idle_durations_dir, test_name, SHAPE_CLUSTERS_DIR)
+    os.makedirs(shape_clusters_dir, exist_ok=True)
+    shape_clusters_csv_file_name = os.path.join(shape_clusters_dir, f"{container_name}.csv")
+    cache_partitions_str = get_cache_partitions_str(config)
+    if not os.path.exists(shape_clusters_csv_file_name):
+        with open(shape_clusters_csv_file_name, 'w') as f:
+            f.write("cache_partitions,shape,num_traces,non_idle_duration\n")
+    with open(shape_clusters_csv_file_name, 'a') as f:
+        for shape, num_traces, median_duration_per_non_idle_interval in shape_to_median_durations:
+            f.write(f"{cache_partitions_str},{shape},{num_traces},{sum(median_duration_per_non_idle_interval.values())}\n")
+    print(f"Median durations of [{len(shape_to_median_durations)}] shape clusters written to {shape_clusters_csv_file_name}")
+
+def get_run_id(data_dir: str) -> str:
+    # every run writes to <run dir>/data/trace_data, the run dir is named after the start time of its workload
+    return os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(data_dir))))
+
+def write_non_idle_duration_sketch(
+        non_idle_durations_dir: str,
+        container_name: str,
+        test_name: str,
+        config: str,
+        run_id: str,
+        trace_non_idle_intervals: TraceNonIdleIntervals,
+) -> None:
+    # quantile sketch of the non idle duration of every trace of the run, so percentiles
+    # across runs are computed from all requests and not from one median per run
+    if not non_idle_durations_dir:
+        return
+
+    sketch = DurationSketch()
+    sketch.add(trace_non_idle_intervals.get_non_idle_durations())
+    sketch_file_path = save_run_sketch(sketch, os.path.join(non_idle_durations_dir, test_name), container_name, config, get_cache_partitions_str(config), run_id)
+    p50, p99, p999 = sketch.get_quantiles()
+    print(f"Non idle duration of [{sketch.count}] traces p50 [{p50:.1f}] p99 [{p99:.1f}] p99.9 [{p999:.1f}], sketch written to {sketch_file_path}")
+
 def main():
     args: argparse.Namespace = parse_arguments()
     test_name: str = args.test_name.replace(" ", "_")
@@ -154,6 +237,8 @@ def main():
     config: str = args.config.replace(" ", "_")
     data_dir: str = args.data_dir
     non_idle_durations_dir: str = args.non_idle_durations_dir
+    min_cluster_traces: int = args.min_cluster_traces
+    run_id: str = args.run_id if args.run_id else get_run_id(data_dir)
 
     print(f"Test Name: {test_name}")
     print(f"Service Name for Traces: {service_name_for_traces}")
@@ -161,31 +246,48 @@ def main():
     print(f"Config: {config}")
     print(f"Data Directory: {data_dir}")
     print(f"Non Idle Durations Directory: {non_idle_durations_dir}")
+    print(f"Min Cluster Traces: {min_cluster_traces}")
+    print(f"Run ID: {run_id}")
 
     container_jaeger_traces_df: pd.DataFrame = load_traces_data(
-        data_dir, service_name_for_traces, test_name, config, container_name)
+        data_dir, service_name_for_traces, test_name, config, container_name, ['trace_id', 'service', 'operation', 'start_time', 'end_time', 'non_idle_intervals'])
     if container_jaeger_traces_df.empty:
         print(f"No traces found for container [{container_name}] with service name [{service_name_for_traces}]")
         return
     print("Container Jaeger Traces Data:")
     print(container_jaeger_traces_df.head())
 
-    all_trace_ids_to_non_idle_intervals: Dict[str, List[Dict[int, int]]] = get_trace_id_to_non_idle_intervals(container_jaeger_traces_df)
-    if not all_trace_ids_to_non_idle_intervals:
+    all_trace_non_idle_intervals: TraceNonIdleIntervals = get_trace_id_to_non_idle_intervals(container_jaeger_traces_df)
+    if len(all_trace_non_idle_intervals) == 0:
         print("No non-idle intervals found in traces.")
         return
     
-    median_non_idle_intervals = get_median_non_idle_intervals(all_trace_ids_to_non_idle_intervals)
-    # filter out traces with non idle intervals not equal to median
-    filtered_trace_ids_to_non_idle_intervals = {trace_id: non_idle_intervals for trace_id, non_idle_intervals in all_trace_ids_to_non_idle_intervals.items() if len(non_idle_intervals) == median_non_idle_intervals}
-    if not filtered_trace_ids_to_non_idle_intervals:
+    write_non_idle_duration_sketch(non_idle_durations_dir, container_name, test_name, config, run_id, all_trace_non_idle_intervals)
+
+    # the per container csv keeps one value per run over all traces, so every run and config
+    # compares the same requests whatever shape cluster is the largest in it
+    median_non_idle_intervals, filtered_trace_non_idle_intervals = filter_traces_with_median_non_idle_intervals(all_trace_non_idle_intervals)
+    if len(filtered_trace_non_idle_intervals) == 0:
         print(f"No traces found with {median_non_idle_intervals} number of non idle intervals.")
         return
-    
-    median_duration_per_non_idle_interval, _ = get_median_duration_information_for_non_idle_intervals(filtered_trace_ids_to_non_idle_intervals, median_non_idle_intervals)
-
+    median_duration_per_non_idle_interval, _ = get_median_duration_information_for_non_idle_intervals(filtered_trace_non_idle_intervals, median_non_idle_intervals)
     write_median_durations_to_csv(non_idle_durations_dir, container_name, test_name, config, median_duration_per_non_idle_interval)
 
+    shape_to_median_durations: List[Tuple[str, int, Dict[int, int]]] = []
+    for shape, cluster_trace_non_idle_intervals in get_shape_cluster_non_idle_intervals(container_jaeger_traces_df, all_trace_non_idle_intervals, min_cluster_traces):
+        print(f"Shape cluster [{shape}] with [{len(cluster_trace_non_idle_intervals)}] traces")
+        median_non_idle_intervals, filtered_trace_non_idle_intervals = filter_traces_with_median_non_idle_intervals(cluster_trace_non_idle_intervals)
+        if len(filtered_trace_non_idle_intervals) == 0:
+            print(f"No traces found with {median_non_idle_intervals} number of non idle intervals in shape cluster [{shape}].")
+            continue
+        median_duration_per_non_idle_interval, _ = get_median_duration_information_for_non_idle_intervals(filtered_trace_non_idle_intervals, median_non_idle_intervals)
+        shape_to_median_durations.append((shape, len(filtered_trace_non_idle_intervals), median_duration_per_non_idle_interval))
+    if not shape_to_median_durations:
+        print("No shape clusters found with enough traces.")
+        return
+
+    write_shape_cluster_median_durations_to_csv(non_idle_durations_dir, container_name, test_name, config, shape_to_median_durations)
+
 if __name__ == "__main__":
     main()
     
\ No newline at end of file
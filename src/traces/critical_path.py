@@ -0,0 +1,143 @@
+import pandas as pd
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from span_data import SpanData
+
+# Critical path of a trace as Jaeger's UI computes it: start at the root's end, step into the
+# last finishing child, and once a span has no child finishing before the current point,
+# its start hands control back to its parent. Children are first clipped to their parent's
+# bounds and children entirely outside their parent are dropped, like Jaeger does.
+CRITICAL_PATH_SUFFIX = "_critical_path.csv"
+
+def get_root_span(span_id_to_span: Dict[str, SpanData], span_to_parent: Dict[str, str]) -> Optional[SpanData]:
+    # partial traces can have several roots, the earliest (then longest) one is used
+    roots = [span for span_id, span in span_id_to_span.items() if span_id not in span_to_parent]
+    if not roots:
+        return None
+    return min(roots, key=lambda span: (span.start_time, -span.duration))
+
+def get_critical_path(span_id_to_span: Dict[str, SpanData]) -> List[Tuple[SpanData, int, int]]:
+    # returns (span, section_start, section_end) from the end of the trace backwards
+    span_to_parent: Dict[str, str] = {}
+    for span_id, span in span_id_to_span.items():
+        for child in span.children:
+            if child.span_id != span_id:
+                span_to_parent.setdefault(child.span_id, span_id)
+
+    root = get_root_span(span_id_to_span, span_to_parent)
+    if root is None:
+        return []
+
+    # clip children to their parent top down, breadth first so deep traces need no recursion
+    span_to_bounds: Dict[str, Tuple[int, int]] = {root.span_id: (root.start_time, root.end_time)}
+    span_to_clipped_parent: Dict[str, str] = {}
+    span_to_children: Dict[str, List[str]] = {}
+    queue = deque([root])
+    while queue:
+        span = queue.popleft()
+        parent_start, parent_end = span_to_bounds[span.span_id]
+        children = []
+        for child in span.children:
+            if child.span_id in span_to_bounds or child.start_time >= parent_end or child.end_time <= parent_start:
+                continue
+            span_to_bounds[child.span_id] = (max(child.start_time, parent_start), min(child.end_time, parent_end))
+            span_to_clipped_parent[child.span_id] = span.span_id
+            children.append(child.span_id)
+            queue.append(child)
+        # last finishing child first
+        children.sort(key=lambda child_id: span_to_bounds[child_id][1], reverse=True)
+        span_to_children[span.span_id] = children
+
+    critical_path = []
+    span_id = root.span_id
+    spawn_time: Optional[int] = None
+    # every step either moves the current point back in time or goes up a level, the cap
+    # only guards against malformed traces
+    for _ in range(4 * len(span_to_bounds) + 1):
+        span_start, span_end = span_to_bounds[span_id]
+        section_end = spawn_time if spawn_time is not None else span_end
+        last_finishing_child = next((child_id for child_id in span_to_children[span_id]
+                                     if spawn_time is None or span_to_bounds[child_id][1] < spawn_time), None)
+        if last_finishing_child is not None:
+            child_end = span_to_bounds[last_finishing_child][1]
+            if child_end != section_end:
+                critical_path.append((span_id_to_span[span_id], child_end, section_end))
+            span_id, spawn_time = last_finishing_child, None
+            continue
+
+        critical_path.append((span_id_to_span[span_id], span_start, section_end))
+        if span_id not in span_to_clipped_parent:
+            break
+        span_id, spawn_time = span_to_clipped_parent[span_id], span_start
+
+    return critical_path
+
+class CriticalPathAggregator:
+    # Sums how much critical path time each (service, operation) owns across traces
+    def __init__(self):
+        self.num_traces = 0
+        self.total_critical_path_time = 0
+        self.__operation_to_time: Dict[Tuple[str, str], int] = {}
+        self.__operation_to_num_traces: Dict[Tuple[str, str], int] = {}
+        self.__operation_to_num_spans: Dict[Tuple[str, str], int] = {}
+
+    def add_trace(self, span_id_to_span: Dict[str, SpanData]) -> None:
+        # takes the span graph of one trace, see traces_handler.create_span_data_graph
+        critical_path = get_critical_path(span_id_to_span)
+        if not critical_path:
+            return
+
+        self.num_traces += 1
+        operations_on_path = set()
+        spans_on_path = set()
+        for span, section_start, section_end in critical_path:
+            operation = (span.service, span.operation)
+            self.__operation_to_time[operation] = self.__operation_to_time.get(operation, 0) + section_end - section_start
+            self.total_critical_path_time += section_end - section_start
+            operations_on_path.add(operation)
+            if span.span_id not in spans_on_path:
+                spans_on_path.add(span.span_id)
+                self.__operation_to_num_spans[operation] = self.__operation_to_num_spans.get(operation, 0) + 1
+        for operation in operations_on_path:
+            self.__operation_to_num_traces[operation] = self.__operation_to_num_traces.get(operation, 0) + 1
+
+    def merge(self, other: "CriticalPathAggregator") -> None:
+        # folds in an aggregator filled by another worker
+        self.num_traces += other.num_traces
+        self.total_critical_path_time += other.total_critical_path_time
+        for operation, critical_path_time in other.__operation_to_time.items():
+            self.__operation_to_time[operation] = self.__operation_to_time.get(operation, 0) + critical_path_time
+        for operation, num_traces in other.__operation_to_num_traces.items():
+            self.__operation_to_num_traces[operation] = self.__operation_to_num_traces.get(operation, 0) + num_traces
+        for operation, num_spans in other.__operation_to_num_spans.items():
+            self.__operation_to_num_spans[operation] = self.__operation_to_num_spans.get(operation, 0) + num_spans
+
+    def get_critical_path_df(self) -> pd.DataFrame:
+        rows = []
+        for (service, operation), critical_path_time in self.__operation_to_time.items():
+            rows.append({
+                "service": service,
+                "operation": operation,
+                "critical_path_time": critical_path_time,
+                "critical_path_share": critical_path_time / self.total_critical_path_time if self.total_critical_path_time else 0.0,
+                "mean_critical_path_time_per_trace": critical_path_time / self.num_traces,
+                "num_traces_on_critical_path": self.__operation_to_num_traces[(service, operation)],
+                "num_spans_on_critical_path": self.__operation_to_num_spans[(service, operation)],
+            })
+        df = pd.DataFrame(rows, columns=["service", "operation", "critical_path_time", "critical_path_share", "mean_critical_path_time_per_trace",
+                                         "num_traces_on_critical_path", "num_spans_on_critical_path"])
+        return df.sort_values("critical_path_time", ascending=False, ignore_index=True)
+
+    def __repr__(self):
+        return f"CriticalPathAggregator(num_traces={self.num_traces}, " \
+            f"total_critical_path_time={self.total_critical_path_time}, " \
+            f"num_operations={len(self.__operation_to_time)})"
+
+def get_critical_path_csv_path(traces_csv_file_path: str) -> str:
+    return traces_csv_file_path[:-len("_traces_data.csv")] + CRITICAL_PATH_SUFFIX
+
+def save_critical_path(critical_path_aggregator: CriticalPathAggregator, traces_csv_file_path: str) -> str:
+    critical_path_csv_file_path = get_critical_path_csv_path(traces_csv_file_path)
+    critical_path_aggregator.get_critical_path_df().to_csv(critical_path_csv_file_path, index=False)
+    print(f"Saved critical path of [{critical_path_aggregator.num_traces}] traces to {critical_path_csv_file_path}")
+    return critical_path_csv_file_path
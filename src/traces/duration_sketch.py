@@ -0,0 +1,148 @@
+import json
+import math
+import os
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional
+
+# Mergeable quantile sketch of durations with a relative error guarantee (DDSketch). A value
+# x > 0 is counted in bucket ceil(log_gamma(x)), gamma = (1 + a) / (1 - a), and every quantile
+# is answered within a relative error a of the true value. Sketches merge by adding bucket
+# counts, so merging any number of runs is exact with respect to the sketch and the memory is
+# bounded by the number of buckets between the smallest and largest duration, about 1000 for
+# 1us to 1000s at a = 1%, and capped at max_num_buckets by folding the lowest buckets.
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_NUM_BUCKETS = 2048
+DEFAULT_QUANTILES = [0.5, 0.99, 0.999]
+SKETCHES_DIR = "sketches"
+
+class DurationSketch:
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY, max_num_buckets: int = DEFAULT_MAX_NUM_BUCKETS):
+        self.relative_accuracy = relative_accuracy
+        self.max_num_buckets = max_num_buckets
+        self.count = 0
+        self.zero_count = 0
+        self.sum = 0
+        self.min: Optional[int] = None
+        self.max: Optional[int] = None
+        self.__gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.__log_gamma = math.log(self.__gamma)
+        self.__bucket_to_count: Dict[int, int] = {}
+
+    def add(self, durations: Iterable[int]) -> None:
+        durations = np.asarray(durations, dtype=np.int64)
+        if len(durations) == 0:
+            return
+        self.count += len(durations)
+        self.sum += int(durations.sum())
+        self.min = int(durations.min()) if self.min is None else min(self.min, int(durations.min()))
+        self.max = int(durations.max()) if self.max is None else max(self.max, int(durations.max()))
+
+        positive_durations = durations[durations > 0]
+        self.zero_count += len(durations) - len(positive_durations)
+        buckets, counts = np.unique(np.ceil(np.log(positive_durations) / self.__log_gamma).astype(np.int64), return_counts=True)
+        self.__add_buckets(zip(buckets.tolist(), counts.tolist()))
+
+    def merge(self, other: "DurationSketch") -> None:
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(f"Cannot merge sketches with relative accuracy [{self.relative_accuracy}] and [{other.relative_accuracy}]")
+        if other.count == 0:
+            return
+        self.count += other.count
+        self.zero_count += other.zero_count
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.__add_buckets(other.__bucket_to_count.items())
+
+    def __add_buckets(self, bucket_counts: Iterable) -> None:
+        for bucket, count in bucket_counts:
+            self.__bucket_to_count[bucket] = self.__bucket_to_count.get(bucket, 0) + count
+        if len(self.__bucket_to_count) > self.max_num_buckets:
+            # the lowest buckets are folded into one, only the smallest durations lose accuracy
+            buckets = sorted(self.__bucket_to_count)
+            num_folded = len(buckets) - self.max_num_buckets + 1
+            folded_count = sum(self.__bucket_to_count.pop(bucket) for bucket in buckets[:num_folded])
+            self.__bucket_to_count[buckets[num_folded]] += folded_count
+
+    def get_quantile(self, quantile: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = quantile * (self.count - 1)
+        if rank < self.zero_count:
+            return float(self.min)
+        cumulative_count = self.zero_count
+        for bucket in sorted(self.__bucket_to_count):
+            cumulative_count += self.__bucket_to_count[bucket]
+            if cumulative_count > rank:
+                value = 2 * self.__gamma ** bucket / (self.__gamma + 1)
+                return float(min(max(value, self.min), self.max))
+        return float(self.max)
+
+    def get_quantiles(self, quantiles: List[float] = DEFAULT_QUANTILES) -> List[Optional[float]]:
+        return [self.get_quantile(quantile) for quantile in quantiles]
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "max_num_buckets": self.max_num_buckets,
+            "count": self.count,
+            "zero_count": self.zero_count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "buckets": {str(bucket): count for bucket, count in sorted(self.__bucket_to_count.items())},
+        }
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]) -> "DurationSketch":
+        sketch = DurationSketch(data["relative_accuracy"], data.get("max_num_buckets", DEFAULT_MAX_NUM_BUCKETS))
+        sketch.count = data["count"]
+        sketch.zero_count = data["zero_count"]
+        sketch.sum = data["sum"]
+        sketch.min = data["min"]
+        sketch.max = data["max"]
+        sketch.__bucket_to_count = {int(bucket): count for bucket, count in data["buckets"].items()}
+        return sketch
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __repr__(self):
+        return f"DurationSketch(relative_accuracy={self.relative_accuracy}, " \
+            f"count={self.count}, " \
+            f"num_buckets={len(self.__bucket_to_count)}, " \
+            f"min={self.min}, " \
+            f"max={self.max})"
+
+def get_container_sketches_dir(non_idle_durations_test_dir: str, container_name: str) -> str:
+    return os.path.join(non_idle_durations_test_dir, SKETCHES_DIR, container_name)
+
+def save_run_sketch(sketch: DurationSketch, non_idle_durations_test_dir: str, container_name: str, config: str, cache_partitions: str, run_id: str) -> str:
+    # one file per run of a config, so every run of a config is merged and only analysing
+    # the same run again replaces its sketch
+    sketches_dir = get_container_sketches_dir(non_idle_durations_test_dir, container_name)
+    os.makedirs(sketches_dir, exist_ok=True)
+    sketch_file_path = os.path.join(sketches_dir, f"{config}_{run_id}.json")
+    with open(f"{sketch_file_path}.tmp", "w") as f:
+        json.dump({"config": config, "run_id": run_id, "cache_partitions": cache_partitions, "sketch": sketch.to_dict()}, f)
+    os.replace(f"{sketch_file_path}.tmp", sketch_file_path)
+    return sketch_file_path
+
+def load_cache_partitions_to_sketch(non_idle_durations_test_dir: str, container_name: str) -> Dict[str, DurationSketch]:
+    # merges the run sketches of a container per cache partition count, one file at a time
+    cache_partitions_to_sketch: Dict[str, DurationSketch] = {}
+    sketches_dir = get_container_sketches_dir(non_idle_durations_test_dir, container_name)
+    if not os.path.isdir(sketches_dir):
+        return cache_partitions_to_sketch
+    for file in sorted(os.listdir(sketches_dir)):
+        if not file.endswith(".json"):
+            continue
+        with open(os.path.join(sketches_dir, file), "r") as f:
+            run_sketch = json.load(f)
+        sketch = DurationSketch.from_dict(run_sketch["sketch"])
+        cache_partitions = run_sketch["cache_partitions"]
+        if cache_partitions not in cache_partitions_to_sketch:
+            cache_partitions_to_sketch[cache_partitions] = sketch
+        else:
+            cache_partitions_to_sketch[cache_partitions].merge(sketch)
+    return cache_partitions_to_sketch
@@ -0,0 +1,333 @@
+import json
+import struct
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Client for Jaeger's gRPC query service (jaeger.api_v3.QueryService). Responses are OTLP
+# TracesData messages streamed one or more per trace. Messages are encoded and decoded by
+# hand at the protobuf wire level for the handful of fields used here, so only grpcio is
+# needed and no generated stubs. Traces come out in the Jaeger query JSON layout so they feed
+# into create_span_data_graph like the HTTP ones.
+QUERY_SERVICE = "jaeger.api_v3.QueryService"
+FIND_TRACES_METHOD = f"/{QUERY_SERVICE}/FindTraces"
+GET_TRACE_METHOD = f"/{QUERY_SERVICE}/GetTrace"
+GET_SERVICES_METHOD = f"/{QUERY_SERVICE}/GetServices"
+# api_v3 requires a start time range, used when the search has none
+DEFAULT_LOOKBACK_US = 2 * 24 * 3600 * 1_000_000
+MAX_MESSAGE_BYTES = 256 * 1024 * 1024
+SERVICE_NAME_ATTRIBUTE = "service.name"
+DURATION_UNITS_TO_US = {"us": 1, "µs": 1, "ms": 1000, "s": 1_000_000}
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH_DELIMITED = 2
+WIRE_FIXED32 = 5
+
+# field numbers from jaeger api_v3 query_service.proto and opentelemetry trace/v1 trace.proto
+FIND_TRACES_QUERY = 1
+QUERY_SERVICE_NAME = 1
+QUERY_OPERATION_NAME = 2
+QUERY_START_TIME_MIN = 4
+QUERY_START_TIME_MAX = 5
+QUERY_DURATION_MIN = 6
+QUERY_DURATION_MAX = 7
+QUERY_SEARCH_DEPTH = 8
+GET_TRACE_TRACE_ID = 1
+GET_SERVICES_SERVICES = 1
+TIMESTAMP_SECONDS = 1
+TIMESTAMP_NANOS = 2
+TRACES_DATA_RESOURCE_SPANS = 1
+RESOURCE_SPANS_RESOURCE = 1
+RESOURCE_SPANS_SCOPE_SPANS = 2
+RESOURCE_ATTRIBUTES = 1
+KEY_VALUE_KEY = 1
+KEY_VALUE_VALUE = 2
+ANY_VALUE_STRING = 1
+SCOPE_SPANS_SPANS = 2
+SPAN_TRACE_ID = 1
+SPAN_SPAN_ID = 2
+SPAN_PARENT_SPAN_ID = 4
+SPAN_NAME = 5
+SPAN_START_TIME_UNIX_NANO = 7
+SPAN_END_TIME_UNIX_NANO = 8
+
+target_to_channel: Dict[str, Any] = {}
+
+def parse_duration_us(duration: str) -> int:
+    # Jaeger search durations look like "500us", "1.5ms" or "2s"
+    for unit in sorted(DURATION_UNITS_TO_US, key=len, reverse=True):
+        if duration.endswith(unit):
+            return int(float(duration[:-len(unit)]) * DURATION_UNITS_TO_US[unit])
+    return int(float(duration))
+
+def encode_varint(value: int) -> bytes:
+    value &= 0xffffffffffffffff
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+def encode_key(field: int, wire_type: int) -> bytes:
+    return encode_varint((field << 3) | wire_type)
+
+def encode_varint_field(field: int, value: int) -> bytes:
+    return encode_key(field, WIRE_VARINT) + encode_varint(value) if value else b""
+
+def encode_fixed64_field(field: int, value: int) -> bytes:
+    return encode_key(field, WIRE_FIXED64) + struct.pack("<Q", value)
+
+def encode_bytes_field(field: int, value: bytes) -> bytes:
+    return encode_key(field, WIRE_LENGTH_DELIMITED) + encode_varint(len(value)) + value
+
+def encode_string_field(field: int, value: Optional[str]) -> bytes:
+    return encode_bytes_field(field, value.encode()) if value else b""
+
+def encode_timestamp_field(field: int, time_us: int) -> bytes:
+    # google.protobuf.Timestamp and Duration share the seconds/nanos layout
+    seconds, remainder_us = divmod(time_us, 1_000_000)
+    return encode_bytes_field(field, encode_varint_field(TIMESTAMP_SECONDS, seconds) + encode_varint_field(TIMESTAMP_NANOS, remainder_us * 1000))
+
+def iter_fields(data: bytes) -> Iterator[Tuple[int, int, Any]]:
+    # yields (field, wire_type, value), length delimited values stay as bytes to decode lazily
+    pos = 0
+    length = len(data)
+
+    def read_varint() -> int:
+        nonlocal pos
+        result = 0
+        shift = 0
+        while True:
+            if pos >= length:
+                raise ValueError("Unexpected end of protobuf message")
+            byte = data[pos]
+            pos += 1
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    while pos < length:
+        key = read_varint()
+        field, wire_type = key >> 3, key & 0x07
+        if wire_type == WIRE_VARINT:
+            value = read_varint()
+        elif wire_type == WIRE_FIXED64:
+            value = struct.unpack_from("<Q", data, pos)[0]
+            pos += 8
+        elif wire_type == WIRE_LENGTH_DELIMITED:
+            size = read_varint()
+            if pos + size > length:
+                raise ValueError("Unexpected end of protobuf message")
+            value = data[pos:pos + size]
+            pos += size
+        elif wire_type == WIRE_FIXED32:
+            value = struct.unpack_from("<I", data, pos)[0]
+            pos += 4
+        else:
+            raise ValueError(f"Unsupported protobuf wire type [{wire_type}]")
+        yield field, wire_type, value
+
+def decode_timestamp_us(data: bytes) -> int:
+    seconds, nanos = 0, 0
+    for field, _, value in iter_fields(data):
+        if field == TIMESTAMP_SECONDS:
+            seconds = value
+        elif field == TIMESTAMP_NANOS:
+            nanos = value
+    return seconds * 1_000_000 + nanos // 1000
+
+def format_trace_id(trace_id: bytes) -> str:
+    # Jaeger renders 128 bit ids with a zero high half as 64 bit ids
+    trace_id_hex = trace_id.hex()
+    if len(trace_id_hex) == 32 and trace_id_hex.startswith("0" * 16):
+        return trace_id_hex[16:]
+    return trace_id_hex
+
+def parse_trace_id(trace_id: str) -> bytes:
+    return int(trace_id, 16).to_bytes(16, "big")
+
+def decode_resource_service(data: bytes) -> str:
+    for field, _, attribute in iter_fields(data):
+        if field != RESOURCE_ATTRIBUTES:
+            continue
+        key, value = None, None
+        for attribute_field, _, attribute_value in iter_fields(attribute):
+            if attribute_field == KEY_VALUE_KEY:
+                key = attribute_value.decode("utf-8", errors="replace")
+            elif attribute_field == KEY_VALUE_VALUE:
+                value = attribute_value
+        if key == SERVICE_NAME_ATTRIBUTE and value is not None:
+            for value_field, _, string_value in iter_fields(value):
+                if value_field == ANY_VALUE_STRING:
+                    return string_value.decode("utf-8", errors="replace")
+    return "unknown"
+
+def decode_span(data: bytes, service: str) -> Dict[str, Any]:
+    trace_id, span_id, parent_span_id, name, start_time_ns, end_time_ns = b"", b"", b"", b"", 0, 0
+    for field, _, value in iter_fields(data):
+        if field == SPAN_TRACE_ID:
+            trace_id = value
+        elif field == SPAN_SPAN_ID:
+            span_id = value
+        elif field == SPAN_PARENT_SPAN_ID:
+            parent_span_id = value
+        elif field == SPAN_NAME:
+            name = value
+        elif field == SPAN_START_TIME_UNIX_NANO:
+            start_time_ns = value
+        elif field == SPAN_END_TIME_UNIX_NANO:
+            end_time_ns = value
+
+    formatted_trace_id = format_trace_id(trace_id)
+    references = []
+    if parent_span_id:
+        references.append({"refType": "CHILD_OF", "traceID": formatted_trace_id, "spanID": parent_span_id.hex()})
+    return {
+        "traceID": formatted_trace_id,
+        "spanID": span_id.hex(),
+        "operationName": name.decode("utf-8", errors="replace"),
+        "references": references,
+        "startTime": start_time_ns // 1000,
+        "duration": (end_time_ns - start_time_ns) // 1000,
+        "processID": service,
+    }
+
+def decode_traces_data(payload: bytes) -> List[Dict[str, Any]]:
+    # one TracesData message, spans grouped into traces in the order they first appear
+    trace_id_to_trace: Dict[str, Dict[str, Any]] = {}
+    for field, _, resource_spans in iter_fields(payload):
+        if field != TRACES_DATA_RESOURCE_SPANS:
+            continue
+        service = "unknown"
+        scope_spans_list = []
+        for resource_spans_field, _, value in iter_fields(resource_spans):
+            if resource_spans_field == RESOURCE_SPANS_RESOURCE:
+                service = decode_resource_service(value)
+            elif resource_spans_field == RESOURCE_SPANS_SCOPE_SPANS:
+                scope_spans_list.append(value)
+        for scope_spans in scope_spans_list:
+            for scope_spans_field, _, span_data in iter_fields(scope_spans):
+                if scope_spans_field != SCOPE_SPANS_SPANS:
+                    continue
+                span = decode_span(span_data, service)
+                trace = trace_id_to_trace.get(span["traceID"])
+                if trace is None:
+                    trace = {"traceID": span["traceID"], "spans": [], "processes": {}, "warnings": None}
+                    trace_id_to_trace[span["traceID"]] = trace
+                trace["spans"].append(span)
+                trace["processes"][service] = {"serviceName": service, "tags": []}
+    return list(trace_id_to_trace.values())
+
+def encode_traces_data(trace: Dict[str, Any]) -> bytes:
+    # Jaeger query JSON trace to one TracesData message, one ResourceSpans per service
+    processes = trace.get("processes", {})
+    service_to_spans: Dict[str, List[bytes]] = {}
+    for span in trace.get("spans", []):
+        service = processes.get(span.get("processID"), {}).get("serviceName", "unknown")
+        parent_span_id = next((reference["spanID"] for reference in span.get("references", []) if reference.get("refType") == "CHILD_OF"), None)
+        start_time_ns = span.get("startTime", 0) * 1000
+        span_bytes = (encode_bytes_field(SPAN_TRACE_ID, parse_trace_id(span["traceID"]))
+                      + encode_bytes_field(SPAN_SPAN_ID, int(span["spanID"], 16).to_bytes(8, "big"))
+                      + (encode_bytes_field(SPAN_PARENT_SPAN_ID, int(parent_span_id, 16).to_bytes(8, "big")) if parent_span_id else b"")
+                      + encode_string_field(SPAN_NAME, span.get("operationName"))
+                      + encode_fixed64_field(SPAN_START_TIME_UNIX_NANO, start_time_ns)
+                      + encode_fixed64_field(SPAN_END_TIME_UNIX_NANO, start_time_ns + span.get("duration", 0) * 1000))
+        service_to_spans.setdefault(service, []).append(span_bytes)
+
+    payload = b""
+    for service, spans in service_to_spans.items():
+        attribute = encode_string_field(KEY_VALUE_KEY, SERVICE_NAME_ATTRIBUTE) + encode_bytes_field(KEY_VALUE_VALUE, encode_string_field(ANY_VALUE_STRING, service))
+        resource = encode_bytes_field(RESOURCE_ATTRIBUTES, attribute)
+        scope_spans = b"".join(encode_bytes_field(SCOPE_SPANS_SPANS, span_bytes) for span_bytes in spans)
+        payload += encode_bytes_field(TRACES_DATA_RESOURCE_SPANS, encode_bytes_field(RESOURCE_SPANS_RESOURCE, resource) + encode_bytes_field(RESOURCE_SPANS_SCOPE_SPANS, scope_spans))
+    return payload
+
+def encode_find_traces_request(service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> bytes:
+    # search_params uses the HTTP API names, see traces_handler.get_search_params
+    search_params = search_params or {}
+    end_time = search_params.get("end") or int(time.time() * 1e6)
+    start_time = search_params.get("start") or end_time - DEFAULT_LOOKBACK_US
+    query = (encode_string_field(QUERY_SERVICE_NAME, service_name)
+             + encode_string_field(QUERY_OPERATION_NAME, search_params.get("operation"))
+             + encode_timestamp_field(QUERY_START_TIME_MIN, int(start_time))
+             + encode_timestamp_field(QUERY_START_TIME_MAX, int(end_time))
+             + encode_varint_field(QUERY_SEARCH_DEPTH, limit))
+    if search_params.get("minDuration"):
+        query += encode_timestamp_field(QUERY_DURATION_MIN, parse_duration_us(str(search_params["minDuration"])))
+    if search_params.get("maxDuration"):
+        query += encode_timestamp_field(QUERY_DURATION_MAX, parse_duration_us(str(search_params["maxDuration"])))
+    return encode_bytes_field(FIND_TRACES_QUERY, query)
+
+def decode_find_traces_request(payload: bytes) -> Dict[str, Any]:
+    request: Dict[str, Any] = {}
+    for field, _, query in iter_fields(payload):
+        if field != FIND_TRACES_QUERY:
+            continue
+        for query_field, _, value in iter_fields(query):
+            if query_field == QUERY_SERVICE_NAME:
+                request["service"] = value.decode()
+            elif query_field == QUERY_OPERATION_NAME:
+                request["operation"] = value.decode()
+            elif query_field == QUERY_START_TIME_MIN:
+                request["start"] = decode_timestamp_us(value)
+            elif query_field == QUERY_START_TIME_MAX:
+                request["end"] = decode_timestamp_us(value)
+            elif query_field == QUERY_DURATION_MIN:
+                request["minDuration"] = decode_timestamp_us(value)
+            elif query_field == QUERY_DURATION_MAX:
+                request["maxDuration"] = decode_timestamp_us(value)
+            elif query_field == QUERY_SEARCH_DEPTH:
+                request["limit"] = value
+    return request
+
+def iter_streamed_traces(messages: Iterable[bytes], decode: Callable[[bytes], List[Dict[str, Any]]] = decode_traces_data) -> Iterator[Dict[str, Any]]:
+    # a trace may be split over consecutive messages, so the traces of the latest message
+    # are held back until a message without them arrives
+    pending: Dict[str, Dict[str, Any]] = {}
+    for message in messages:
+        traces = decode(message)
+        message_trace_ids = set(trace["traceID"] for trace in traces)
+        for trace_id in [trace_id for trace_id in pending if trace_id not in message_trace_ids]:
+            yield pending.pop(trace_id)
+        for trace in traces:
+            pending_trace = pending.get(trace["traceID"])
+            if pending_trace is None:
+                pending[trace["traceID"]] = trace
+            else:
+                pending_trace["spans"].extend(trace["spans"])
+                pending_trace["processes"].update(trace["processes"])
+    yield from pending.values()
+
+def get_channel(target: str) -> Any:
+    # channels are thread safe and multiplex calls, one per target is shared by all fetch workers
+    import grpc
+
+    if target not in target_to_channel:
+        target_to_channel[target] = grpc.insecure_channel(target, options=[("grpc.max_receive_message_length", MAX_MESSAGE_BYTES)])
+    return target_to_channel[target]
+
+def iter_find_traces_messages(target: str, service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> Iterator[bytes]:
+    # raw TracesData messages, without a deserializer grpc hands back the bytes as received
+    find_traces = get_channel(target).unary_stream(FIND_TRACES_METHOD)
+    yield from find_traces(encode_find_traces_request(service_name, limit, search_params))
+
+def find_traces(target: str, service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    print(f"Streaming traces from gRPC [{target}] for service [{service_name}] with limit [{limit}] and params [{search_params}]")
+    yield from iter_streamed_traces(iter_find_traces_messages(target, service_name, limit, search_params))
+
+def get_trace(target: str, trace_id: str) -> str:
+    # returned as the text of an HTTP /api/traces/{id} response, so the trace cache and
+    # parse_and_save_traces handle both backends alike
+    get_trace_call = get_channel(target).unary_stream(GET_TRACE_METHOD)
+    traces = list(iter_streamed_traces(get_trace_call(encode_string_field(GET_TRACE_TRACE_ID, trace_id))))
+    return json.dumps({"data": traces, "total": 0, "limit": 0, "offset": 0, "errors": None})
+
+def get_services(target: str) -> List[str]:
+    get_services_call = get_channel(target).unary_unary(GET_SERVICES_METHOD)
+    response = get_services_call(b"")
+    return [value.decode() for field, _, value in iter_fields(response) if field == GET_SERVICES_SERVICES]
@@ -0,0 +1,260 @@
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from jaeger_grpc import QUERY_SERVICE, GET_SERVICES_SERVICES, GET_TRACE_TRACE_ID, decode_find_traces_request, encode_bytes_field, encode_traces_data, iter_fields, parse_duration_us
+from trace_archive import TraceArchive, find_trace_archives
+
+# Serves the subset of the Jaeger query HTTP API that traces_handler uses, from synthetic
+# or recorded traces, so trace ingest can be exercised and benchmarked without Jaeger. The
+# api_v3 gRPC query service that jaeger_grpc uses can be served next to it.
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 16686
+DEFAULT_GRPC_PORT = 16685
+GRPC_SERVER_WORKERS = 16
+DEFAULT_SEARCH_LIMIT = 20
+SYNTHETIC_SERVICES = ["nginx-web-server", "compose-post-service", "text-service", "user-mention-service",
+                      "url-shorten-service", "media-service", "unique-id-service", "post-storage-service",
+                      "user-timeline-service", "home-timeline-service", "social-graph-service"]
+
+def create_synthetic_trace(trace_index: int, num_spans: int, start_time: int, rng: random.Random) -> Dict[str, Any]:
+    # root span on the first service, every other span is a child of a random earlier span
+    # and starts inside its parent, so children overlap and nest like a fan-out request
+    trace_id = f"{trace_index + 1:016x}"
+    root_duration = rng.randint(2_000, 20_000)
+    spans = [{
+        "traceID": trace_id,
+        "spanID": f"{trace_index + 1:08x}{0:08x}",
+        "operationName": "/wrk2-api/post/compose",
+        "references": [],
+        "startTime": start_time,
+        "duration": root_duration,
+        "processID": "p1",
+    }]
+    processes = {"p1": {"serviceName": SYNTHETIC_SERVICES[0], "tags": []}}
+
+    for span_index in range(1, num_spans):
+        parent = spans[rng.randrange(len(spans))]
+        parent_end_time = parent["startTime"] + parent["duration"]
+        span_start_time = rng.randint(parent["startTime"], max(parent["startTime"], parent_end_time - 1))
+        span_duration = rng.randint(1, max(1, (parent_end_time - span_start_time) // 2))
+        service_index = 1 + (span_index - 1) % (len(SYNTHETIC_SERVICES) - 1)
+        process_id = f"p{service_index + 1}"
+        processes[process_id] = {"serviceName": SYNTHETIC_SERVICES[service_index], "tags": []}
+        spans.append({
+            "traceID": trace_id,
+            "spanID": f"{trace_index + 1:08x}{span_index:08x}",
+            "operationName": f"{SYNTHETIC_SERVICES[service_index]}-op-{span_index % 4}",
+            "references": [{"refType": "CHILD_OF", "traceID": trace_id, "spanID": parent["spanID"]}],
+            "startTime": span_start_time,
+            "duration": span_duration,
+            "processID": process_id,
+        })
+
+    return {"traceID": trace_id, "spans": spans, "processes": processes, "warnings": None}
+
+def create_synthetic_traces(num_traces: int, spans_per_trace: int, seed: int) -> List[Dict[str, Any]]:
+    rng = random.Random(seed)
+    start_time = int(time.time() * 1e6)
+    traces = []
+    for trace_index in range(num_traces):
+        traces.append(create_synthetic_trace(trace_index, spans_per_trace, start_time, rng))
+        start_time += rng.randint(100, 10_000)
+    return traces
+
+def load_recorded_traces(traces_dir: str) -> List[Dict[str, Any]]:
+    # reads the {service}_traces.archive files written with --save-traces-json, and the
+    # {service}_{trace_id}.json files older runs saved instead
+    traces = []
+    for archive_path in find_trace_archives(traces_dir).values():
+        with TraceArchive(archive_path) as archive:
+            for _, trace_text in archive.iter_traces():
+                traces.extend(json.loads(trace_text).get("data", None) or [])
+    for file in sorted(os.listdir(traces_dir)):
+        if not file.endswith(".json"):
+            continue
+        with open(os.path.join(traces_dir, file), "r") as f:
+            traces.extend(json.load(f).get("data", None) or [])
+    return traces
+
+class JaegerStandIn:
+    def __init__(self, traces: List[Dict[str, Any]], latency_ms: float = 0.0):
+        self.latency_s = latency_ms / 1000
+        self.trace_id_to_text: Dict[str, str] = {}
+        # (service, operation, start_time, duration) of every span, used for search filters
+        self.trace_id_to_span_keys: Dict[str, List[Tuple[str, str, int, int]]] = {}
+        self.trace_id_to_start_time: Dict[str, int] = {}
+        for trace in traces:
+            trace_id = trace["traceID"]
+            self.trace_id_to_text[trace_id] = json.dumps(trace)
+            processes = trace.get("processes", {})
+            self.trace_id_to_span_keys[trace_id] = [
+                (processes.get(span.get("processID"), {}).get("serviceName"), span.get("operationName"), span.get("startTime", 0), span.get("duration", 0))
+                for span in trace.get("spans", [])
+            ]
+            self.trace_id_to_start_time[trace_id] = min((span.get("startTime", 0) for span in trace.get("spans", [])), default=0)
+        self.trace_id_to_traces_data: Dict[str, bytes] = {}
+        self.services = sorted(set(span_key[0] for span_keys in self.trace_id_to_span_keys.values() for span_key in span_keys))
+
+    def search(self, service: Optional[str], limit: int, start_time: Optional[int] = None, end_time: Optional[int] = None,
+               operation: Optional[str] = None, min_duration: Optional[int] = None, max_duration: Optional[int] = None) -> List[str]:
+        # a trace matches when one of its spans on the service matches every filter,
+        # like Jaeger the most recent traces come first
+        def matches(span_key: Tuple[str, str, int, int]) -> bool:
+            span_service, span_operation, span_start_time, span_duration = span_key
+            return ((service is None or span_service == service)
+                    and (operation is None or span_operation == operation)
+                    and (start_time is None or span_start_time >= start_time)
+                    and (end_time is None or span_start_time <= end_time)
+                    and (min_duration is None or span_duration >= min_duration)
+                    and (max_duration is None or span_duration <= max_duration))
+
+        trace_ids = [trace_id for trace_id, span_keys in self.trace_id_to_span_keys.items() if any(matches(span_key) for span_key in span_keys)]
+        trace_ids.sort(key=lambda trace_id: self.trace_id_to_start_time[trace_id], reverse=True)
+        return trace_ids[:limit]
+
+    def create_handler(self) -> type:
+        stand_in = self
+
+        class JaegerStandInHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out as separate writes, without this keep-alive
+            # requests stall on delayed ACKs and the stand-in adds its own latency
+            disable_nagle_algorithm = True
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+            def send_body(self, status: int, body: str) -> None:
+                if stand_in.latency_s > 0:
+                    time.sleep(stand_in.latency_s)
+                encoded_body = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(encoded_body)))
+                self.end_headers()
+                self.wfile.write(encoded_body)
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                params = parse_qs(url.query)
+                path = url.path.rstrip("/")
+
+                if path == "/api/services":
+                    self.send_body(200, json.dumps({"data": stand_in.services, "total": len(stand_in.services), "limit": 0, "offset": 0, "errors": None}))
+                elif path == "/api/traces":
+                    def param(name: str, parse: Any = str) -> Any:
+                        return parse(params[name][0]) if name in params else None
+                    trace_ids = stand_in.search(
+                        param("service"), param("limit", int) or DEFAULT_SEARCH_LIMIT, param("start", int), param("end", int),
+                        param("operation"), param("minDuration", parse_duration_us), param("maxDuration", parse_duration_us))
+                    body = '{"data":[' + ",".join(stand_in.trace_id_to_text[trace_id] for trace_id in trace_ids) + '],"total":0,"limit":0,"offset":0,"errors":null}'
+                    self.send_body(200, body)
+                elif path.startswith("/api/traces/"):
+                    trace_id = path[len("/api/traces/"):]
+                    if trace_id not in stand_in.trace_id_to_text:
+                        self.send_body(404, json.dumps({"data": None, "total": 0, "limit": 0, "offset": 0, "errors": [{"code": 404, "msg": "trace not found"}]}))
+                        return
+                    self.send_body(200, '{"data":[' + stand_in.trace_id_to_text[trace_id] + '],"total":0,"limit":0,"offset":0,"errors":null}')
+                else:
+                    self.send_body(404, json.dumps({"data": None, "errors": [{"code": 404, "msg": "not found"}]}))
+
+        return JaegerStandInHandler
+
+    def get_traces_data(self, trace_id: str) -> bytes:
+        # encoded on first use and kept, like the JSON text
+        if trace_id not in self.trace_id_to_traces_data:
+            self.trace_id_to_traces_data[trace_id] = encode_traces_data(json.loads(self.trace_id_to_text[trace_id]))
+        return self.trace_id_to_traces_data[trace_id]
+
+    def create_grpc_handler(self) -> Any:
+        # messages are passed as raw bytes, one TracesData message per trace like Jaeger's api_v3
+        import grpc
+
+        stand_in = self
+
+        def find_traces(request: bytes, context: Any) -> Iterator[bytes]:
+            query = decode_find_traces_request(request)
+            if stand_in.latency_s > 0:
+                time.sleep(stand_in.latency_s)
+            trace_ids = stand_in.search(query.get("service"), query.get("limit") or DEFAULT_SEARCH_LIMIT, query.get("start"), query.get("end"),
+                                        query.get("operation"), query.get("minDuration"), query.get("maxDuration"))
+            for trace_id in trace_ids:
+                yield stand_in.get_traces_data(trace_id)
+
+        def get_trace(request: bytes, context: Any) -> Iterator[bytes]:
+            trace_id = next((value.decode() for field, _, value in iter_fields(request) if field == GET_TRACE_TRACE_ID), "")
+            if stand_in.latency_s > 0:
+                time.sleep(stand_in.latency_s)
+            if trace_id not in stand_in.trace_id_to_text:
+                context.abort(grpc.StatusCode.NOT_FOUND, "trace not found")
+            yield stand_in.get_traces_data(trace_id)
+
+        def get_services(request: bytes, context: Any) -> bytes:
+            return b"".join(encode_bytes_field(GET_SERVICES_SERVICES, service.encode()) for service in stand_in.services)
+
+        return grpc.method_handlers_generic_handler(QUERY_SERVICE, {
+            "FindTraces": grpc.unary_stream_rpc_method_handler(find_traces),
+            "GetTrace": grpc.unary_stream_rpc_method_handler(get_trace),
+            "GetServices": grpc.unary_unary_rpc_method_handler(get_services),
+        })
+
+def start_jaeger_stand_in(traces: List[Dict[str, Any]], host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, latency_ms: float = 0.0) -> ThreadingHTTPServer:
+    # serves from a daemon thread, port 0 picks a free port, see server.server_address
+    server = ThreadingHTTPServer((host, port), JaegerStandIn(traces, latency_ms).create_handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_jaeger_grpc_stand_in(traces: List[Dict[str, Any]], host: str = DEFAULT_HOST, port: int = DEFAULT_GRPC_PORT, latency_ms: float = 0.0) -> Tuple[Any, int]:
+    # returns the started server and the bound port, port 0 picks a free port
+    import grpc
+    from concurrent.futures import ThreadPoolExecutor
+
+    server = grpc.server(ThreadPoolExecutor(max_workers=GRPC_SERVER_WORKERS))
+    server.add_generic_rpc_handlers((JaegerStandIn(traces, latency_ms).create_grpc_handler(),))
+    bound_port = server.add_insecure_port(f"{host}:{port}")
+    server.start()
+    return server, bound_port
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve synthetic or recorded traces over the Jaeger query HTTP API")
+    parser.add_argument("--host", type=str, default=DEFAULT_HOST, help="Host to listen on")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on")
+    parser.add_argument("--grpc-port", type=int, default=0, help="Also serve the api_v3 gRPC query service on this port, e.g. 16685")
+    parser.add_argument("--traces-dir", type=str, help="Directory of saved trace JSONs to serve instead of synthetic traces")
+    parser.add_argument("--num-traces", type=int, default=1000, help="Number of synthetic traces")
+    parser.add_argument("--spans-per-trace", type=int, default=20, help="Number of spans per synthetic trace")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Added latency per request in milliseconds")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for synthetic traces")
+    args = parser.parse_args()
+
+    if args.traces_dir:
+        traces = load_recorded_traces(args.traces_dir)
+    else:
+        traces = create_synthetic_traces(args.num_traces, args.spans_per_trace, args.seed)
+
+    stand_in = JaegerStandIn(traces, args.latency_ms)
+    server = ThreadingHTTPServer((args.host, args.port), stand_in.create_handler())
+    server.daemon_threads = True
+    print(f"Serving [{len(traces)}] traces on [http://{args.host}:{server.server_address[1]}] with [{args.latency_ms}] ms latency")
+    grpc_server = None
+    if args.grpc_port:
+        grpc_server, grpc_port = start_jaeger_grpc_stand_in(traces, args.host, args.grpc_port, args.latency_ms)
+        print(f"Serving [{len(traces)}] traces over gRPC on [{args.host}:{grpc_port}]")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if grpc_server is not None:
+            grpc_server.stop(None)
+
+if __name__ == "__main__":
+    main()
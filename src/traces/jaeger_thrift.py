@@ -0,0 +1,185 @@
+import struct
+from typing import Any, Dict, List, Tuple
+
+# Decoder for the Thrift compact protocol payloads that Jaeger clients send to the agent over
+# UDP (Agent.emitBatch, see jaeger-idl thrift/jaeger.thrift). Structs are decoded generically
+# into {field_id: value} dicts and then mapped onto the Jaeger query JSON layout that
+# create_span_data_graph already understands.
+COMPACT_PROTOCOL_ID = 0x82
+COMPACT_VERSION_MASK = 0x1f
+COMPACT_TYPE_SHIFT = 5
+
+TYPE_STOP = 0
+TYPE_BOOLEAN_TRUE = 1
+TYPE_BOOLEAN_FALSE = 2
+TYPE_BYTE = 3
+TYPE_I16 = 4
+TYPE_I32 = 5
+TYPE_I64 = 6
+TYPE_DOUBLE = 7
+TYPE_BINARY = 8
+TYPE_LIST = 9
+TYPE_SET = 10
+TYPE_MAP = 11
+TYPE_STRUCT = 12
+
+# field ids from jaeger.thrift
+BATCH_PROCESS = 1
+BATCH_SPANS = 2
+PROCESS_SERVICE_NAME = 1
+SPAN_TRACE_ID_LOW = 1
+SPAN_TRACE_ID_HIGH = 2
+SPAN_SPAN_ID = 3
+SPAN_PARENT_SPAN_ID = 4
+SPAN_OPERATION_NAME = 5
+SPAN_REFERENCES = 6
+SPAN_START_TIME = 8
+SPAN_DURATION = 9
+SPAN_REF_TYPE = 1
+SPAN_REF_TRACE_ID_LOW = 2
+SPAN_REF_TRACE_ID_HIGH = 3
+SPAN_REF_SPAN_ID = 4
+SPAN_REF_TYPES = {0: "CHILD_OF", 1: "FOLLOWS_FROM"}
+
+class CompactReader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.pos = 0
+
+    def read_byte(self) -> int:
+        if self.pos >= len(self.data):
+            raise ValueError("Unexpected end of thrift payload")
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def read_varint(self) -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte = self.read_byte()
+            result |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return result
+            shift += 7
+
+    def read_zigzag(self) -> int:
+        value = self.read_varint()
+        return (value >> 1) ^ -(value & 1)
+
+    def read_binary(self) -> bytes:
+        length = self.read_varint()
+        if self.pos + length > len(self.data):
+            raise ValueError("Unexpected end of thrift payload")
+        value = self.data[self.pos:self.pos + length]
+        self.pos += length
+        return value
+
+    def read_value(self, value_type: int) -> Any:
+        if value_type == TYPE_BOOLEAN_TRUE:
+            return True
+        if value_type == TYPE_BOOLEAN_FALSE:
+            return False
+        if value_type == TYPE_BYTE:
+            return self.read_byte()
+        if value_type in (TYPE_I16, TYPE_I32, TYPE_I64):
+            return self.read_zigzag()
+        if value_type == TYPE_DOUBLE:
+            if self.pos + 8 > len(self.data):
+                raise ValueError("Unexpected end of thrift payload")
+            value = struct.unpack_from("<d", self.data, self.pos)[0]
+            self.pos += 8
+            return value
+        if value_type == TYPE_BINARY:
+            return self.read_binary()
+        if value_type in (TYPE_LIST, TYPE_SET):
+            return self.read_list()
+        if value_type == TYPE_MAP:
+            return self.read_map()
+        if value_type == TYPE_STRUCT:
+            return self.read_struct()
+        raise ValueError(f"Unknown thrift compact type [{value_type}]")
+
+    def read_list(self) -> List[Any]:
+        header = self.read_byte()
+        size = header >> 4
+        element_type = header & 0x0f
+        if size == 15:
+            size = self.read_varint()
+        if element_type in (TYPE_BOOLEAN_TRUE, TYPE_BOOLEAN_FALSE):
+            # booleans inside collections take a whole byte
+            return [self.read_byte() == TYPE_BOOLEAN_TRUE for _ in range(size)]
+        return [self.read_value(element_type) for _ in range(size)]
+
+    def read_map(self) -> Dict[Any, Any]:
+        size = self.read_varint()
+        if size == 0:
+            return {}
+        types = self.read_byte()
+        return {self.read_value(types >> 4): self.read_value(types & 0x0f) for _ in range(size)}
+
+    def read_struct(self) -> Dict[int, Any]:
+        fields: Dict[int, Any] = {}
+        field_id = 0
+        while True:
+            header = self.read_byte()
+            field_type = header & 0x0f
+            if field_type == TYPE_STOP:
+                return fields
+            delta = header >> 4
+            field_id = field_id + delta if delta else self.read_zigzag()
+            fields[field_id] = self.read_value(field_type)
+
+    def read_message_begin(self) -> Tuple[str, int, int]:
+        if self.read_byte() != COMPACT_PROTOCOL_ID:
+            raise ValueError("Not a thrift compact protocol message")
+        version_and_type = self.read_byte()
+        message_type = (version_and_type >> COMPACT_TYPE_SHIFT) & 0x07
+        sequence_id = self.read_varint()
+        name = self.read_binary().decode("utf-8", errors="replace")
+        return name, message_type, sequence_id
+
+def format_id(value: int) -> str:
+    # thrift i64 ids are signed, Jaeger renders them as unsigned zero padded hex
+    return f"{value & 0xffffffffffffffff:016x}"
+
+def format_trace_id(trace_id_high: int, trace_id_low: int) -> str:
+    if trace_id_high == 0:
+        return format_id(trace_id_low)
+    return format_id(trace_id_high) + format_id(trace_id_low)
+
+def decode_emit_batch(payload: bytes) -> Tuple[str, List[Dict[str, Any]]]:
+    # returns the batch service name and its spans in the Jaeger query JSON span layout
+    reader = CompactReader(payload)
+    name, _, _ = reader.read_message_begin()
+    if name != "emitBatch":
+        raise ValueError(f"Unexpected thrift method [{name}]")
+    args = reader.read_struct()
+    batch = args.get(1, {})
+    process = batch.get(BATCH_PROCESS, {})
+    service_name = process.get(PROCESS_SERVICE_NAME, b"unknown").decode("utf-8", errors="replace")
+
+    spans = []
+    for thrift_span in batch.get(BATCH_SPANS, []):
+        trace_id = format_trace_id(thrift_span.get(SPAN_TRACE_ID_HIGH, 0), thrift_span.get(SPAN_TRACE_ID_LOW, 0))
+        references = []
+        for thrift_reference in thrift_span.get(SPAN_REFERENCES, []):
+            references.append({
+                "refType": SPAN_REF_TYPES.get(thrift_reference.get(SPAN_REF_TYPE, 0), "CHILD_OF"),
+                "traceID": format_trace_id(thrift_reference.get(SPAN_REF_TRACE_ID_HIGH, 0), thrift_reference.get(SPAN_REF_TRACE_ID_LOW, 0)),
+                "spanID": format_id(thrift_reference.get(SPAN_REF_SPAN_ID, 0)),
+            })
+        parent_span_id = thrift_span.get(SPAN_PARENT_SPAN_ID, 0)
+        if parent_span_id != 0 and not references:
+            # older clients only set parentSpanId, Jaeger turns it into a CHILD_OF reference
+            references.append({"refType": "CHILD_OF", "traceID": trace_id, "spanID": format_id(parent_span_id)})
+        spans.append({
+            "traceID": trace_id,
+            "spanID": format_id(thrift_span.get(SPAN_SPAN_ID, 0)),
+            "operationName": thrift_span.get(SPAN_OPERATION_NAME, b"unknown").decode("utf-8", errors="replace"),
+            "references": references,
+            "startTime": thrift_span.get(SPAN_START_TIME, 0),
+            "duration": thrift_span.get(SPAN_DURATION, 0),
+        })
+
+    return service_name, spans
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+from typing import Iterable, Iterator, List, Tuple
+from span_store import parse_non_idle_intervals
+from span_table import segmented_cummax
+
+class TraceNonIdleIntervals:
+    # Merged non idle intervals of many traces as CSR arrays: the intervals of trace i are
+    # starts/ends[offsets[i]:offsets[i + 1]], sorted by start time and non overlapping.
+    # Traces keep the order of their first span in the traces data.
+    def __init__(self, trace_ids: np.ndarray, offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+        self.trace_ids = trace_ids
+        self.offsets = offsets
+        self.starts = starts
+        self.ends = ends
+
+    def __len__(self) -> int:
+        return len(self.trace_ids)
+
+    def get_counts(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def get_trace_starts(self) -> np.ndarray:
+        return self.starts[self.offsets[:-1]]
+
+    def get_trace_ends(self) -> np.ndarray:
+        return self.ends[self.offsets[1:] - 1]
+
+    def get_non_idle_durations(self) -> np.ndarray:
+        # total non idle time of every trace
+        durations = self.ends - self.starts
+        return np.add.reduceat(durations, self.offsets[:-1]) if len(durations) else np.zeros(len(self.trace_ids), dtype=np.int64)
+
+    def get_intervals(self, trace_idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        interval_slice = slice(self.offsets[trace_idx], self.offsets[trace_idx + 1])
+        return self.starts[interval_slice], self.ends[interval_slice]
+
+    def items(self) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+        # yields (trace_id, [(start, end), ...]) with plain ints, for code that walks traces one by one
+        starts, ends, offsets = self.starts.tolist(), self.ends.tolist(), self.offsets.tolist()
+        for trace_idx, trace_id in enumerate(self.trace_ids):
+            yield trace_id, list(zip(starts[offsets[trace_idx]:offsets[trace_idx + 1]], ends[offsets[trace_idx]:offsets[trace_idx + 1]]))
+
+    def select(self, trace_mask: np.ndarray) -> "TraceNonIdleIntervals":
+        counts = self.get_counts()[trace_mask]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        interval_mask = np.repeat(trace_mask, self.get_counts())
+        return TraceNonIdleIntervals(self.trace_ids[trace_mask], offsets, self.starts[interval_mask], self.ends[interval_mask])
+
+    def select_trace_ids(self, trace_ids: Iterable[str]) -> "TraceNonIdleIntervals":
+        return self.select(np.isin(self.trace_ids, np.array(list(trace_ids), dtype=object)))
+
+    def __repr__(self):
+        return f"TraceNonIdleIntervals(num_traces={len(self.trace_ids)}, " \
+            f"num_intervals={len(self.starts)})"
+
+def get_span_intervals(non_idle_intervals: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # per span CSR intervals from either "s-e;s-e" csv strings or the (n, 2) arrays of the span store
+    if len(non_idle_intervals) == 0 or isinstance(non_idle_intervals.iloc[0], str):
+        return parse_non_idle_intervals(non_idle_intervals)
+    arrays = [np.asarray(intervals, dtype=np.int64).reshape(-1, 2) for intervals in non_idle_intervals]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    np.cumsum([len(intervals) for intervals in arrays], out=offsets[1:])
+    flat = np.concatenate(arrays)
+    return offsets, flat[:, 0], flat[:, 1]
+
+def merge_trace_non_idle_intervals(traces_df: pd.DataFrame) -> TraceNonIdleIntervals:
+    # sorts every trace's span intervals by start and merges overlapping or touching ones:
+    # an interval starting after the furthest end of the earlier intervals of its trace
+    # starts a new merged interval
+    trace_codes, trace_ids = pd.factorize(traces_df["trace_id"])
+    span_offsets, span_starts, span_ends = get_span_intervals(traces_df["non_idle_intervals"])
+    interval_trace_codes = np.repeat(trace_codes.astype(np.int64), np.diff(span_offsets))
+    if len(span_starts) == 0:
+        empty = np.empty(0, dtype=np.int64)
+        return TraceNonIdleIntervals(np.empty(0, dtype=object), np.zeros(1, dtype=np.int64), empty, empty)
+
+    order = np.lexsort((span_starts, interval_trace_codes))
+    trace_codes_sorted, starts, ends = interval_trace_codes[order], span_starts[order], span_ends[order]
+
+    first_of_trace = np.ones(len(starts), dtype=bool)
+    first_of_trace[1:] = trace_codes_sorted[1:] != trace_codes_sorted[:-1]
+    running_end = segmented_cummax(ends, np.flatnonzero(first_of_trace))
+    starts_merged = first_of_trace.copy()
+    starts_merged[1:] |= starts[1:] > running_end[:-1]
+    merged_starts_idx = np.flatnonzero(starts_merged)
+
+    merged_trace_codes = trace_codes_sorted[merged_starts_idx]
+    present_trace_codes, counts = np.unique(merged_trace_codes, return_counts=True)
+    offsets = np.zeros(len(present_trace_codes) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return TraceNonIdleIntervals(np.asarray(trace_ids, dtype=object)[present_trace_codes], offsets,
+                                 starts[merged_starts_idx], np.maximum.reduceat(ends, merged_starts_idx))
+
+def concat_trace_non_idle_intervals(trace_non_idle_intervals_list: List[TraceNonIdleIntervals]) -> TraceNonIdleIntervals:
+    if not trace_non_idle_intervals_list:
+        empty = np.empty(0, dtype=np.int64)
+        return TraceNonIdleIntervals(np.empty(0, dtype=object), np.zeros(1, dtype=np.int64), empty, empty)
+    counts = np.concatenate([trace_non_idle_intervals.get_counts() for trace_non_idle_intervals in trace_non_idle_intervals_list])
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return TraceNonIdleIntervals(
+        np.concatenate([trace_non_idle_intervals.trace_ids for trace_non_idle_intervals in trace_non_idle_intervals_list]), offsets,
+        np.concatenate([trace_non_idle_intervals.starts for trace_non_idle_intervals in trace_non_idle_intervals_list]),
+        np.concatenate([trace_non_idle_intervals.ends for trace_non_idle_intervals in trace_non_idle_intervals_list]))
@@ -5,7 +5,12 @@ import seaborn as sns
 import math
 import os
 import numpy as np
-from typing import Tuple
+from typing import List, Tuple
+from span_store import get_span_store_dir, has_span_store, load_span_store
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+from src.profile.figure_rendering import DEFAULT_RENDER_WORKERS, DEFAULT_WORKER_MEMORY_MB, render_figures
 
 DEFAULT_SERVICE_NAME = "nginx-web-server"
 
@@ -18,6 +23,8 @@ def parse_arguments() -> argparse.Namespace:
     parser.add_argument("--data-dir", type=str, required=True, help="Data directory")
     parser.add_argument("--plot-dir", type=str, required=True, help="Plot directory")
     parser.add_argument("--default-service-name", type=str, help="Default service name for traces")
+    parser.add_argument("--workers", type=int, default=DEFAULT_RENDER_WORKERS, help="Number of figure rendering processes")
+    parser.add_argument("--worker-memory-mb", type=int, default=DEFAULT_WORKER_MEMORY_MB, help="Memory a rendering process may allocate in MB, 0 for no limit")
     
     return parser.parse_args()
 
@@ -37,8 +44,14 @@ def load_data(
         jaeger_traces_csv_file_path: str = os.path.join(data_dir, 
                                                     f"{DEFAULT_SERVICE_NAME}_{test_name}_{config}_traces_data.csv")
 
-    jaeger_traces_df: pd.DataFrame = pd.read_csv(jaeger_traces_csv_file_path)
-    container_jaeger_traces_df: pd.DataFrame = jaeger_traces_df[jaeger_traces_df['container_name'] == container_name]
+    columns = ['service', 'operation', 'start_time', 'non_idle_execution_time']
+    span_store_dir: str = get_span_store_dir(jaeger_traces_csv_file_path)
+    if has_span_store(span_store_dir):
+        print(f"Loading container [{container_name}] from span store {span_store_dir}")
+        container_jaeger_traces_df: pd.DataFrame = load_span_store(span_store_dir, container_name, columns)
+    else:
+        jaeger_traces_df: pd.DataFrame = pd.read_csv(jaeger_traces_csv_file_path, usecols=columns + ['container_name'])
+        container_jaeger_traces_df: pd.DataFrame = jaeger_traces_df[jaeger_traces_df['container_name'] == container_name]
     per_service_operation_stats: pd.DataFrame = (
         container_jaeger_traces_df
         .groupby(['service', 'operation'])['non_idle_execution_time']
@@ -90,6 +103,47 @@ def plot_histogram(
     ax.tick_params(axis='both', labelsize=8)
     ax.grid(True, linestyle='--', alpha=0.7)
 
+def render_service_histograms(
+        service: str,
+        operation_plots: List[Tuple[str, pd.Series, pd.Series]],
+        x_min: float,
+        x_max: float,
+        y_max: float,
+        container_name: str,
+        test_name: str,
+        config: str,
+        output_file_path: str
+) -> str:
+    num_operations: int = len(operation_plots)
+    plots_per_row: int = 4
+    rows: int = math.ceil(num_operations / plots_per_row)
+
+    fig, axs = plt.subplots(rows, plots_per_row, figsize=(12, 5 * rows))
+    plt.style.use('ggplot')
+    axs = np.array(axs).reshape(rows, plots_per_row)
+    fig.suptitle(
+        f"Non-Idle Execution Time - {container_name}\nService: {service} | Test: {test_name} | Config: {config}", 
+        fontsize=14, 
+        y=0.98,
+        fontweight='bold'
+    )
+
+    plot_count: int = 0
+    for operation, operation_data, stats in operation_plots:
+        row: int = plot_count // plots_per_row
+        col: int = plot_count % plots_per_row
+        ax: plt.Axes = axs[row, col]
+        plot_histogram(ax, operation_data, operation, stats, x_min, x_max, y_max)
+        plot_count += 1
+    for i in range(plot_count, rows * plots_per_row):
+        axs[i // plots_per_row, i % plots_per_row].axis('off')
+
+    plt.tight_layout()
+    plt.subplots_adjust(top=0.9, hspace=0.4, wspace=0.3)
+    plt.savefig(output_file_path, bbox_inches='tight', dpi=300)
+    plt.close(fig)
+    return output_file_path
+
 def plot_service_histograms(
         container_jaeger_traces_df: pd.DataFrame, 
         per_service_operation_stats: pd.DataFrame,
@@ -98,50 +152,30 @@ def plot_service_histograms(
         plot_dir: str,
         container_name: str, 
         test_name: str, 
-        config: str
+        config: str,
+        num_workers: int = DEFAULT_RENDER_WORKERS,
+        worker_memory_mb: int = DEFAULT_WORKER_MEMORY_MB
 ) -> None:
+    # the data of every service's figure is gathered here and the figures are rendered in parallel
+    figure_args = []
     for service in unique_services:
         service_data_df: pd.DataFrame = container_jaeger_traces_df[container_jaeger_traces_df['service'] == service]
         service_stats_df: pd.DataFrame = per_service_operation_stats[per_service_operation_stats['service'] == service]
         histograms = []
+        operation_plots: List[Tuple[str, pd.Series, pd.Series]] = []
         for operation, stats in service_stats_df.groupby('operation'):
-            operation_data = service_data_df[service_data_df['operation'] == operation]['non_idle_execution_time']
+            operation_data: pd.Series = service_data_df[service_data_df['operation'] == operation]['non_idle_execution_time']
             hist, _ = np.histogram(operation_data, bins='auto')
             histograms.append(hist)
+            operation_plots.append((str(operation), operation_data, stats.iloc[0]))
         
         x_min = service_data_df['non_idle_execution_time'].min()
         x_max = service_data_df['non_idle_execution_time'].max() * 1.05
         y_max = max([h.max() for h in histograms]) * 1.1 
-        num_operations: int = len(service_stats_df)
-        plots_per_row: int = 4
-        rows: int = math.ceil(num_operations / plots_per_row)
-
-        fig, axs = plt.subplots(rows, plots_per_row, figsize=(12, 5 * rows))
-        plt.style.use('ggplot')
-        axs = np.array(axs).reshape(rows, plots_per_row)
-        fig.suptitle(
-            f"Non-Idle Execution Time - {container_name}\nService: {service} | Test: {test_name} | Config: {config}", 
-            fontsize=14, 
-            y=0.98,
-            fontweight='bold'
-        )
-
-        plot_count: int = 0
-        for operation, stats in service_stats_df.groupby('operation'):
-            row: int = plot_count // plots_per_row
-            col: int = plot_count % plots_per_row
-            ax: plt.Axes = axs[row, col]
-            operation_data: pd.Series = service_data_df[service_data_df['operation'] == operation]['non_idle_execution_time']
-            plot_histogram(ax, operation_data, str(operation), stats.iloc[0], x_min, x_max, y_max)
-            plot_count += 1
-        for i in range(plot_count, rows * plots_per_row):
-            axs[i // plots_per_row, i % plots_per_row].axis('off')
-
-        plt.tight_layout()
-        plt.subplots_adjust(top=0.9, hspace=0.4, wspace=0.3)
         output_file_path: str = os.path.join(plot_dir, f"{container_name}_{test_name}_{config}_service_{service}_exec_time_dist.png")
-        plt.savefig(output_file_path, bbox_inches='tight', dpi=300)
-        plt.close(fig)
+        figure_args.append((service, operation_plots, x_min, x_max, y_max, container_name, test_name, config, output_file_path))
+
+    for output_file_path in render_figures(render_service_histograms, figure_args, num_workers, worker_memory_mb):
         print(f'Plot saved: {output_file_path}')
 
     print("Done plotting Jaeger trace data")
@@ -184,6 +218,8 @@ def main() -> None:
     config: str = args.config.replace(" ", "_")
     data_dir: str = args.data_dir
     plot_dir: str = args.plot_dir
+    num_workers: int = args.workers
+    worker_memory_mb: int = args.worker_memory_mb
 
     if args.default_service_name:
         DEFAULT_SERVICE_NAME = args.default_service_name
@@ -196,6 +232,8 @@ def main() -> None:
     print(f"Data Directory: {data_dir}")
     print(f"Plot Directory: {plot_dir}")
     print(f"Default Service Name: {DEFAULT_SERVICE_NAME}")
+    print(f"Workers: {num_workers}")
+    print(f"Worker Memory (MB): {worker_memory_mb}")
 
     container_jaeger_traces_df, per_service_operation_stats, unique_services = load_data(
         data_dir, service_name_for_traces, test_name, config, container_name)
@@ -208,7 +246,7 @@ def main() -> None:
     plot_trace_non_idle_exec_times(container_jaeger_traces_df, container_name, test_name, config, data_dir, plot_dir)
 
     print(f"\nPlotting histograms for each service...")
-    plot_service_histograms(container_jaeger_traces_df, per_service_operation_stats, unique_services, data_dir, plot_dir, container_name, test_name, config)
+    plot_service_histograms(container_jaeger_traces_df, per_service_operation_stats, unique_services, data_dir, plot_dir, container_name, test_name, config, num_workers, worker_memory_mb)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,11 +1,21 @@
-from traces_handler import get_trace_ids, get_services, parse_and_save_traces
+import traces_handler
+from traces_handler import get_trace_ids, get_traces, stream_traces, iter_traces_in_window, get_services, parse_and_save_traces, parse_and_save_traces_from_search, DEFAULT_FETCH_WORKERS
+from critical_path import CriticalPathAggregator, save_critical_path
+from span_store import get_span_store_dir, write_span_store
+from trace_cache import TraceCache, DEFAULT_TRACE_CACHE_MAX_MB
+from typing import Any, Dict, Optional, Tuple
 import argparse
 import os
+import time
+import pandas as pd
 
 DEFAULT_SERVICE_NAME = "nginx-web-server"
+INGEST_MODES = ["bulk", "stream", "per-trace"]
 
 def parse_config_file(data_dir: str) -> dict:
-    docker_container_service_config_path = os.path.join(data_dir, "docker_container_service_config.csv")
+    return parse_container_config_file(os.path.join(data_dir, "docker_container_service_config.csv"))
+
+def parse_container_config_file(docker_container_service_config_path: str) -> dict:
     if not os.path.exists(docker_container_service_config_path):
         print(f"[ERROR:] Docker container service config file [{docker_container_service_config_path}] not found.")
         SystemExit(1)
@@ -20,7 +30,23 @@ def parse_config_file(data_dir: str) -> dict:
 
     return jaeger_service_to_container_mapping
 
-def process_traces(service_name_for_traces: str, data_dir :str, limit: int, test_name: str, config: str, jaeger_service_to_container_mapping: dict, save_traces_json: bool) -> None:
+def get_profile_data_window(profile_data_dir: str) -> Optional[Tuple[int, int]]:
+    # profiler samples are timestamped in microseconds, like Jaeger span start times
+    min_time, max_time = None, None
+    for file in os.listdir(profile_data_dir):
+        if not file.endswith(".csv"):
+            continue
+        times = pd.read_csv(os.path.join(profile_data_dir, file), usecols=["Time"])["Time"]
+        if times.empty:
+            continue
+        min_time = int(times.min()) if min_time is None else min(min_time, int(times.min()))
+        max_time = int(times.max()) if max_time is None else max(max_time, int(times.max()))
+    if min_time is None:
+        return None
+    return min_time, max_time
+
+def process_traces(service_name_for_traces: str, data_dir :str, limit: int, test_name: str, config: str, jaeger_service_to_container_mapping: dict, save_traces_json: bool, fetch_workers: int, ingest_mode: str, trace_cache_dir: str = None, trace_cache_max_mb: int = DEFAULT_TRACE_CACHE_MAX_MB,
+                   window: Optional[Tuple[int, int]] = None, num_windows: int = 1, page_limit: Optional[int] = None, search_filters: Optional[Dict[str, Any]] = None) -> None:
     global DEFAULT_SERVICE_NAME
 
     available_services = get_services()['data']
@@ -30,13 +56,36 @@ def process_traces(service_name_for_traces: str, data_dir :str, limit: int, test
         print(f"Using default service to collect traces [{DEFAULT_SERVICE_NAME}]")
         service_name_for_traces = DEFAULT_SERVICE_NAME
     
-    trace_ids = get_trace_ids(service_name_for_traces, limit)
-
-    df = parse_and_save_traces(service_name_for_traces, data_dir, trace_ids, save_traces_json)
+    trace_cache = TraceCache(trace_cache_dir, trace_cache_max_mb * 1024 * 1024) if trace_cache_dir else None
+    critical_path_aggregator = CriticalPathAggregator()
+
+    if window is not None:
+        window_start, window_end = window
+        page_limit = page_limit if page_limit else limit
+        print(f"Collecting up to [{limit}] traces in window [{window_start} - {window_end}] over [{num_windows}] sub-windows with page limit [{page_limit}] and filters [{search_filters}]")
+        traces = iter_traces_in_window(service_name_for_traces, window_start, window_end, limit, page_limit, num_windows, search_filters, ingest_mode == "stream")
+        if ingest_mode == "per-trace":
+            trace_ids = [trace.get("traceID", "unknown") for trace in traces]
+            df = parse_and_save_traces(service_name_for_traces, data_dir, trace_ids, save_traces_json, fetch_workers, trace_cache, critical_path_aggregator)
+        else:
+            df = parse_and_save_traces_from_search(service_name_for_traces, data_dir, traces, save_traces_json, fetch_workers, trace_cache, critical_path_aggregator)
+    elif ingest_mode == "bulk":
+        traces = get_traces(service_name_for_traces, limit, search_filters)
+        df = parse_and_save_traces_from_search(service_name_for_traces, data_dir, traces, save_traces_json, fetch_workers, trace_cache, critical_path_aggregator)
+    elif ingest_mode == "stream":
+        traces = stream_traces(service_name_for_traces, limit, search_filters)
+        df = parse_and_save_traces_from_search(service_name_for_traces, data_dir, traces, save_traces_json, fetch_workers, trace_cache, critical_path_aggregator)
+    else:
+        trace_ids = get_trace_ids(service_name_for_traces, limit, search_filters)
+        df = parse_and_save_traces(service_name_for_traces, data_dir, trace_ids, save_traces_json, fetch_workers, trace_cache, critical_path_aggregator)
     if df is None:
         print(f"[ERROR:] No traces found for service '{service_name_for_traces}'")
         SystemExit(1)
 
+    df_csv_file_path = save_traces_data(df, service_name_for_traces, data_dir, test_name, config, jaeger_service_to_container_mapping)
+    save_critical_path(critical_path_aggregator, df_csv_file_path)
+
+def save_traces_data(df: pd.DataFrame, service_name_for_traces: str, data_dir: str, test_name: str, config: str, jaeger_service_to_container_mapping: dict) -> str:
     df['container_name'] = df['service'].apply(lambda x: jaeger_service_to_container_mapping[x] if x in jaeger_service_to_container_mapping else None)
 
     test_name = test_name.replace(" ", "_")
@@ -48,6 +97,9 @@ def process_traces(service_name_for_traces: str, data_dir :str, limit: int, test
 
     print(f"Saved traces data to {df_csv_file_path}")
 
+    write_span_store(df, get_span_store_dir(df_csv_file_path))
+    return df_csv_file_path
+
 def main() -> None:
     global DEFAULT_SERVICE_NAME
 
@@ -59,16 +111,51 @@ def main() -> None:
     parser.add_argument("--config", type=str, required=True, help="Test config")
     parser.add_argument("--save-trace-json", type=bool, default=False, help="Save trace jsons")
     parser.add_argument("--default-service-name", type=str, help="Default service name")
+    parser.add_argument("--fetch-workers", type=int, default=DEFAULT_FETCH_WORKERS, help="Number of concurrent trace fetch workers")
+    parser.add_argument("--ingest-mode", type=str, choices=INGEST_MODES, default="bulk", help="Build traces from the bulk search response, stream them out of it one at a time, or fetch each trace by id")
+    parser.add_argument("--jaeger-url", type=str, help="Jaeger query URL, e.g. a local jaeger_stand_in.py")
+    parser.add_argument("--ingest-backend", type=str, choices=traces_handler.INGEST_BACKENDS, default="http", help="Query Jaeger over the HTTP JSON API or the gRPC api_v3 query service")
+    parser.add_argument("--jaeger-grpc-target", type=str, help="Jaeger gRPC query service host:port, used with --ingest-backend grpc")
+    parser.add_argument("--window-start-us", type=int, help="Only collect traces starting after this time in microseconds")
+    parser.add_argument("--window-end-us", type=int, help="Only collect traces starting before this time in microseconds")
+    parser.add_argument("--profile-data-dir", type=str, help="Collect traces in the time window covered by the profile data CSVs in this directory")
+    parser.add_argument("--num-windows", type=int, default=1, help="Number of sub-windows to page the collection window through")
+    parser.add_argument("--page-limit", type=int, help="Maximum traces per sub-window query, defaults to the limit")
+    parser.add_argument("--operation", type=str, help="Only collect traces with this operation on the service")
+    parser.add_argument("--min-duration", type=str, help="Only collect traces with a span of the service at least this long, e.g. 500us")
+    parser.add_argument("--max-duration", type=str, help="Only collect traces with a span of the service at most this long, e.g. 10ms")
+    parser.add_argument("--trace-cache-dir", type=str, help="Directory of the on disk trace cache, only fetches by trace id (the per-trace mode and refetches of truncated search results) read it, the bulk and stream modes download the whole search response and only fill it")
+    parser.add_argument("--trace-cache-max-mb", type=int, default=DEFAULT_TRACE_CACHE_MAX_MB, help="Size in MB above which least recently used cached traces are evicted")
 
     args = parser.parse_args()
-    print(f"Processing jaeger traces for following args:\n\tservice_name_for_traces [{args.service_name_for_traces}]\n\tdata_dir [{args.data_dir}]\n\tlimit [{args.limit}]\n\ttest_name [{args.test_name}]\n\tconfig [{args.config}]\n\tsave_trace_json [{args.save_trace_json}]\n\tdefault_service_name [{args.default_service_name}]")
+    print(f"Processing jaeger traces for following args:\n\tservice_name_for_traces [{args.service_name_for_traces}]\n\tdata_dir [{args.data_dir}]\n\tlimit [{args.limit}]\n\ttest_name [{args.test_name}]\n\tconfig [{args.config}]\n\tsave_trace_json [{args.save_trace_json}]\n\tdefault_service_name [{args.default_service_name}]\n\tfetch_workers [{args.fetch_workers}]\n\tingest_mode [{args.ingest_mode}]\n\ttrace_cache_dir [{args.trace_cache_dir}]\n\ttrace_cache_max_mb [{args.trace_cache_max_mb}]\n\tjaeger_url [{args.jaeger_url}]\n\tingest_backend [{args.ingest_backend}]\n\tjaeger_grpc_target [{args.jaeger_grpc_target}]\n\twindow_start_us [{args.window_start_us}]\n\twindow_end_us [{args.window_end_us}]\n\tprofile_data_dir [{args.profile_data_dir}]\n\tnum_windows [{args.num_windows}]\n\tpage_limit [{args.page_limit}]\n\toperation [{args.operation}]\n\tmin_duration [{args.min_duration}]\n\tmax_duration [{args.max_duration}]")
 
     if args.default_service_name:
         DEFAULT_SERVICE_NAME = args.default_service_name
 
+    if args.jaeger_url:
+        traces_handler.JAEGER_URL = args.jaeger_url
+    if args.jaeger_grpc_target:
+        traces_handler.JAEGER_GRPC_TARGET = args.jaeger_grpc_target
+    traces_handler.INGEST_BACKEND = args.ingest_backend
+
     jaeger_service_to_container_mapping = parse_config_file(args.data_dir)
 
-    process_traces(args.service_name_for_traces, args.data_dir, args.limit, args.test_name, args.config, jaeger_service_to_container_mapping, args.save_trace_json)
+    window = None
+    if args.profile_data_dir:
+        window = get_profile_data_window(args.profile_data_dir)
+        if window is None:
+            print(f"[WARNING:] No profile data found in [{args.profile_data_dir}], collecting traces without a profiling window")
+    if args.window_start_us is not None or args.window_end_us is not None:
+        # explicit bounds take precedence over the profile data window
+        window_start = args.window_start_us if args.window_start_us is not None else (window[0] if window else 0)
+        window_end = args.window_end_us if args.window_end_us is not None else (window[1] if window else int(time.time() * 1e6))
+        window = (window_start, window_end)
+
+    search_filters = {"operation": args.operation, "minDuration": args.min_duration, "maxDuration": args.max_duration}
+
+    process_traces(args.service_name_for_traces, args.data_dir, args.limit, args.test_name, args.config, jaeger_service_to_container_mapping, args.save_trace_json, args.fetch_workers, args.ingest_mode, args.trace_cache_dir, args.trace_cache_max_mb,
+                   window, args.num_windows, args.page_limit, search_filters)
 
 if __name__ == "__main__":
     main()
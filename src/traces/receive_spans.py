@@ -0,0 +1,279 @@
+import argparse
+import os
+import shutil
+import signal
+import socket
+import time
+import pandas as pd
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+from jaeger_thrift import decode_emit_batch
+from process_jaeger_traces import parse_container_config_file
+from span_store import get_span_store_dir, append_span_store_chunk, write_span_store, STRING_COLUMNS
+from traces_handler import get_span_records
+
+# Receives spans from Jaeger clients while the workload runs (Thrift compact emitBatch over
+# UDP, the protocol the DeathStarBench services use towards jaeger-agent) and forwards every
+# datagram unchanged to the real agent. Traces are assembled in memory, considered complete
+# once no span arrived for the completion timeout, and their span records are flushed to the
+# traces data CSV and span store in chunks, so no post-run collection is needed. Chunks flushed
+# before the container mapping exists land in the no container partition, they are relabelled
+# and the span store repartitioned at shutdown once the mapping can be read.
+DEFAULT_LISTEN_HOST = "0.0.0.0"
+DEFAULT_LISTEN_PORT = 6841
+DEFAULT_FORWARD_HOST = "127.0.0.1"
+DEFAULT_FORWARD_PORT = 6831
+DEFAULT_COMPLETION_TIMEOUT_S = 5.0
+DEFAULT_MAX_BUFFERED_TRACES = 10000
+DEFAULT_FLUSH_TRACES = 1000
+DEFAULT_FLUSH_INTERVAL_S = 10.0
+MAX_UDP_PACKET_SIZE = 65000
+SOCKET_RECEIVE_BUFFER_BYTES = 8 * 1024 * 1024
+SWEEP_INTERVAL_S = 0.5
+# ids of completed traces kept to drop spans that arrive after their trace was flushed
+MAX_RECENTLY_COMPLETED_TRACES = 100000
+
+class TraceAssembler:
+    # Buffers spans by trace id in least recently updated order. A trace completes once it
+    # saw no span for completion_timeout_s, or early when the buffer is over max_traces.
+    def __init__(self, completion_timeout_s: float, max_traces: int):
+        self.completion_timeout_s = completion_timeout_s
+        self.max_traces = max_traces
+        self.num_forced_completions = 0
+        self.num_late_spans = 0
+        self.__trace_id_to_trace: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.__recently_completed: Deque[str] = deque()
+        self.__recently_completed_set: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self.__trace_id_to_trace)
+
+    def add_spans(self, service: str, spans: List[Dict[str, Any]], now: float) -> List[Dict[str, Any]]:
+        for span in spans:
+            trace_id = span["traceID"]
+            if trace_id in self.__recently_completed_set:
+                self.num_late_spans += 1
+                continue
+
+            span["processID"] = service
+            if trace_id in self.__trace_id_to_trace:
+                trace = self.__trace_id_to_trace.pop(trace_id)[1]
+            else:
+                trace = {"traceID": trace_id, "spans": [], "processes": {}}
+            trace["spans"].append(span)
+            trace["processes"][service] = {"serviceName": service, "tags": []}
+            self.__trace_id_to_trace[trace_id] = (now, trace)
+
+        completed_traces = []
+        while len(self.__trace_id_to_trace) > self.max_traces:
+            completed_traces.append(self.__complete_oldest())
+            self.num_forced_completions += 1
+        return completed_traces
+
+    def pop_completed(self, now: float) -> List[Dict[str, Any]]:
+        completed_traces = []
+        while self.__trace_id_to_trace:
+            last_update_time = next(iter(self.__trace_id_to_trace.values()))[0]
+            if now - last_update_time < self.completion_timeout_s:
+                break
+            completed_traces.append(self.__complete_oldest())
+        return completed_traces
+
+    def pop_all(self) -> List[Dict[str, Any]]:
+        return [self.__complete_oldest() for _ in range(len(self.__trace_id_to_trace))]
+
+    def __complete_oldest(self) -> Dict[str, Any]:
+        trace_id, (_, trace) = self.__trace_id_to_trace.popitem(last=False)
+        self.__recently_completed.append(trace_id)
+        self.__recently_completed_set.add(trace_id)
+        if len(self.__recently_completed) > MAX_RECENTLY_COMPLETED_TRACES:
+            self.__recently_completed_set.discard(self.__recently_completed.popleft())
+        return trace
+
+    def __repr__(self):
+        return f"TraceAssembler(completion_timeout_s={self.completion_timeout_s}, " \
+            f"max_traces={self.max_traces}, " \
+            f"num_buffered_traces={len(self.__trace_id_to_trace)}, " \
+            f"num_forced_completions={self.num_forced_completions}, " \
+            f"num_late_spans={self.num_late_spans})"
+
+def get_traces_data_paths(service_name_for_traces: str, data_dir: str, test_name: str, config: str) -> Tuple[str, str]:
+    # same file names as process_jaeger_traces.save_traces_data, so the analysis scripts pick them up
+    test_name = test_name.replace(" ", "_")
+    config = config.replace(" ", "_")
+    df_csv_file_path = os.path.join(data_dir, f"{service_name_for_traces}_{test_name}_{config}_traces_data.csv")
+    return df_csv_file_path, get_span_store_dir(df_csv_file_path)
+
+def get_container_config_path(data_dir: str, container_config_path: Optional[str]) -> str:
+    return container_config_path if container_config_path else os.path.join(data_dir, "docker_container_service_config.csv")
+
+def load_container_mapping(container_config_path: str) -> Optional[Dict[str, str]]:
+    # the mapping is usually written after the workload, retried on every flush and at shutdown until found
+    if not os.path.exists(container_config_path):
+        return None
+    return parse_container_config_file(container_config_path)
+
+def set_container_names(df: pd.DataFrame, jaeger_service_to_container_mapping: Optional[Dict[str, str]]) -> None:
+    mapping = jaeger_service_to_container_mapping or {}
+    df['container_name'] = df['service'].apply(lambda x: mapping[x] if x in mapping else None)
+
+def flush_records(records: List[Dict[str, Any]], jaeger_service_to_container_mapping: Optional[Dict[str, str]], df_csv_file_path: str, span_store_dir: str, chunk_index: int) -> None:
+    df = pd.DataFrame(records)
+    set_container_names(df, jaeger_service_to_container_mapping)
+    df.to_csv(df_csv_file_path, mode="a", header=not os.path.exists(df_csv_file_path), index=False)
+    append_span_store_chunk(df, span_store_dir, chunk_index)
+
+def repartition_traces_data(jaeger_service_to_container_mapping: Dict[str, str], df_csv_file_path: str, span_store_dir: str) -> None:
+    # rewrites the container names of the traces data CSV and the span store partitions in place,
+    # in the order the spans were flushed
+    df = pd.read_csv(df_csv_file_path, dtype={column: str for column in STRING_COLUMNS})
+    set_container_names(df, jaeger_service_to_container_mapping)
+    df.to_csv(f"{df_csv_file_path}.tmp", index=False)
+    os.replace(f"{df_csv_file_path}.tmp", df_csv_file_path)
+    write_span_store(df, span_store_dir)
+    print(f"Repartitioned [{len(df)}] spans of [{df_csv_file_path}] by container")
+
+def receive_spans(listen_host: str, listen_port: int, forward_address: Optional[Tuple[str, int]], service_name_for_traces: str, data_dir: str, test_name: str, config: str,
+                  completion_timeout_s: float, max_buffered_traces: int, flush_traces: int, flush_interval_s: float, duration_s: float,
+                  container_config_path: Optional[str] = None) -> None:
+    df_csv_file_path, span_store_dir = get_traces_data_paths(service_name_for_traces, data_dir, test_name, config)
+    if os.path.exists(df_csv_file_path) or os.path.exists(span_store_dir):
+        print(f"[WARNING:] Replacing existing traces data [{df_csv_file_path}] and span store [{span_store_dir}]")
+        if os.path.exists(df_csv_file_path):
+            os.remove(df_csv_file_path)
+        shutil.rmtree(span_store_dir, ignore_errors=True)
+    os.makedirs(span_store_dir)
+
+    container_config_path = get_container_config_path(data_dir, container_config_path)
+    jaeger_service_to_container_mapping = load_container_mapping(container_config_path)
+    assembler = TraceAssembler(completion_timeout_s, max_buffered_traces)
+
+    stop = False
+    def request_stop(signum: int, frame: Any) -> None:
+        nonlocal stop
+        stop = True
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, SOCKET_RECEIVE_BUFFER_BYTES)
+    sock.bind((listen_host, listen_port))
+    sock.settimeout(SWEEP_INTERVAL_S)
+    print(f"Receiving spans on [{listen_host}:{listen_port}], forwarding to [{forward_address}], writing to [{df_csv_file_path}] and [{span_store_dir}]")
+
+    pending_records: List[Dict[str, Any]] = []
+    num_pending_traces = 0
+    num_packets = 0
+    num_invalid_packets = 0
+    num_traces = 0
+    num_spans = 0
+    chunk_index = 0
+    has_unmapped_chunks = False
+    start_time = time.monotonic()
+    last_sweep_time = start_time
+    last_flush_time = start_time
+
+    def complete_traces(traces: List[Dict[str, Any]]) -> None:
+        nonlocal num_pending_traces, num_traces
+        for trace in traces:
+            pending_records.extend(get_span_records(trace))
+        num_pending_traces += len(traces)
+        num_traces += len(traces)
+
+    def flush() -> None:
+        nonlocal pending_records, num_pending_traces, chunk_index, jaeger_service_to_container_mapping, has_unmapped_chunks, last_flush_time
+        last_flush_time = time.monotonic()
+        if not pending_records:
+            return
+        if jaeger_service_to_container_mapping is None:
+            jaeger_service_to_container_mapping = load_container_mapping(container_config_path)
+        has_unmapped_chunks = has_unmapped_chunks or jaeger_service_to_container_mapping is None
+        flush_records(pending_records, jaeger_service_to_container_mapping, df_csv_file_path, span_store_dir, chunk_index)
+        print(f"Flushed chunk [{chunk_index}] with [{num_pending_traces}] traces and [{len(pending_records)}] spans, [{num_traces}] traces so far, {assembler}")
+        chunk_index += 1
+        pending_records = []
+        num_pending_traces = 0
+
+    try:
+        while not stop and (duration_s <= 0 or time.monotonic() - start_time < duration_s):
+            try:
+                payload = sock.recv(MAX_UDP_PACKET_SIZE)
+            except socket.timeout:
+                payload = None
+            except InterruptedError:
+                payload = None
+
+            now = time.monotonic()
+            if payload:
+                num_packets += 1
+                if forward_address is not None:
+                    sock.sendto(payload, forward_address)
+                try:
+                    service, spans = decode_emit_batch(payload)
+                except ValueError as e:
+                    num_invalid_packets += 1
+                    print(f"[WARNING:] Skipping invalid span batch: {e}")
+                    continue
+                num_spans += len(spans)
+                complete_traces(assembler.add_spans(service, spans, now))
+
+            if now - last_sweep_time >= SWEEP_INTERVAL_S:
+                complete_traces(assembler.pop_completed(now))
+                last_sweep_time = now
+            if num_pending_traces >= flush_traces or now - last_flush_time >= flush_interval_s:
+                flush()
+    finally:
+        sock.close()
+        complete_traces(assembler.pop_all())
+        flush()
+
+    if has_unmapped_chunks:
+        jaeger_service_to_container_mapping = load_container_mapping(container_config_path)
+        if jaeger_service_to_container_mapping is None:
+            print(f"[WARNING:] Container config [{container_config_path}] not found, spans flushed without it stay in the no container partition of [{span_store_dir}]")
+        else:
+            repartition_traces_data(jaeger_service_to_container_mapping, df_csv_file_path, span_store_dir)
+
+    elapsed_time = time.monotonic() - start_time
+    print(f"Received [{num_packets}] packets ([{num_invalid_packets}] invalid) with [{num_spans}] spans, completed [{num_traces}] traces in [{elapsed_time:.2f}] s, "
+          f"[{assembler.num_forced_completions}] completed early by the buffer limit, [{assembler.num_late_spans}] late spans dropped")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Receive Jaeger spans over UDP, forward them to jaeger-agent and compute non idle intervals as traces complete")
+    parser.add_argument("--service-name-for-traces", type=str, required=True, help="Service name used in the traces data file names")
+    parser.add_argument("--data-dir", type=str, required=True, help="Data directory to write the traces data CSV and span store to")
+    parser.add_argument("--test-name", type=str, required=True, help="Test name")
+    parser.add_argument("--config", type=str, required=True, help="Test config")
+    parser.add_argument("--container-config", type=str, help="Docker container service config CSV mapping Jaeger services to containers, defaults to docker_container_service_config.csv in the data directory")
+    parser.add_argument("--listen-host", type=str, default=DEFAULT_LISTEN_HOST, help="Host to receive spans on")
+    parser.add_argument("--listen-port", type=int, default=DEFAULT_LISTEN_PORT, help="UDP port to receive Thrift compact span batches on")
+    parser.add_argument("--forward-host", type=str, default=DEFAULT_FORWARD_HOST, help="jaeger-agent host to forward span batches to")
+    parser.add_argument("--forward-port", type=int, default=DEFAULT_FORWARD_PORT, help="jaeger-agent UDP port to forward span batches to, 0 disables forwarding")
+    parser.add_argument("--completion-timeout-s", type=float, default=DEFAULT_COMPLETION_TIMEOUT_S, help="Seconds without new spans after which a trace is complete")
+    parser.add_argument("--max-buffered-traces", type=int, default=DEFAULT_MAX_BUFFERED_TRACES, help="Maximum number of incomplete traces held in memory")
+    parser.add_argument("--flush-traces", type=int, default=DEFAULT_FLUSH_TRACES, help="Number of completed traces per span store chunk")
+    parser.add_argument("--flush-interval-s", type=float, default=DEFAULT_FLUSH_INTERVAL_S, help="Maximum seconds between span store flushes")
+    parser.add_argument("--duration-s", type=float, default=0.0, help="Seconds to receive for, 0 receives until SIGINT or SIGTERM")
+    args = parser.parse_args()
+
+    print(f"Running with args:"
+          f"\n\tservice_name_for_traces [{args.service_name_for_traces}]"
+          f"\n\tdata_dir [{args.data_dir}]"
+          f"\n\ttest_name [{args.test_name}]"
+          f"\n\tconfig [{args.config}]"
+          f"\n\tcontainer_config [{args.container_config}]"
+          f"\n\tlisten [{args.listen_host}:{args.listen_port}]"
+          f"\n\tforward [{args.forward_host}:{args.forward_port}]"
+          f"\n\tcompletion_timeout_s [{args.completion_timeout_s}]"
+          f"\n\tmax_buffered_traces [{args.max_buffered_traces}]"
+          f"\n\tflush_traces [{args.flush_traces}]"
+          f"\n\tflush_interval_s [{args.flush_interval_s}]"
+          f"\n\tduration_s [{args.duration_s}]")
+
+    forward_address = (args.forward_host, args.forward_port) if args.forward_port > 0 else None
+    receive_spans(args.listen_host, args.listen_port, forward_address, args.service_name_for_traces, args.data_dir, args.test_name, args.config,
+                  args.completion_timeout_s, args.max_buffered_traces, args.flush_traces, args.flush_interval_s, args.duration_s,
+                  args.container_config)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from traces_handler import create_span_data_graph, get_span_records
+from span_table import get_span_records_df
+from process_jaeger_traces import parse_config_file, save_traces_data
+from trace_archive import TraceArchive, find_trace_archives
+from critical_path import CriticalPathAggregator, save_critical_path
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Any, Dict, List, Optional, Tuple
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+
+def find_saved_trace_files(data_dir: str, service_name_for_traces: Optional[str]) -> Dict[str, List[str]]:
+    # saved traces are named {service}_{trace_id}.json, trace ids are hex so the last "_" splits the name
+    service_to_trace_files: Dict[str, List[str]] = {}
+    for file in sorted(os.listdir(data_dir)):
+        if not file.endswith(".json") or "_" not in file:
+            continue
+        service_name = file[:-len(".json")].rsplit("_", 1)[0]
+        if service_name_for_traces and service_name != service_name_for_traces:
+            continue
+        service_to_trace_files.setdefault(service_name, []).append(os.path.join(data_dir, file))
+    return service_to_trace_files
+
+def get_contiguous_chunks(items: List[Any], num_workers: int) -> List[List[Any]]:
+    # contiguous chunks, so concatenating their spans keeps the order of the live ingest
+    num_chunks = max(1, min(len(items), num_workers * 4))
+    return [chunk.tolist() for chunk in np.array_split(np.array(items, dtype=object), num_chunks)]
+
+def parse_saved_trace_text(trace_text: str, source: str) -> Optional[Dict[str, Any]]:
+    try:
+        trace = json.loads(trace_text).get("data", None)
+    except ValueError as err:
+        print(f"[WARNING:] Skipping trace [{source}] as it could not be decoded: {err}")
+        return None
+
+    if not trace:
+        print(f"[WARNING:] Skipping trace [{source}] due to missing data")
+        return None
+
+    if len(trace) != 1:
+        print(f"[WARNING:] Skipping trace [{source}] due to invalid data, expected 1 trace, got {len(trace)}")
+        return None
+
+    return trace[0]
+
+def parse_saved_trace_file(file_path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(file_path, "r") as f:
+            trace_text = f.read()
+    except OSError as err:
+        print(f"[WARNING:] Skipping trace file [{file_path}] as it could not be read: {err}")
+        return None
+
+    return parse_saved_trace_text(trace_text, file_path)
+
+def parse_saved_trace_files_chunk(trace_files: List[str]) -> Tuple[List[Dict[str, Any]], CriticalPathAggregator]:
+    # the critical path of the chunk is aggregated in the worker and merged by the caller
+    records = []
+    critical_path_aggregator = CriticalPathAggregator()
+    for file_path in trace_files:
+        trace = parse_saved_trace_file(file_path)
+        if trace is None:
+            continue
+        records.extend(get_span_records(trace))
+        critical_path_aggregator.add_trace(create_span_data_graph(trace))
+    return records, critical_path_aggregator
+
+def parse_archived_traces(archive_path: str, trace_ids: List[str]) -> Tuple[pd.DataFrame, CriticalPathAggregator]:
+    # each worker opens the archive itself, reads only its share of the traces and computes
+    # their spans in one batch and their critical path
+    traces = []
+    critical_path_aggregator = CriticalPathAggregator()
+    with TraceArchive(archive_path) as archive:
+        for trace_id, trace_text in archive.iter_traces(trace_ids):
+            try:
+                trace = json.loads(trace_text).get("data", None)
+            except ValueError as err:
+                print(f"[WARNING:] Skipping trace [{archive_path}:{trace_id}] as it could not be decoded: {err}")
+                continue
+            if not trace or len(trace) != 1:
+                print(f"[WARNING:] Skipping trace [{archive_path}:{trace_id}] due to missing or invalid data")
+                continue
+            traces.append(trace[0])
+            critical_path_aggregator.add_trace(create_span_data_graph(trace[0]))
+    return get_span_records_df(traces), critical_path_aggregator
+
+def parse_saved_trace_files(trace_files: List[str], num_workers: int) -> Tuple[pd.DataFrame, CriticalPathAggregator]:
+    records = []
+    critical_path_aggregator = CriticalPathAggregator()
+    start_time = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk_records, chunk_critical_path_aggregator in executor.map(parse_saved_trace_files_chunk, get_contiguous_chunks(trace_files, num_workers)):
+            records.extend(chunk_records)
+            critical_path_aggregator.merge(chunk_critical_path_aggregator)
+
+    elapsed_time = time.perf_counter() - start_time
+    traces_per_second = len(trace_files) / elapsed_time if elapsed_time > 0 else 0.0
+    print(f"Parsed [{len(trace_files)}] trace files in [{elapsed_time:.2f}s] with [{num_workers}] workers, throughput [{traces_per_second:.2f}] traces/s")
+
+    return pd.DataFrame(records), critical_path_aggregator
+
+def parse_trace_archive(archive_path: str, num_workers: int) -> Tuple[pd.DataFrame, CriticalPathAggregator]:
+    dfs = []
+    critical_path_aggregator = CriticalPathAggregator()
+    start_time = time.perf_counter()
+
+    with TraceArchive(archive_path) as archive:
+        trace_ids = archive.trace_ids()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for df, chunk_critical_path_aggregator in executor.map(partial(parse_archived_traces, archive_path), get_contiguous_chunks(trace_ids, num_workers)):
+            dfs.append(df)
+            critical_path_aggregator.merge(chunk_critical_path_aggregator)
+
+    elapsed_time = time.perf_counter() - start_time
+    traces_per_second = len(trace_ids) / elapsed_time if elapsed_time > 0 else 0.0
+    print(f"Parsed [{len(trace_ids)}] archived traces from [{archive_path}] in [{elapsed_time:.2f}s] with [{num_workers}] workers, throughput [{traces_per_second:.2f}] traces/s")
+
+    return (pd.concat(dfs, ignore_index=True) if dfs else pd.DataFrame()), critical_path_aggregator
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Rebuild traces data CSVs from saved Jaeger traces without a running Jaeger")
+    parser.add_argument("--data-dir", type=str, required=True, help="Trace data directory with the trace archives or saved trace JSONs")
+    parser.add_argument("--test-name", type=str, required=True, help="Test name")
+    parser.add_argument("--config", type=str, required=True, help="Test config")
+    parser.add_argument("--service-name-for-traces", type=str, help="Only re-ingest traces saved for this service")
+    parser.add_argument("--output-dir", type=str, help="Directory to write the traces data CSV to, defaults to the data directory")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Number of parsing processes")
+
+    args = parser.parse_args()
+    output_dir = args.output_dir if args.output_dir else args.data_dir
+    print(f"Re-ingesting saved jaeger traces for following args:\n\tdata_dir [{args.data_dir}]\n\ttest_name [{args.test_name}]\n\tconfig [{args.config}]\n\tservice_name_for_traces [{args.service_name_for_traces}]\n\toutput_dir [{output_dir}]\n\tworkers [{args.workers}]")
+
+    jaeger_service_to_container_mapping = {}
+    if os.path.exists(os.path.join(args.data_dir, "docker_container_service_config.csv")):
+        jaeger_service_to_container_mapping = parse_config_file(args.data_dir)
+    else:
+        print(f"[WARNING:] Docker container service config not found in [{args.data_dir}], container names will be empty")
+
+    # archives replace the per trace JSONs of older runs, which are still read when there is no archive
+    service_to_archive_path = find_trace_archives(args.data_dir, args.service_name_for_traces)
+    service_to_trace_files = find_saved_trace_files(args.data_dir, args.service_name_for_traces)
+    if not service_to_archive_path and not service_to_trace_files:
+        print(f"[ERROR:] No trace archives or saved trace JSONs found in [{args.data_dir}]")
+        raise SystemExit(1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    for service_name in sorted(set(service_to_archive_path) | set(service_to_trace_files)):
+        if service_name in service_to_archive_path:
+            print(f"Re-ingesting archived traces for service [{service_name}] from [{service_to_archive_path[service_name]}]")
+            df, critical_path_aggregator = parse_trace_archive(service_to_archive_path[service_name], args.workers)
+        else:
+            print(f"Re-ingesting [{len(service_to_trace_files[service_name])}] saved trace JSONs for service [{service_name}]")
+            df, critical_path_aggregator = parse_saved_trace_files(service_to_trace_files[service_name], args.workers)
+        if df.empty:
+            print(f"[WARNING:] No spans found in saved traces for service [{service_name}]")
+            continue
+        df_csv_file_path = save_traces_data(df, service_name, output_dir, args.test_name, args.config, jaeger_service_to_container_mapping)
+        save_critical_path(critical_path_aggregator, df_csv_file_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Columnar span store, one directory per container with one .npy file per column.
+# Non idle intervals are kept as CSR arrays: the intervals of span i are
+# non_idle_intervals_start/end[offsets[i]:offsets[i + 1]]. Stores that are written
+# incrementally hold one chunk_* directory per flush inside each container partition,
+# readers concatenate the chunks in order.
+SPAN_STORE_SUFFIX = "_span_store"
+NO_CONTAINER_PARTITION = "_no_container"
+STRING_COLUMNS = ["trace_id", "span_id", "service", "operation"]
+INT_COLUMNS = ["start_time", "end_time", "duration", "non_idle_execution_time"]
+INTERVAL_OFFSETS_FILE = "non_idle_intervals_offsets.npy"
+INTERVAL_STARTS_FILE = "non_idle_intervals_start.npy"
+INTERVAL_ENDS_FILE = "non_idle_intervals_end.npy"
+CHUNK_DIR_PREFIX = "chunk_"
+
+def get_span_store_dir(traces_csv_file_path: str) -> str:
+    return traces_csv_file_path[:-len("_traces_data.csv")] + SPAN_STORE_SUFFIX
+
+def get_partition_name(container_name: Optional[str]) -> str:
+    if container_name is None or (isinstance(container_name, float) and np.isnan(container_name)):
+        return NO_CONTAINER_PARTITION
+    return str(container_name).replace(os.sep, "_")
+
+def parse_non_idle_intervals(non_idle_intervals: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # parses "s-e;s-e" strings into CSR offsets and flat int64 start/end arrays in one pass
+    values: List[str] = non_idle_intervals.astype(str).tolist()
+    counts = np.fromiter((value.count(";") + 1 for value in values), dtype=np.int64, count=len(values))
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    if not values:
+        return offsets, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    flat = np.array(";".join(values).replace("-", ";").split(";"), dtype=np.int64)
+    return offsets, flat[0::2], flat[1::2]
+
+def write_span_store_partition(partition_df: pd.DataFrame, partition_dir: str) -> None:
+    os.makedirs(partition_dir)
+    for column in STRING_COLUMNS:
+        np.save(os.path.join(partition_dir, f"{column}.npy"), partition_df[column].astype(str).to_numpy(dtype=str))
+    for column in INT_COLUMNS:
+        np.save(os.path.join(partition_dir, f"{column}.npy"), partition_df[column].to_numpy(dtype=np.int64))
+    offsets, starts, ends = parse_non_idle_intervals(partition_df["non_idle_intervals"])
+    np.save(os.path.join(partition_dir, INTERVAL_OFFSETS_FILE), offsets)
+    np.save(os.path.join(partition_dir, INTERVAL_STARTS_FILE), starts)
+    np.save(os.path.join(partition_dir, INTERVAL_ENDS_FILE), ends)
+
+def group_by_partition(traces_df: pd.DataFrame) -> Iterator[Tuple[str, pd.DataFrame]]:
+    container_names = traces_df["container_name"] if "container_name" in traces_df else pd.Series([None] * len(traces_df), index=traces_df.index)
+    return iter(traces_df.groupby(container_names.map(get_partition_name), sort=False))
+
+def write_span_store(traces_df: pd.DataFrame, span_store_dir: str) -> None:
+    # written to a temporary directory and swapped in so readers never see a half written store
+    tmp_span_store_dir = f"{span_store_dir}.tmp"
+    shutil.rmtree(tmp_span_store_dir, ignore_errors=True)
+    os.makedirs(tmp_span_store_dir)
+
+    for partition_name, partition_df in group_by_partition(traces_df):
+        write_span_store_partition(partition_df, os.path.join(tmp_span_store_dir, partition_name))
+
+    shutil.rmtree(span_store_dir, ignore_errors=True)
+    os.replace(tmp_span_store_dir, span_store_dir)
+    print(f"Saved span store to {span_store_dir}")
+
+def append_span_store_chunk(traces_df: pd.DataFrame, span_store_dir: str, chunk_index: int) -> None:
+    # each partition chunk is written under a temporary name and renamed into place,
+    # so a reader or a crash mid flush only ever sees whole chunks
+    for partition_name, partition_df in group_by_partition(traces_df):
+        partition_dir = os.path.join(span_store_dir, partition_name)
+        os.makedirs(partition_dir, exist_ok=True)
+        chunk_dir = os.path.join(partition_dir, f"{CHUNK_DIR_PREFIX}{chunk_index:06d}")
+        tmp_chunk_dir = f"{chunk_dir}.tmp"
+        shutil.rmtree(tmp_chunk_dir, ignore_errors=True)
+        write_span_store_partition(partition_df, tmp_chunk_dir)
+        os.replace(tmp_chunk_dir, chunk_dir)
+
+def get_partition_dir(span_store_dir: str, container_name: str) -> str:
+    return os.path.join(span_store_dir, get_partition_name(container_name))
+
+def get_chunk_dirs(partition_dir: str) -> List[str]:
+    if os.path.exists(os.path.join(partition_dir, INTERVAL_OFFSETS_FILE)):
+        return [partition_dir]
+    return [os.path.join(partition_dir, chunk) for chunk in sorted(os.listdir(partition_dir))
+            if chunk.startswith(CHUNK_DIR_PREFIX) and not chunk.endswith(".tmp")]
+
+def load_partition_file(partition_dir: str, file_name: str) -> np.ndarray:
+    # a single chunk stays memory mapped, several chunks are concatenated
+    chunk_dirs = get_chunk_dirs(partition_dir)
+    if len(chunk_dirs) == 1:
+        return np.load(os.path.join(chunk_dirs[0], file_name), mmap_mode="r")
+    if not chunk_dirs:
+        return np.empty(0)
+    return np.concatenate([np.load(os.path.join(chunk_dir, file_name), mmap_mode="r") for chunk_dir in chunk_dirs])
+
+def load_partition_offsets(partition_dir: str) -> np.ndarray:
+    chunk_dirs = get_chunk_dirs(partition_dir)
+    if len(chunk_dirs) == 1:
+        return np.load(os.path.join(chunk_dirs[0], INTERVAL_OFFSETS_FILE), mmap_mode="r")
+    chunk_offsets = [np.load(os.path.join(chunk_dir, INTERVAL_OFFSETS_FILE), mmap_mode="r") for chunk_dir in chunk_dirs]
+    offsets = [np.zeros(1, dtype=np.int64)]
+    base = 0
+    for offset in chunk_offsets:
+        offsets.append(offset[1:] + base)
+        base += int(offset[-1])
+    return np.concatenate(offsets)
+
+def load_span_store_intervals(span_store_dir: str, container_name: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    partition_dir = get_partition_dir(span_store_dir, container_name)
+    if not os.path.isdir(partition_dir):
+        empty = np.empty(0, dtype=np.int64)
+        return np.zeros(1, dtype=np.int64), empty, empty
+    offsets = load_partition_offsets(partition_dir)
+    starts = load_partition_file(partition_dir, INTERVAL_STARTS_FILE).astype(np.int64, copy=False)
+    ends = load_partition_file(partition_dir, INTERVAL_ENDS_FILE).astype(np.int64, copy=False)
+    return offsets, starts, ends
+
+def load_span_store(span_store_dir: str, container_name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    # only the container partition and the requested columns are read from disk,
+    # non_idle_intervals comes back as one (n, 2) int64 array per span
+    columns = columns if columns is not None else STRING_COLUMNS + INT_COLUMNS + ["non_idle_intervals", "container_name"]
+    partition_dir = get_partition_dir(span_store_dir, container_name)
+    if not os.path.isdir(partition_dir):
+        return pd.DataFrame(columns=columns)
+
+    data: Dict[str, object] = {}
+    num_spans = len(load_partition_offsets(partition_dir)) - 1
+    for column in columns:
+        if column in STRING_COLUMNS or column in INT_COLUMNS:
+            data[column] = load_partition_file(partition_dir, f"{column}.npy")
+        elif column == "non_idle_intervals":
+            offsets, starts, ends = load_span_store_intervals(span_store_dir, container_name)
+            intervals = np.column_stack((starts, ends))
+            data[column] = np.split(intervals, offsets[1:-1])
+        elif column == "container_name":
+            data[column] = [container_name] * num_spans
+    return pd.DataFrame(data, columns=columns)
+
+def has_span_store(span_store_dir: str) -> bool:
+    return os.path.isdir(span_store_dir)
@@ -0,0 +1,223 @@
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Iterable, List, Tuple
+
+# Struct of arrays span table and a batch engine that computes non idle execution time and
+# non idle intervals for every span of every trace at once. It reproduces
+# SpanData.get_non_idle_execution_time exactly: children sorted by start time, overlapping
+# children merged into groups, and only the longest child of a group (the first one on ties)
+# counted as busy, like Jaeger does.
+INT64_KEY_LIMIT = 2 ** 62
+
+class SpanTable:
+    # One row per distinct span id of each trace, in the order create_span_data_graph would
+    # return them. Strings are interned into code arrays, parent/child links are an edge list
+    # in the order SpanData.add_child would have been called.
+    def __init__(self, trace_id_codes: np.ndarray, trace_ids: List[str], span_ids: np.ndarray,
+                 service_codes: np.ndarray, services: List[str], operation_codes: np.ndarray, operations: List[str],
+                 start_times: np.ndarray, durations: np.ndarray, edge_parents: np.ndarray, edge_children: np.ndarray):
+        self.trace_id_codes = trace_id_codes
+        self.trace_ids = trace_ids
+        self.span_ids = span_ids
+        self.service_codes = service_codes
+        self.services = services
+        self.operation_codes = operation_codes
+        self.operations = operations
+        self.start_times = start_times
+        self.durations = durations
+        self.end_times = start_times + durations
+        self.edge_parents = edge_parents
+        self.edge_children = edge_children
+
+    def __len__(self) -> int:
+        return len(self.span_ids)
+
+    def __repr__(self):
+        return f"SpanTable(num_spans={len(self.span_ids)}, " \
+            f"num_trace_ids={len(self.trace_ids)}, " \
+            f"num_edges={len(self.edge_parents)}, " \
+            f"num_services={len(self.services)}, " \
+            f"num_operations={len(self.operations)})"
+
+def build_span_table(traces: Iterable[Dict[str, Any]]) -> SpanTable:
+    # one pass over the decoded traces filling flat lists, no per span objects are kept
+    trace_id_to_code: Dict[str, int] = {}
+    service_to_code: Dict[str, int] = {}
+    operation_to_code: Dict[str, int] = {}
+    trace_id_codes: List[int] = []
+    span_ids: List[str] = []
+    service_codes: List[int] = []
+    operation_codes: List[int] = []
+    start_times: List[int] = []
+    durations: List[int] = []
+    edge_parents: List[int] = []
+    edge_children: List[int] = []
+
+    for trace in traces:
+        process_id_to_service = {process_id: process.get("serviceName", "unknown") for process_id, process in trace.get("processes", {}).items()}
+        span_id_to_index: Dict[str, int] = {}
+        spans = trace.get("spans", [])
+
+        for span in spans:
+            span_id = span.get("spanID", "unknown")
+            trace_id = span.get("traceID", "unknown")
+            service = process_id_to_service.get(span.get("processID", "unknown"), "unknown")
+            operation = span.get("operationName", "unknown")
+            row = (trace_id_to_code.setdefault(trace_id, len(trace_id_to_code)), service_to_code.setdefault(service, len(service_to_code)),
+                   operation_to_code.setdefault(operation, len(operation_to_code)), span.get("startTime", 0), span.get("duration", 0))
+
+            # a repeated span id keeps its first position but takes the later span's values
+            index = span_id_to_index.get(span_id)
+            if index is None:
+                span_id_to_index[span_id] = len(span_ids)
+                span_ids.append(span_id)
+                trace_id_codes.append(row[0])
+                service_codes.append(row[1])
+                operation_codes.append(row[2])
+                start_times.append(row[3])
+                durations.append(row[4])
+            else:
+                trace_id_codes[index], service_codes[index], operation_codes[index], start_times[index], durations[index] = row
+
+        for span in spans:
+            child_index = span_id_to_index[span.get("spanID", "unknown")]
+            for reference in span.get("references", []):
+                parent_index = span_id_to_index.get(reference.get("spanID", "unknown"))
+                if reference.get("refType", "") == "CHILD_OF" and parent_index is not None:
+                    edge_parents.append(parent_index)
+                    edge_children.append(child_index)
+
+    return SpanTable(
+        np.array(trace_id_codes, dtype=np.int64), list(trace_id_to_code), np.array(span_ids, dtype=object),
+        np.array(service_codes, dtype=np.int64), list(service_to_code), np.array(operation_codes, dtype=np.int64), list(operation_to_code),
+        np.array(start_times, dtype=np.int64), np.array(durations, dtype=np.int64),
+        np.array(edge_parents, dtype=np.int64), np.array(edge_children, dtype=np.int64))
+
+def segmented_cummax(values: np.ndarray, segment_starts: np.ndarray) -> np.ndarray:
+    # running maximum that restarts at every segment start. Values are shifted to start at 0
+    # in their segment and offset by segment number, so one np.maximum.accumulate never
+    # carries a maximum across a segment boundary. Segments are processed in blocks small
+    # enough for the offset keys to fit in int64.
+    segment_lengths = np.diff(np.append(segment_starts, len(values)))
+    segment_ids = np.repeat(np.arange(len(segment_starts), dtype=np.int64), segment_lengths)
+    segment_mins = np.minimum.reduceat(values, segment_starts)
+    relative_values = values - segment_mins[segment_ids]
+    width = int(relative_values.max()) + 1
+    segments_per_block = max(1, INT64_KEY_LIMIT // width)
+
+    result = np.empty_like(values)
+    for first_segment in range(0, len(segment_starts), segments_per_block):
+        last_segment = min(len(segment_starts), first_segment + segments_per_block)
+        block = slice(segment_starts[first_segment], segment_starts[last_segment] if last_segment < len(segment_starts) else len(values))
+        block_offsets = (segment_ids[block] - first_segment) * width
+        result[block] = np.maximum.accumulate(relative_values[block] + block_offsets) - block_offsets + segment_mins[segment_ids[block]]
+    return result
+
+def compute_non_idle(span_table: SpanTable) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # returns non idle execution time per span and the non idle intervals as CSR arrays:
+    # the intervals of span i are starts/ends[offsets[i]:offsets[i + 1]]
+    num_spans = len(span_table)
+    starts, ends, durations = span_table.start_times, span_table.end_times, span_table.durations
+    non_idle_execution_time = durations.copy()
+
+    # leaves have a single interval covering the whole span
+    interval_spans = [np.arange(num_spans, dtype=np.int64)]
+    interval_orders = [np.zeros(num_spans, dtype=np.int64)]
+    interval_starts = [starts]
+    interval_ends = [ends]
+    is_parent = np.zeros(num_spans, dtype=bool)
+
+    if len(span_table.edge_parents):
+        # children of each parent by start time, ties keep the add_child order
+        edge_order = np.lexsort((np.arange(len(span_table.edge_parents)), starts[span_table.edge_children], span_table.edge_parents))
+        parents = span_table.edge_parents[edge_order]
+        children = span_table.edge_children[edge_order]
+        child_starts, child_ends, child_durations = starts[children], ends[children], durations[children]
+
+        first_child = np.ones(len(parents), dtype=bool)
+        first_child[1:] = parents[1:] != parents[:-1]
+        parent_starts = np.flatnonzero(first_child)
+        running_end = segmented_cummax(child_ends, parent_starts)
+
+        # a child starting at or after the furthest end of its earlier siblings starts a new group
+        starts_group = first_child.copy()
+        starts_group[1:] |= child_starts[1:] >= running_end[:-1]
+        group_starts = np.flatnonzero(starts_group)
+        group_ids = np.cumsum(starts_group) - 1
+
+        # the first child with the group's longest duration represents the group
+        group_max_durations = np.maximum.reduceat(child_durations, group_starts)
+        candidates = np.flatnonzero(child_durations == group_max_durations[group_ids])
+        _, first_candidates = np.unique(group_ids[candidates], return_index=True)
+        representatives = candidates[first_candidates]
+        group_parents = parents[representatives]
+        group_starts_time = child_starts[representatives]
+        group_ends_time = child_ends[representatives]
+
+        parent_of_groups = parents[parent_starts]
+        first_group_of_parent = np.searchsorted(group_starts, parent_starts)
+        non_idle_execution_time[parent_of_groups] = durations[parent_of_groups] - np.add.reduceat(child_durations[representatives], first_group_of_parent)
+        is_parent[parent_of_groups] = True
+
+        # the gap before each group's representative, measured from the previous
+        # representative's end, or from the parent's start for the first group
+        first_group = np.zeros(len(group_starts), dtype=bool)
+        first_group[first_group_of_parent] = True
+        cursors = np.empty(len(group_starts), dtype=np.int64)
+        cursors[1:] = group_ends_time[:-1]
+        cursors[first_group] = starts[group_parents[first_group]]
+        has_gap = cursors < group_starts_time
+        group_orders = np.arange(len(group_starts), dtype=np.int64) - np.repeat(first_group_of_parent, np.diff(np.append(first_group_of_parent, len(group_starts))))
+
+        interval_spans.append(group_parents[has_gap])
+        interval_orders.append(group_orders[has_gap])
+        interval_starts.append(cursors[has_gap])
+        interval_ends.append(group_starts_time[has_gap])
+
+        # then the tail from the last representative's end to the parent's end, always kept
+        last_group_of_parent = np.append(first_group_of_parent[1:], len(group_starts)) - 1
+        interval_spans.append(parent_of_groups)
+        interval_orders.append(np.full(len(parent_of_groups), len(group_starts), dtype=np.int64))
+        interval_starts.append(group_ends_time[last_group_of_parent])
+        interval_ends.append(ends[parent_of_groups])
+
+    interval_spans[0] = interval_spans[0][~is_parent]
+    interval_orders[0] = interval_orders[0][~is_parent]
+    interval_starts[0] = interval_starts[0][~is_parent]
+    interval_ends[0] = interval_ends[0][~is_parent]
+
+    interval_spans_all = np.concatenate(interval_spans)
+    interval_order = np.lexsort((np.concatenate(interval_orders), interval_spans_all))
+    offsets = np.zeros(num_spans + 1, dtype=np.int64)
+    np.cumsum(np.bincount(interval_spans_all, minlength=num_spans), out=offsets[1:])
+    return non_idle_execution_time, offsets, np.concatenate(interval_starts)[interval_order], np.concatenate(interval_ends)[interval_order]
+
+def format_non_idle_intervals(offsets: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> List[str]:
+    # CSR intervals back to the "s-e;s-e" strings of the traces data CSV
+    intervals = [f"{start}-{end}" for start, end in zip(starts.tolist(), ends.tolist())]
+    offsets_list = offsets.tolist()
+    return [";".join(intervals[offsets_list[i]:offsets_list[i + 1]]) for i in range(len(offsets_list) - 1)]
+
+def get_span_records_df(traces: Iterable[Dict[str, Any]]) -> pd.DataFrame:
+    # the same rows and columns get_span_records produces, for a whole batch of traces
+    span_table = build_span_table(traces)
+    if len(span_table) == 0:
+        return pd.DataFrame()
+
+    non_idle_execution_time, offsets, starts, ends = compute_non_idle(span_table)
+    negative_spans = np.flatnonzero(non_idle_execution_time < 0)
+    if len(negative_spans):
+        print(f"[WARNING:] Non idle execution time is negative for [{len(negative_spans)}] spans, e.g. span [{span_table.span_ids[negative_spans[0]]}] "
+              f"in trace [{span_table.trace_ids[span_table.trace_id_codes[negative_spans[0]]]}]")
+
+    return pd.DataFrame({
+        "trace_id": np.array(span_table.trace_ids, dtype=object)[span_table.trace_id_codes],
+        "span_id": span_table.span_ids,
+        "service": np.array(span_table.services, dtype=object)[span_table.service_codes],
+        "operation": np.array(span_table.operations, dtype=object)[span_table.operation_codes],
+        "start_time": span_table.start_times,
+        "end_time": span_table.end_times,
+        "duration": span_table.durations,
+        "non_idle_execution_time": non_idle_execution_time,
+        "non_idle_intervals": format_non_idle_intervals(offsets, starts, ends),
+    })
@@ -0,0 +1,197 @@
+import atexit
+import fcntl
+import os
+import struct
+import zlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Append only archive of Jaeger trace responses, one per service and run, replacing one JSON
+# file per trace. Every trace is a zlib compressed frame:
+#   magic (4 bytes) | trace id length (uint16) | payload length (uint32) | trace id | payload
+# A side index of "trace_id offset length" lines makes random reads by trace id a single seek.
+# Frames are self describing, so an index that lags behind the data after a crash is rebuilt
+# by scanning the frames past the last indexed one.
+TRACE_ARCHIVE_SUFFIX = "_traces.archive"
+TRACE_ARCHIVE_INDEX_SUFFIX = ".index"
+FRAME_MAGIC = b"JTRC"
+FRAME_HEADER = struct.Struct("<4sHI")
+TRACE_ARCHIVE_COMPRESSION_LEVEL = 6
+
+def get_trace_archive_path(data_dir: str, service_name_for_traces: str) -> str:
+    return os.path.join(data_dir, f"{service_name_for_traces}{TRACE_ARCHIVE_SUFFIX}")
+
+def find_trace_archives(data_dir: str, service_name_for_traces: Optional[str] = None) -> Dict[str, str]:
+    service_to_archive_path: Dict[str, str] = {}
+    for file in sorted(os.listdir(data_dir)):
+        if not file.endswith(TRACE_ARCHIVE_SUFFIX):
+            continue
+        service_name = file[:-len(TRACE_ARCHIVE_SUFFIX)]
+        if service_name_for_traces and service_name != service_name_for_traces:
+            continue
+        service_to_archive_path[service_name] = os.path.join(data_dir, file)
+    return service_to_archive_path
+
+def scan_frames(f, offset: int) -> Iterator[Tuple[str, int, int]]:
+    # yields (trace_id, frame offset, frame length) of every whole frame from offset on
+    file_size = os.fstat(f.fileno()).st_size
+    while offset + FRAME_HEADER.size <= file_size:
+        f.seek(offset)
+        magic, trace_id_length, payload_length = FRAME_HEADER.unpack(f.read(FRAME_HEADER.size))
+        frame_length = FRAME_HEADER.size + trace_id_length + payload_length
+        if magic != FRAME_MAGIC or offset + frame_length > file_size:
+            return
+        trace_id = f.read(trace_id_length).decode()
+        yield trace_id, offset, frame_length
+        offset += frame_length
+
+def read_index(index_path: str) -> Dict[str, Tuple[int, int]]:
+    trace_id_to_frame: Dict[str, Tuple[int, int]] = {}
+    if not os.path.exists(index_path):
+        return trace_id_to_frame
+    with open(index_path, "r") as f:
+        for line in f:
+            fields = line.split()
+            # a line cut short by a crash is ignored, the frame scan picks the trace up again
+            if len(fields) != 3 or not line.endswith("\n"):
+                continue
+            trace_id_to_frame[fields[0]] = (int(fields[1]), int(fields[2]))
+    return trace_id_to_frame
+
+def load_index(archive_path: str, f) -> Tuple[Dict[str, Tuple[int, int]], int]:
+    # returns the index, completed with any frames missing from the index file, and the end of the last whole frame
+    trace_id_to_frame = read_index(archive_path + TRACE_ARCHIVE_INDEX_SUFFIX)
+    end = max((offset + length for offset, length in trace_id_to_frame.values()), default=0)
+    for trace_id, offset, length in scan_frames(f, end):
+        trace_id_to_frame[trace_id] = (offset, length)
+        end = offset + length
+    return trace_id_to_frame, end
+
+def decode_frame(frame: bytes) -> Tuple[str, str]:
+    magic, trace_id_length, payload_length = FRAME_HEADER.unpack_from(frame)
+    if magic != FRAME_MAGIC:
+        raise ValueError("Invalid trace archive frame")
+    trace_id = frame[FRAME_HEADER.size:FRAME_HEADER.size + trace_id_length].decode()
+    payload = frame[FRAME_HEADER.size + trace_id_length:FRAME_HEADER.size + trace_id_length + payload_length]
+    return trace_id, zlib.decompress(payload).decode()
+
+class TraceArchiveWriter:
+    # The only writer of an archive, enforced with an exclusive lock on the data file. Each
+    # append is flushed with its index line, a trace appended again replaces the earlier copy.
+    def __init__(self, archive_path: str):
+        self.archive_path = archive_path
+        self.num_appended = 0
+        self.__file = open(archive_path, "a+b")
+        try:
+            fcntl.flock(self.__file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.__file.close()
+            raise RuntimeError(f"Trace archive [{archive_path}] is already open for writing")
+
+        self.__trace_id_to_frame, end = load_index(archive_path, self.__file)
+        # drop a frame cut short by a crash so new frames stay aligned, and rewrite the index
+        # so it covers every frame and carries no half written line
+        self.__file.truncate(end)
+        index_path = archive_path + TRACE_ARCHIVE_INDEX_SUFFIX
+        with open(f"{index_path}.tmp", "w") as f:
+            for trace_id, (offset, length) in sorted(self.__trace_id_to_frame.items(), key=lambda item: item[1][0]):
+                f.write(f"{trace_id} {offset} {length}\n")
+        os.replace(f"{index_path}.tmp", index_path)
+        self.__index_file = open(index_path, "a")
+
+    def __contains__(self, trace_id: str) -> bool:
+        return trace_id in self.__trace_id_to_frame
+
+    def __len__(self) -> int:
+        return len(self.__trace_id_to_frame)
+
+    def append(self, trace_id: str, trace_text: str) -> None:
+        encoded_trace_id = str(trace_id).encode()
+        payload = zlib.compress(trace_text.encode(), TRACE_ARCHIVE_COMPRESSION_LEVEL)
+        frame = FRAME_HEADER.pack(FRAME_MAGIC, len(encoded_trace_id), len(payload)) + encoded_trace_id + payload
+
+        self.__file.seek(0, os.SEEK_END)
+        offset = self.__file.tell()
+        self.__file.write(frame)
+        self.__file.flush()
+        self.__index_file.write(f"{trace_id} {offset} {len(frame)}\n")
+        self.__index_file.flush()
+        self.__trace_id_to_frame[str(trace_id)] = (offset, len(frame))
+        self.num_appended += 1
+
+    def close(self) -> None:
+        if self.__file.closed:
+            return
+        self.__index_file.close()
+        fcntl.flock(self.__file.fileno(), fcntl.LOCK_UN)
+        self.__file.close()
+
+    def __enter__(self) -> "TraceArchiveWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return f"TraceArchiveWriter(archive_path={self.archive_path}, " \
+            f"num_traces={len(self.__trace_id_to_frame)}, " \
+            f"num_appended={self.num_appended})"
+
+class TraceArchive:
+    # Read only view of an archive, safe to open while the writer appends. Traces appended
+    # after opening are not visible until the archive is opened again.
+    def __init__(self, archive_path: str):
+        self.archive_path = archive_path
+        self.__file = open(archive_path, "rb")
+        self.__trace_id_to_frame, _ = load_index(archive_path, self.__file)
+
+    def __contains__(self, trace_id: str) -> bool:
+        return trace_id in self.__trace_id_to_frame
+
+    def __len__(self) -> int:
+        return len(self.__trace_id_to_frame)
+
+    def trace_ids(self) -> List[str]:
+        # in the order they were appended
+        return sorted(self.__trace_id_to_frame, key=lambda trace_id: self.__trace_id_to_frame[trace_id][0])
+
+    def get(self, trace_id: str) -> Optional[str]:
+        frame_location = self.__trace_id_to_frame.get(trace_id)
+        if frame_location is None:
+            return None
+        offset, length = frame_location
+        self.__file.seek(offset)
+        return decode_frame(self.__file.read(length))[1]
+
+    def iter_traces(self, trace_ids: Optional[List[str]] = None) -> Iterator[Tuple[str, str]]:
+        # yields (trace_id, trace_text), reading frames in file order
+        trace_ids = trace_ids if trace_ids is not None else self.trace_ids()
+        for trace_id in sorted(trace_ids, key=lambda trace_id: self.__trace_id_to_frame[trace_id][0]):
+            yield trace_id, self.get(trace_id)
+
+    def close(self) -> None:
+        self.__file.close()
+
+    def __enter__(self) -> "TraceArchive":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def __repr__(self):
+        return f"TraceArchive(archive_path={self.archive_path}, " \
+            f"num_traces={len(self.__trace_id_to_frame)})"
+
+archive_path_to_writer: Dict[str, TraceArchiveWriter] = {}
+
+def get_trace_archive_writer(archive_path: str) -> TraceArchiveWriter:
+    # one writer per archive for the whole process, closed at exit
+    if archive_path not in archive_path_to_writer:
+        archive_path_to_writer[archive_path] = TraceArchiveWriter(archive_path)
+    return archive_path_to_writer[archive_path]
+
+def close_trace_archive_writers() -> None:
+    for writer in archive_path_to_writer.values():
+        writer.close()
+    archive_path_to_writer.clear()
+
+atexit.register(close_trace_archive_writers)
@@ -0,0 +1,107 @@
+import os
+import re
+import tempfile
+from typing import Dict, Optional
+
+DEFAULT_TRACE_CACHE_MAX_MB = 1024
+# evict down to this fraction of max_bytes so eviction does not run on every put once full
+TRACE_CACHE_EVICTION_WATERMARK = 0.9
+TRACE_CACHE_FILE_SUFFIX = ".json"
+
+class TraceCache:
+    # On disk cache of Jaeger trace responses keyed by trace id. Entries are written
+    # atomically so a crash never leaves a partial trace behind, and the least recently
+    # used entries are evicted once the cache grows past max_bytes.
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.__trace_id_to_size: Dict[str, int] = {}
+        self.__total_bytes = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        for file in os.listdir(cache_dir):
+            file_path = os.path.join(cache_dir, file)
+            if file.endswith(".tmp"):
+                # left behind by a write that was interrupted
+                os.remove(file_path)
+            elif file.endswith(TRACE_CACHE_FILE_SUFFIX):
+                size = os.path.getsize(file_path)
+                self.__trace_id_to_size[file[:-len(TRACE_CACHE_FILE_SUFFIX)]] = size
+                self.__total_bytes += size
+
+        print(f"Trace cache [{cache_dir}] holds [{len(self.__trace_id_to_size)}] traces, [{self.__total_bytes / (1024 * 1024):.2f}] MB of [{max_bytes / (1024 * 1024):.2f}] MB")
+        self.__evict()
+
+    def __get_file_path(self, trace_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{trace_id}{TRACE_CACHE_FILE_SUFFIX}")
+
+    def __contains__(self, trace_id: str) -> bool:
+        return self.__is_valid_trace_id(trace_id) and trace_id in self.__trace_id_to_size
+
+    def get(self, trace_id: str) -> Optional[str]:
+        if trace_id not in self:
+            self.misses += 1
+            return None
+
+        file_path = self.__get_file_path(trace_id)
+        try:
+            with open(file_path, "r") as f:
+                trace_text = f.read()
+        except OSError:
+            self.__forget(trace_id)
+            self.misses += 1
+            return None
+
+        # bump the modification time so eviction treats this entry as recently used
+        os.utime(file_path)
+        self.hits += 1
+        return trace_text
+
+    def put(self, trace_id: str, trace_text: str) -> None:
+        if not self.__is_valid_trace_id(trace_id):
+            return
+
+        fd, tmp_file_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(trace_text)
+        os.replace(tmp_file_path, self.__get_file_path(trace_id))
+
+        self.__forget(trace_id)
+        size = os.path.getsize(self.__get_file_path(trace_id))
+        self.__trace_id_to_size[trace_id] = size
+        self.__total_bytes += size
+        self.__evict()
+
+    def __evict(self) -> None:
+        if self.__total_bytes <= self.max_bytes:
+            return
+
+        trace_id_to_mtime = {trace_id: os.path.getmtime(self.__get_file_path(trace_id)) for trace_id in self.__trace_id_to_size}
+        num_evicted = 0
+        for trace_id in sorted(trace_id_to_mtime, key=trace_id_to_mtime.get):
+            if self.__total_bytes <= self.max_bytes * TRACE_CACHE_EVICTION_WATERMARK:
+                break
+            try:
+                os.remove(self.__get_file_path(trace_id))
+            except FileNotFoundError:
+                pass
+            self.__forget(trace_id)
+            num_evicted += 1
+        print(f"Evicted [{num_evicted}] traces from trace cache [{self.cache_dir}]")
+
+    def __forget(self, trace_id: str) -> None:
+        self.__total_bytes -= self.__trace_id_to_size.pop(trace_id, 0)
+
+    @staticmethod
+    def __is_valid_trace_id(trace_id: str) -> bool:
+        return bool(re.fullmatch(r"[0-9A-Za-z]+", str(trace_id)))
+
+    def __repr__(self):
+        return f"TraceCache(cache_dir={self.cache_dir}, " \
+            f"max_bytes={self.max_bytes}, " \
+            f"num_traces={len(self.__trace_id_to_size)}, " \
+            f"total_bytes={self.__total_bytes}, " \
+            f"hits={self.hits}, " \
+            f"misses={self.misses})"
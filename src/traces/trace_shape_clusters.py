@@ -0,0 +1,69 @@
+import hashlib
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Tuple
+
+# Groups traces by the shape of their span tree so that traces doing the same work are
+# aligned with each other. The traces data CSV carries no parent span ids, so the tree of a
+# trace's spans in the container is rebuilt from time containment: spans sorted by start
+# time (longest first on ties) nest inside the closest earlier span that still covers them.
+# The shape is the pre-order of service/operation per node with the nesting, children in
+# start time order, hashed so traces can be bucketed by a short key.
+SHAPE_HASH_DIGEST_SIZE = 8
+DEFAULT_MIN_CLUSTER_TRACES = 10
+
+def get_trace_id_to_shape(traces_df: pd.DataFrame) -> Dict[str, str]:
+    # one linear pass over the spans after a single sort, every span is pushed and popped once
+    if traces_df.empty:
+        return {}
+    trace_codes, trace_ids = pd.factorize(traces_df["trace_id"])
+    service_codes, _ = pd.factorize(traces_df["service"], sort=True)
+    operation_codes, _ = pd.factorize(traces_df["operation"], sort=True)
+    start_times = traces_df["start_time"].to_numpy(dtype=np.int64)
+    end_times = traces_df["end_time"].to_numpy(dtype=np.int64)
+    # ties on start and end are broken by service and operation so the shape does not depend on row order
+    order = np.lexsort((operation_codes, service_codes, -end_times, start_times, trace_codes))
+
+    trace_code_list = trace_codes[order].tolist()
+    start_list = start_times[order].tolist()
+    end_list = end_times[order].tolist()
+    services = traces_df["service"].to_numpy(dtype=object)[order].tolist()
+    operations = traces_df["operation"].to_numpy(dtype=object)[order].tolist()
+
+    trace_id_to_shape: Dict[str, str] = {}
+    tokens: List[str] = []
+    open_span_ends: List[int] = []
+    for i in range(len(order)):
+        if i > 0 and trace_code_list[i] != trace_code_list[i - 1]:
+            trace_id_to_shape[trace_ids[trace_code_list[i - 1]]] = get_shape_hash(tokens)
+            tokens = []
+            open_span_ends = []
+        # close every open span that does not cover this one
+        while open_span_ends and (open_span_ends[-1] <= start_list[i] or open_span_ends[-1] < end_list[i]):
+            open_span_ends.pop()
+            tokens.append(")")
+        tokens.append(f"({services[i]}\x1f{operations[i]}")
+        open_span_ends.append(end_list[i])
+    trace_id_to_shape[trace_ids[trace_code_list[-1]]] = get_shape_hash(tokens)
+
+    return trace_id_to_shape
+
+def get_shape_hash(tokens: List[str]) -> str:
+    return hashlib.blake2b("".join(tokens).encode(), digest_size=SHAPE_HASH_DIGEST_SIZE).hexdigest()
+
+def get_shape_clusters(trace_id_to_shape: Dict[str, str], min_cluster_traces: int = DEFAULT_MIN_CLUSTER_TRACES) -> List[Tuple[str, List[str]]]:
+    # returns (shape, trace ids) of every cluster with at least min_cluster_traces traces, largest first
+    shape_to_trace_ids: Dict[str, List[str]] = {}
+    for trace_id, shape in trace_id_to_shape.items():
+        shape_to_trace_ids.setdefault(shape, []).append(trace_id)
+    if not shape_to_trace_ids:
+        print("No traces found to cluster by shape.")
+        return []
+
+    clusters = sorted(shape_to_trace_ids.items(), key=lambda cluster: (-len(cluster[1]), cluster[0]))
+    print(f"Trace shape clusters: [{len(clusters)}] shapes over [{len(trace_id_to_shape)}] traces, largest cluster sizes: {[len(trace_ids) for _, trace_ids in clusters[:10]]}")
+
+    kept_clusters = [cluster for cluster in clusters if len(cluster[1]) >= min_cluster_traces]
+    num_kept_traces = sum(len(trace_ids) for _, trace_ids in kept_clusters)
+    print(f"Using [{len(kept_clusters)}] shape clusters with at least [{min_cluster_traces}] traces, covering [{num_kept_traces}] of [{len(trace_id_to_shape)}] traces")
+    return kept_clusters
@@ -1,15 +1,49 @@
+import codecs
+import json
 import requests
+import time
 import pandas as pd
-from typing import Any, Dict, List
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from itertools import islice
+from requests.adapters import HTTPAdapter
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+import jaeger_grpc
+from critical_path import CriticalPathAggregator
 from span_data import SpanData
+from span_table import get_span_records_df
+from trace_archive import get_trace_archive_path, get_trace_archive_writer
+from trace_cache import TraceCache
 
 JAEGER_URL = "http://localhost:16686"
+JAEGER_GRPC_TARGET = "localhost:16685"
+# "http" uses the query JSON API under JAEGER_URL, "grpc" the api_v3 query service at JAEGER_GRPC_TARGET
+INGEST_BACKENDS = ["http", "grpc"]
+INGEST_BACKEND = "http"
 JAEGER_SERVICES_API_PATH = "/api/services"
 JAEGER_TRACES_API_PATH = "/api/traces"
+DEFAULT_FETCH_WORKERS = 8
+STREAM_CHUNK_SIZE = 64 * 1024
+MIN_SEARCH_WINDOW_US = 1000
+# traces whose spans are computed together by the span table engine
+SPAN_TABLE_BATCH_TRACES = 1000
 
-def get_trace_ids(service_name: str, limit: int) -> Dict[str, Any]:
-    url = f"{JAEGER_URL}{JAEGER_TRACES_API_PATH}"
+def get_search_params(service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    # search_params carries the optional Jaeger search filters, e.g. start/end in microseconds,
+    # operation, minDuration/maxDuration as duration strings like "500us"
     params = {"service": service_name, "limit": limit}
+    if search_params:
+        params.update({key: value for key, value in search_params.items() if value is not None})
+    return params
+
+def get_traces(service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    if INGEST_BACKEND == "grpc":
+        traces = list(jaeger_grpc.find_traces(JAEGER_GRPC_TARGET, service_name, limit, search_params))
+        print(f"[{len(traces)}] traces fetched successfully")
+        return traces
+
+    url = f"{JAEGER_URL}{JAEGER_TRACES_API_PATH}"
+    params = get_search_params(service_name, limit, search_params)
     
     try:
         print(f"Fetching traces from [{url}] with params [{params}]")
@@ -18,12 +52,157 @@ def get_trace_ids(service_name: str, limit: int) -> Dict[str, Any]:
     except requests.exceptions.HTTPError as err:
         raise err
     
-    traces = response.json().get("data", [])
+    traces = response.json().get("data", None) or []
+    print(f"[{len(traces)}] traces fetched successfully")
+    return traces
+
+def get_trace_ids(service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> List[str]:
+    traces = get_traces(service_name, limit, search_params)
     trace_ids = [trace.get("traceID", "unknown") for trace in traces]
     print(f"Trace IDs fetched successfully")
     return trace_ids
 
-def get_services() -> List[str]:
+def iter_traces_in_window(service_name: str, start_time: int, end_time: int, limit: int, page_limit: int, num_windows: int = 1,
+                          search_params: Optional[Dict[str, Any]] = None, stream: bool = False) -> Iterator[Dict[str, Any]]:
+    # pages through [start_time, end_time] (microseconds) in num_windows sub-windows, each
+    # queried with at most page_limit traces. A sub-window that comes back full may hold more
+    # traces than one query returns, so it is split in half and queried again until at most
+    # limit distinct traces have been yielded.
+    search_params = dict(search_params or {})
+    window_length = max(1, (end_time - start_time) // max(1, num_windows))
+    windows: Deque[Tuple[int, int]] = deque(
+        (window_start, min(end_time, window_start + window_length)) for window_start in range(start_time, end_time, window_length))
+    seen_trace_ids = set()
+
+    while windows and len(seen_trace_ids) < limit:
+        window_start, window_end = windows.popleft()
+        search_params.update({"start": window_start, "end": window_end})
+        if stream:
+            page = stream_traces(service_name, page_limit, search_params)
+        else:
+            page = get_traces(service_name, page_limit, search_params)
+
+        page_size = 0
+        for trace in page:
+            page_size += 1
+            trace_id = trace.get("traceID", "unknown")
+            if trace_id in seen_trace_ids or len(seen_trace_ids) >= limit:
+                continue
+            seen_trace_ids.add(trace_id)
+            yield trace
+
+        if page_size >= page_limit and window_end - window_start >= MIN_SEARCH_WINDOW_US * 2:
+            window_mid = (window_start + window_end) // 2
+            print(f"Window [{window_start} - {window_end}] returned [{page_size}] traces which is the page limit, splitting it")
+            windows.appendleft((window_mid, window_end))
+            windows.appendleft((window_start, window_mid))
+
+    print(f"[{len(seen_trace_ids)}] traces collected in window [{start_time} - {end_time}]")
+
+def iter_json_array_items(chunks: Iterable[bytes], array_key: str = "data") -> Iterator[Any]:
+    # incrementally decodes the top level object of a response body and yields the items
+    # of its array_key array one at a time, so only one item is held in memory at once
+    decoder = json.JSONDecoder()
+    utf8_decoder = codecs.getincrementaldecoder("utf-8")()
+    chunks_iter = iter(chunks)
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more() -> bool:
+        nonlocal buffer, pos, eof
+        if eof:
+            return False
+        chunk = next(chunks_iter, None)
+        if chunk is None:
+            eof = True
+            buffer = buffer[pos:] + utf8_decoder.decode(b"", final=True)
+        else:
+            buffer = buffer[pos:] + utf8_decoder.decode(chunk)
+        pos = 0
+        return True
+
+    def skip_whitespace() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer):
+                return buffer[pos]
+            if not read_more():
+                raise ValueError("Unexpected end of JSON stream")
+
+    def expect(token: str) -> None:
+        nonlocal pos
+        if skip_whitespace() != token:
+            raise ValueError(f"Expected [{token}] in JSON stream at [{buffer[pos:pos + 20]}]")
+        pos += 1
+
+    def decode_value() -> Any:
+        nonlocal pos
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, pos)
+                # a value ending at the buffer boundary could be a number cut in half
+                if end < len(buffer) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            read_more()
+
+    expect("{")
+    if skip_whitespace() == "}":
+        return
+    while True:
+        key = decode_value()
+        expect(":")
+        if key == array_key and skip_whitespace() == "[":
+            pos += 1
+            if skip_whitespace() == "]":
+                pos += 1
+            else:
+                while True:
+                    yield decode_value()
+                    if skip_whitespace() == ",":
+                        pos += 1
+                        continue
+                    expect("]")
+                    break
+        else:
+            decode_value()
+        if skip_whitespace() == ",":
+            pos += 1
+            continue
+        expect("}")
+        return
+
+def stream_traces(service_name: str, limit: int, search_params: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+    if INGEST_BACKEND == "grpc":
+        yield from jaeger_grpc.find_traces(JAEGER_GRPC_TARGET, service_name, limit, search_params)
+        return
+
+    url = f"{JAEGER_URL}{JAEGER_TRACES_API_PATH}"
+    params = get_search_params(service_name, limit, search_params)
+
+    try:
+        print(f"Streaming traces from [{url}] with params [{params}]")
+        response = requests.get(url, params=params, stream=True)
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as err:
+        raise err
+
+    with response:
+        yield from iter_json_array_items(response.iter_content(chunk_size=STREAM_CHUNK_SIZE))
+
+def get_services() -> Dict[str, Any]:
+    if INGEST_BACKEND == "grpc":
+        services = {"data": jaeger_grpc.get_services(JAEGER_GRPC_TARGET)}
+        print("Services fetched successfully [{}]".format(services))
+        return services
+
     url = f"{JAEGER_URL}{JAEGER_SERVICES_API_PATH}"
     
     try:
@@ -37,24 +216,96 @@ def get_services() -> List[str]:
     print("Services fetched successfully [{}]".format(services))
     return services
 
-def parse_and_save_traces(service_name_for_traces: str, data_dir_for_curr_run: str, trace_ids: List[Any], save_traces_json: bool) -> pd.DataFrame:
+def create_session(pool_size: int) -> requests.Session:
+    # keep-alive connections shared across fetch workers, one pooled connection per worker
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def fetch_trace(session: requests.Session, trace_id: str) -> str:
+    if INGEST_BACKEND == "grpc":
+        print(f"Fetching trace [{trace_id}] from gRPC [{JAEGER_GRPC_TARGET}]")
+        return jaeger_grpc.get_trace(JAEGER_GRPC_TARGET, trace_id)
+
+    url = f"{JAEGER_URL}{JAEGER_TRACES_API_PATH}/{trace_id}"
+
+    try:
+        print(f"Fetching trace from [{url}]")
+        response = session.get(url)
+        response.raise_for_status()
+    except requests.exceptions.HTTPError as err:
+        raise err
+
+    return response.text
+
+def fetch_traces(trace_ids: List[Any], num_workers: int, trace_cache: Optional[TraceCache] = None) -> Iterator[Tuple[str, str, bool]]:
+    # yields (trace_id, trace_text, is_cached) in the order of trace_ids with at most
+    # 2 * num_workers requests in flight, traces found in trace_cache are not fetched
+    num_workers = max(1, num_workers)
+    max_in_flight = 2 * num_workers
+    trace_ids_iter = iter(trace_ids)
+
+    with create_session(num_workers) as session, ThreadPoolExecutor(max_workers=num_workers) as executor:
+        def submit(trace_id: str) -> Tuple[str, Future, bool]:
+            future: Future = Future()
+            cached_trace_text = trace_cache.get(trace_id) if trace_cache is not None else None
+            if cached_trace_text is not None:
+                future.set_result(cached_trace_text)
+                return trace_id, future, True
+            return trace_id, executor.submit(fetch_trace, session, trace_id), False
+
+        in_flight: Deque[Tuple[str, Future, bool]] = deque()
+        for trace_id in islice(trace_ids_iter, max_in_flight):
+            in_flight.append(submit(trace_id))
+
+        while in_flight:
+            trace_id, future, is_cached = in_flight.popleft()
+            trace_text = future.result()
+            next_trace_id = next(trace_ids_iter, None)
+            if next_trace_id is not None:
+                in_flight.append(submit(next_trace_id))
+            yield trace_id, trace_text, is_cached
+
+def get_span_records(trace: Dict[str, Any]) -> List[Dict[str, Any]]:
     records = []
+    trace_id = trace.get("traceID", "unknown")
+
+    span_id_to_span_map: Dict[str, SpanData] = create_span_data_graph(trace)
+
+    for span_id, span in span_id_to_span_map.items():
+        span_non_idle_execution_time = span.get_non_idle_execution_time()
+
+        if span_non_idle_execution_time < 0:
+            print(f"[WARNING:] Non idle execution time is negative for span [{span_id}] in trace [{trace_id}], span details: [{span}]")
+
+        records.append({
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "service": span.service,
+            "operation": span.operation,
+            "start_time": span.start_time,
+            "end_time": span.end_time,
+            "duration": span.duration,
+            "non_idle_execution_time": span_non_idle_execution_time,
+            "non_idle_intervals": ";".join(f"{start}-{end}" for start, end in span.non_idle_intervals)
+        })
+
+    return records
+
+def parse_and_save_traces(service_name_for_traces: str, data_dir_for_curr_run: str, trace_ids: List[Any], save_traces_json: bool, num_workers: int = DEFAULT_FETCH_WORKERS, trace_cache: Optional[TraceCache] = None,
+                          critical_path_aggregator: Optional[CriticalPathAggregator] = None) -> pd.DataFrame:
+    traces_to_parse: List[Dict[str, Any]] = []
+    dfs: List[pd.DataFrame] = []
     num_traces = len(trace_ids)
     counter = 0
+    fetch_start_time = time.perf_counter()
 
-    for trace_id in trace_ids:
+    for trace_id, trace_text, is_cached in fetch_traces(trace_ids, num_workers, trace_cache):
         counter += 1
 
-        url = f"{JAEGER_URL}{JAEGER_TRACES_API_PATH}/{trace_id}"
-
-        try:
-            print(f"Fetching trace from [{url}]")
-            response = requests.get(url)
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as err:
-            raise err
-        
-        trace = response.json().get("data", None)
+        trace = json.loads(trace_text).get("data", None)
         if not trace:
             print(f"[WARNING:] Skipping trace [{trace_id}] due to missing data")
             continue
@@ -63,35 +314,106 @@ def parse_and_save_traces(service_name_for_traces: str, data_dir_for_curr_run: s
             print(f"[WARNING:] Skipping trace [{trace_id}] due to invalid data, expected 1 trace, got {len(trace)}")
             continue
 
+        # only well formed traces are cached so incomplete ones are fetched again on the next run
+        if trace_cache is not None and not is_cached:
+            trace_cache.put(trace_id, trace_text)
+
         trace = trace[0]
 
         trace_id = trace.get("traceID", "unknown")
         if save_traces_json:
-            save_trace_to_file(service_name_for_traces, data_dir_for_curr_run, trace_id, response.text)
+            save_trace_to_file(service_name_for_traces, data_dir_for_curr_run, trace_id, trace_text)
 
         print(f"[{counter}/{num_traces}] Parsing trace [{trace_id}]")
 
-        span_id_to_span_map: Dict[str, SpanData] = create_span_data_graph(trace)
+        traces_to_parse.append(trace)
+        if critical_path_aggregator is not None:
+            critical_path_aggregator.add_trace(create_span_data_graph(trace))
+        if len(traces_to_parse) >= SPAN_TABLE_BATCH_TRACES:
+            dfs.append(get_span_records_df(traces_to_parse))
+            traces_to_parse = []
+
+    dfs.append(get_span_records_df(traces_to_parse))
+
+    elapsed_time = time.perf_counter() - fetch_start_time
+    traces_per_second = counter / elapsed_time if elapsed_time > 0 else 0.0
+    print(f"Fetched and parsed [{counter}] traces in [{elapsed_time:.2f}s] with [{num_workers}] workers, throughput [{traces_per_second:.2f}] traces/s")
+    if trace_cache is not None:
+        print(f"Trace cache hits [{trace_cache.hits}] misses [{trace_cache.misses}]")
 
-        for span_id, span in span_id_to_span_map.items():
-            span_non_idle_execution_time = span.get_non_idle_execution_time()
+    return pd.concat(dfs, ignore_index=True)
 
-            if span_non_idle_execution_time < 0:
-                print(f"[WARNING:] Non idle execution time is negative for span [{span_id}] in trace [{trace_id}], span details: [{span}]")
+def is_complete_trace(trace: Dict[str, Any]) -> bool:
+    # search results can carry traces that are still being written or were cut short,
+    # treat those as incomplete so they get fetched again by trace id
+    if not trace.get("traceID") or trace.get("warnings"):
+        return False
 
-            records.append({
-                "trace_id": span.trace_id,
-                "span_id": span.span_id,
-                "service": span.service,
-                "operation": span.operation,
-                "start_time": span.start_time,
-                "end_time": span.end_time,
-                "duration": span.duration,
-                "non_idle_execution_time": span_non_idle_execution_time,
-                "non_idle_intervals": ";".join(f"{start}-{end}" for start, end in span.non_idle_intervals)
-            })
+    spans = trace.get("spans", [])
+    if not spans:
+        return False
 
-    return pd.DataFrame(records)
+    processes = trace.get("processes", {})
+    span_ids = set(span.get("spanID") for span in spans)
+    for span in spans:
+        if span.get("processID") not in processes:
+            return False
+        for reference in span.get("references", []):
+            if reference.get("refType", "") == "CHILD_OF" and reference.get("spanID") not in span_ids:
+                return False
+
+    return True
+
+def parse_and_save_traces_from_search(service_name_for_traces: str, data_dir_for_curr_run: str, traces: Iterable[Dict[str, Any]], save_traces_json: bool, num_workers: int = DEFAULT_FETCH_WORKERS, trace_cache: Optional[TraceCache] = None,
+                                      critical_path_aggregator: Optional[CriticalPathAggregator] = None) -> pd.DataFrame:
+    # traces can be a list or a generator such as stream_traces, so it is only iterated once
+    traces_to_parse: List[Dict[str, Any]] = []
+    dfs: List[pd.DataFrame] = []
+    counter = 0
+    trace_ids_to_refetch = []
+    parse_start_time = time.perf_counter()
+
+    for trace in traces:
+        counter += 1
+        trace_id = trace.get("traceID", "unknown")
+
+        if not is_complete_trace(trace):
+            print(f"[WARNING:] Trace [{trace_id}] in search response is truncated or invalid, fetching it by trace id")
+            trace_ids_to_refetch.append(trace_id)
+            continue
+
+        # the search response already holds the whole trace, so the cache is only filled here
+        # for later fetches by trace id, it cannot save downloading the search response
+        if save_traces_json or trace_cache is not None:
+            trace_text = json.dumps({"data": [trace]})
+            if save_traces_json:
+                save_trace_to_file(service_name_for_traces, data_dir_for_curr_run, trace_id, trace_text)
+            if trace_cache is not None:
+                trace_cache.put(trace_id, trace_text)
+
+        print(f"[{counter}] Parsing trace [{trace_id}] from search response")
+
+        traces_to_parse.append(trace)
+        if critical_path_aggregator is not None:
+            critical_path_aggregator.add_trace(create_span_data_graph(trace))
+        if len(traces_to_parse) >= SPAN_TABLE_BATCH_TRACES:
+            dfs.append(get_span_records_df(traces_to_parse))
+            traces_to_parse = []
+
+    dfs.append(get_span_records_df(traces_to_parse))
+
+    elapsed_time = time.perf_counter() - parse_start_time
+    num_parsed_traces = counter - len(trace_ids_to_refetch)
+    traces_per_second = num_parsed_traces / elapsed_time if elapsed_time > 0 else 0.0
+    print(f"Parsed [{num_parsed_traces}] traces from search response in [{elapsed_time:.2f}s], throughput [{traces_per_second:.2f}] traces/s")
+
+    df = pd.concat(dfs, ignore_index=True)
+    if trace_ids_to_refetch:
+        print(f"Fetching [{len(trace_ids_to_refetch)}] truncated or invalid traces by trace id")
+        refetched_df = parse_and_save_traces(service_name_for_traces, data_dir_for_curr_run, trace_ids_to_refetch, save_traces_json, num_workers, trace_cache, critical_path_aggregator)
+        df = pd.concat([df, refetched_df], ignore_index=True)
+
+    return df
 
 def create_span_data_graph(trace: Dict[str, Any]) -> Dict[str, SpanData]:
     trace_id = trace.get("traceID", "unknown")
@@ -130,7 +452,8 @@ def create_span_data_graph(trace: Dict[str, Any]) -> Dict[str, SpanData]:
     return span_id_to_span
 
 def save_trace_to_file(service_name_for_traces: str, data_dir_for_curr_run: str, trace_id: str, trace_text: str) -> None:
-    file_path = f"{data_dir_for_curr_run}/{service_name_for_traces}_{trace_id}.json"
-
-    with open(file_path, "w") as file:
-        file.write(trace_text)
\ No newline at end of file
+    # appended to the run's {service}_traces.archive instead of one JSON file per trace,
+    # traces already archived by an earlier pass over the same run are not written again
+    trace_archive_writer = get_trace_archive_writer(get_trace_archive_path(data_dir_for_curr_run, service_name_for_traces))
+    if trace_id not in trace_archive_writer:
+        trace_archive_writer.append(trace_id, trace_text)
@@ -0,0 +1,43 @@
+import os
+import sys
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../src/profile')))
+from trace_exemplars import EXEMPLAR_COLUMNS, get_exemplars_file_path, load_exemplar_tracker, update_run_exemplars
+
+def get_trace_exemplars_df(trace_id_prefix: str, num_traces: int, base_duration: int) -> pd.DataFrame:
+    return pd.DataFrame({
+        "trace_id": [f"{trace_id_prefix}{i}" for i in range(num_traces)],
+        "start_time": list(range(num_traces)),
+        "end_time": [i + 1 for i in range(num_traces)],
+        "non_idle_duration": [base_duration + i for i in range(num_traces)],
+        "llc_loads": [10.0] * num_traces,
+        "llc_misses": [1.0] * num_traces,
+        "instructions": [1000.0] * num_traces,
+        "mpki": [1.0] * num_traces,
+    }, columns=EXEMPLAR_COLUMNS[2:])
+
+def test_runs_of_same_config_are_all_added(tmp_path):
+    test_dir = str(tmp_path)
+    update_run_exemplars(test_dir, "c-text", "2026-01-01_00-00-00", "r1_cp2", "2", get_trace_exemplars_df("a", 10, 100), top_k=3, reservoir_size=50)
+    update_run_exemplars(test_dir, "c-text", "2026-01-01_01-00-00", "r1_cp2", "2", get_trace_exemplars_df("b", 10, 200), top_k=3, reservoir_size=50)
+
+    tracker = load_exemplar_tracker(get_exemplars_file_path(test_dir, "c-text", "2"))
+    assert tracker.runs == ["2026-01-01_00-00-00", "2026-01-01_01-00-00"]
+    assert tracker.run_to_config == {"2026-01-01_00-00-00": "r1_cp2", "2026-01-01_01-00-00": "r1_cp2"}
+    assert tracker.num_seen == 20
+
+    # the second run is slower, so it holds the top durations
+    top_exemplars = tracker.get_top_exemplars("non_idle_duration")
+    assert [exemplar["trace_id"] for exemplar in top_exemplars] == ["b9", "b8", "b7"]
+    assert all(exemplar["run"] == "2026-01-01_01-00-00" and exemplar["config"] == "r1_cp2" for exemplar in top_exemplars)
+    assert {exemplar["run"] for exemplar in tracker.get_typical_exemplars()} == {"2026-01-01_00-00-00", "2026-01-01_01-00-00"}
+
+def test_same_run_is_added_once(tmp_path):
+    test_dir = str(tmp_path)
+    for _ in range(2):
+        update_run_exemplars(test_dir, "c-text", "2026-01-01_00-00-00", "r1_cp2", "2", get_trace_exemplars_df("a", 10, 100))
+
+    tracker = load_exemplar_tracker(get_exemplars_file_path(test_dir, "c-text", "2"))
+    assert tracker.runs == ["2026-01-01_00-00-00"]
+    assert tracker.num_seen == 10